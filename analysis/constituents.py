@@ -0,0 +1,183 @@
+#!/home/elims/envs/py37/bin/python
+
+## This python holds the tidal constituents used by the harmonic analysis:
+## Doodson numbers, phase offsets and nodal corrections (Schureman's
+## conventions, as in the NOAA and t_tide tables), plus the astronomical
+## arguments needed to build a design matrix on any time axis.
+##
+## Nodal factors f and phase corrections u follow the approximations in
+## Pugh (1987) table 4.3 in terms of the lunar node longitude N, and
+## Schureman's formula for L2. Compound and shallow water constituents
+## take products / sums of their parents. Like t_tide, MF and MM are left
+## without nodal corrections, and minor constituents without their own
+## formula share their parent's.
+#########################################################################
+
+#####################################
+## Import packages
+#####################################
+import numpy, pandas
+
+#####################################
+## Define constants
+#####################################
+# Mean longitudes (deg) at J2000 and rates (deg / Julian century) of the
+# moon (s), sun (h), lunar perigee (p), lunar node (N) and perihelion (p1).
+j2000 = pandas.Timestamp ('2000-01-01 12:00:00')
+astro_coeffs = {'s' :[218.3164477, 481267.88123421, -0.0015786],
+                'h' :[280.46646  ,  36000.76983   ,  0.0003032],
+                'p' :[ 83.3532465,   4069.0137287 , -0.0103200],
+                'N' :[125.04452  ,  -1934.136261  ,  0.0020708],
+                'p1':[282.93735  ,      1.71946   ,  0.00046  ]}
+hours_per_century = 36525. * 24.
+
+# name: (Doodson numbers on tau, s, h, p, N', p1; offset in degrees;
+#        nodal parents with their powers). Listed by priority: when two
+#        constituents cannot be resolved, the one listed first is kept.
+constituent_table = {
+    'M2'  :((2, 0, 0, 0, 0, 0),    0, {'M2':1}),
+    'S2'  :((2, 2,-2, 0, 0, 0),    0, {}),
+    'N2'  :((2,-1, 0, 1, 0, 0),    0, {'M2':1}),
+    'K1'  :((1, 1, 0, 0, 0, 0),  -90, {'K1':1}),
+    'O1'  :((1,-1, 0, 0, 0, 0),   90, {'O1':1}),
+    'M4'  :((4, 0, 0, 0, 0, 0),    0, {'M2':2}),
+    'K2'  :((2, 2, 0, 0, 0, 0),    0, {'K2':1}),
+    'P1'  :((1, 1,-2, 0, 0, 0),   90, {}),
+    'Q1'  :((1,-2, 0, 1, 0, 0),   90, {'O1':1}),
+    'M6'  :((6, 0, 0, 0, 0, 0),    0, {'M2':3}),
+    'MS4' :((4, 2,-2, 0, 0, 0),    0, {'M2':1}),
+    'MN4' :((4,-1, 0, 1, 0, 0),    0, {'M2':2}),
+    'NU2' :((2,-1, 2,-1, 0, 0),    0, {'M2':1}),
+    'MU2' :((2,-2, 2, 0, 0, 0),    0, {'M2':1}),
+    '2N2' :((2,-2, 0, 2, 0, 0),    0, {'M2':1}),
+    'L2'  :((2, 1, 0,-1, 0, 0),  180, {'L2':1}),
+    'LDA2':((2, 1,-2, 1, 0, 0),  180, {'M2':1}),
+    'T2'  :((2, 2,-3, 0, 0, 1),    0, {}),
+    'R2'  :((2, 2,-1, 0, 0,-1),  180, {}),
+    'J1'  :((1, 2, 0,-1, 0, 0),  -90, {'J1':1}),
+    'OO1' :((1, 3, 0, 0, 0, 0),  -90, {'OO1':1}),
+    'RHO1':((1,-2, 2,-1, 0, 0),   90, {'O1':1}),
+    '2Q1' :((1,-3, 0, 2, 0, 0),   90, {'O1':1}),
+    'M3'  :((3, 0, 0, 0, 0, 0),    0, {'M2':1.5}),
+    'MK3' :((3, 1, 0, 0, 0, 0),  -90, {'M2':1, 'K1':1}),
+    '2MK3':((3,-1, 0, 0, 0, 0),   90, {'M2':2, 'K1':-1}),
+    '2MS6':((6, 2,-2, 0, 0, 0),    0, {'M2':2}),
+    'S4'  :((4, 4,-4, 0, 0, 0),    0, {}),
+    'S6'  :((6, 6,-6, 0, 0, 0),    0, {}),
+    'M8'  :((8, 0, 0, 0, 0, 0),    0, {'M2':4}),
+    'MF'  :((0, 2, 0, 0, 0, 0),    0, {}),
+    'MM'  :((0, 1, 0,-1, 0, 0),    0, {}),
+    'MSF' :((0, 2,-2, 0, 0, 0),    0, {'M2':-1}),
+    'SSA' :((0, 0, 2, 0, 0, 0),    0, {}),
+    'SA'  :((0, 0, 1, 0, 0,-1),    0, {}),
+}
+
+# f = sum of a_k cos (kN); u = sum of b_k sin (kN) in degrees, k = 0..3
+nodal_coeffs = {'M2' :([1.0004, -0.0373,  0.0002,  0.0000], [0, - 2.14,  0.00,  0.00]),
+                'K1' :([1.0060,  0.1150, -0.0088,  0.0006], [0, - 8.86,  0.68, -0.07]),
+                'O1' :([1.0089,  0.1871, -0.0147,  0.0014], [0,  10.80, -1.34,  0.19]),
+                'K2' :([1.0241,  0.2863,  0.0083, -0.0015], [0, -17.74,  0.68, -0.04]),
+                'J1' :([1.0129,  0.1676, -0.0170,  0.0016], [0, -12.94,  1.34, -0.19]),
+                'OO1':([1.1027,  0.6504,  0.0317, -0.0014], [0, -36.68,  4.02, -0.57])}
+
+# Obliquity of the ecliptic and inclination of the lunar orbit (deg)
+obliquity, inclination = 23.452, 5.145
+
+#####################################
+## Define functions
+#####################################
+to_hours = lambda times: (pandas.DatetimeIndex (times) - j2000).total_seconds ().values / 3600.
+
+def get_speeds (names):
+
+    # Angular speeds in deg / hour from the rates of the Doodson variables
+    rates = {key:coeffs[1] / hours_per_century for key, coeffs in astro_coeffs.items ()}
+    variable_rates = numpy.array ([15. + rates['h'] - rates['s'], rates['s'], rates['h'],
+                                   rates['p'], -rates['N'], rates['p1']])
+    doodsons = numpy.array ([constituent_table[name][0] for name in names], dtype=float)
+    return doodsons.dot (variable_rates)
+
+def get_frequencies (names):
+
+    # cycles / hour, as in the t_tide tables
+    return get_speeds (names) / 360.
+
+def get_astro_arguments (hours):
+
+    # Doodson variables (deg) at hours since J2000: tau, s, h, p, N', p1
+    hours = numpy.atleast_1d (numpy.asarray (hours, dtype=float))
+    centuries = hours / hours_per_century
+    variables = {key:coeffs[0] + coeffs[1] * centuries + coeffs[2] * centuries**2
+                 for key, coeffs in astro_coeffs.items ()}
+
+    # Lunar time = mean solar time (180 deg at UT midnight) + h - s
+    solar_time = 180. + 15. * numpy.mod (hours + 12., 24.)
+    tau = solar_time + variables['h'] - variables['s']
+    return numpy.stack ([tau, variables['s'], variables['h'], variables['p'],
+                         -variables['N'], variables['p1']], axis=-1)
+
+def get_nodal_corrections (hours, names):
+
+    # f (-) and u (deg) of each constituent, shaped (ntime, nconsti)
+    hours = numpy.atleast_1d (numpy.asarray (hours, dtype=float))
+    centuries = hours / hours_per_century
+    node = numpy.radians (numpy.polyval (astro_coeffs['N'][::-1], centuries))
+
+    base_f, base_u = {}, {}
+    for parent, (fcoeffs, ucoeffs) in nodal_coeffs.items ():
+        base_f[parent] = sum (a * numpy.cos (k * node) for k, a in enumerate (fcoeffs))
+        base_u[parent] = sum (b * numpy.sin (k * node) for k, b in enumerate (ucoeffs))
+
+    # L2 also depends on the lunar perigee (Schureman eqs. 197 and 214)
+    perigee = numpy.radians (numpy.polyval (astro_coeffs['p'][::-1], centuries))
+    omega, i = numpy.radians (obliquity), numpy.radians (inclination)
+    I = numpy.arccos (numpy.cos (omega) * numpy.cos (i) - numpy.sin (omega) * numpy.sin (i) * numpy.cos (node))
+    nu = numpy.arcsin (numpy.sin (i) * numpy.sin (node) / numpy.sin (I))
+    xi = node - 2 * numpy.arctan (0.64412 * numpy.tan (node / 2)) - nu
+    P = perigee - xi
+    tan2 = numpy.tan (I / 2)**2
+    base_f['L2'] = base_f['M2'] * numpy.sqrt (1 - 12 * tan2 * numpy.cos (2 * P) + 36 * tan2**2)
+    base_u['L2'] = base_u['M2'] - numpy.degrees (numpy.arctan2 (numpy.sin (2 * P),
+                                                  1 / (6 * tan2) - numpy.cos (2 * P)))
+
+    f = numpy.ones ((len (hours), len (names)))
+    u = numpy.zeros ((len (hours), len (names)))
+    for index, name in enumerate (names):
+        for parent, power in constituent_table[name][2].items ():
+            f[:, index] *= base_f[parent] ** abs (power)
+            u[:, index] += base_u[parent] * power
+    return f, u
+
+def get_arguments (hours, names):
+
+    # V + u (deg) and f of each constituent at each time
+    doodsons = numpy.array ([constituent_table[name][0] for name in names], dtype=float)
+    offsets = numpy.array ([constituent_table[name][1] for name in names], dtype=float)
+    V = get_astro_arguments (hours).dot (doodsons.T) + offsets
+    f, u = get_nodal_corrections (hours, names)
+    return numpy.mod (V + u, 360.), f
+
+def select_constituents (duration, names=None, rayleigh=1.):
+
+    # Keep constituents (by priority) whose frequencies are at least
+    # rayleigh / duration apart from all those already kept. duration is
+    # the record length in hours.
+    if names is None: names = list (constituent_table.keys ())
+    frequencies = get_frequencies (names)
+    resolution = rayleigh / duration
+
+    selected = []
+    for name, frequency in zip (names, frequencies):
+        kept = get_frequencies (selected) if len (selected) > 0 else numpy.array ([])
+        if numpy.all (numpy.abs (kept - frequency) >= resolution): selected.append (name)
+
+    # Output in frequency order like the t_tide tables
+    return sorted (selected, key=lambda name: get_frequencies ([name])[0])
+
+def design_matrix (hours, names):
+
+    # Columns: mean, then f cos (V+u) and f sin (V+u) of each constituent
+    arguments, f = get_arguments (hours, names)
+    arguments = numpy.radians (arguments)
+    return numpy.hstack ([numpy.ones ((len (arguments), 1)),
+                          f * numpy.cos (arguments), f * numpy.sin (arguments)])
@@ -0,0 +1,130 @@
+#!/home/elims/envs/py37/bin/python
+
+## This python performs harmonic analysis on many current time-series at
+## once. Each velocity is taken as a complex number w = u + i v (east,
+## north), and all stations or nodes on one time axis are solved with
+## one design (see design_cache.py) as a complex multi right-hand-side
+## least-squares problem. The complex coefficients a, b of each
+## constituent, w = a cos (V+u) + b sin (V+u), split into counter-rotating
+## components
+##
+##   w = W+ exp (i (V+u)) + W- exp (-i (V+u)),  W+ = (a - i b) / 2,  W- = (a + i b) / 2
+##
+## which give the tidal ellipse as in t_tide's ellipse tables:
+##
+##   major = |W+| + |W-|, minor = |W+| - |W-| (negative when clockwise),
+##   inclination = (arg W+ + arg W-) / 2, in [0, 180) deg counterclockwise
+##   from east, and phase = (arg W- - arg W+) / 2, the Greenwich phase lag
+##   (deg) of the current along the major axis in the inclination
+##   direction.
+##
+## Velocities and axes are in m/s. Errors are not estimated. Stores come
+## from the custodian scripts, which callers put on the path (see
+## run_t_tide.py).
+#########################################################################
+
+#####################################
+## Import packages
+#####################################
+import numpy, pandas
+import ofs_store
+from constituents import get_frequencies, select_constituents, to_hours
+from design_cache import get_design
+from harmonic_analysis import rayleigh
+
+#####################################
+## Define constants
+#####################################
+ellipse_keys = ['major', 'minor', 'inc', 'pha']
+
+#####################################
+## Define functions
+#####################################
+def to_ellipses (coefs):
+
+    # coefs: complex (1 + 2*nconsti, ...) of [mean, a, b]
+    nconsti = (len (coefs) - 1) // 2
+    a, b = coefs[1:1+nconsti], coefs[1+nconsti:]
+    wplus, wminus = (a - 1j * b) / 2., (a + 1j * b) / 2.
+    major = numpy.abs (wplus) + numpy.abs (wminus)
+    minor = numpy.abs (wplus) - numpy.abs (wminus)
+
+    # Inclination and phase are defined up to a half turn together
+    inc = (numpy.angle (wplus) + numpy.angle (wminus)) / 2.
+    pha = (numpy.angle (wminus) - numpy.angle (wplus)) / 2.
+    is_flipped = inc < 0
+    inc, pha = numpy.where (is_flipped, inc + numpy.pi, inc), numpy.where (is_flipped, pha + numpy.pi, pha)
+    return {'major':major, 'minor':minor, 'inc':numpy.mod (numpy.degrees (inc), 180.),
+            'pha':numpy.mod (numpy.degrees (pha), 360.)}
+
+def fit_currents (hours, u, v, names, latitude=None, cache_path=None):
+
+    # u, v: (ntime, nstation) east / north on the same time axis. A sample
+    # is used only where both components are there; columns with gaps are
+    # solved together with the other columns that share the same gaps.
+    values = numpy.asarray (u, dtype=float) + 1j * numpy.asarray (v, dtype=float)
+    if values.ndim == 1: values = values[:, None]
+    nstation = values.shape[1]
+    design = get_design (hours, names, latitude=latitude, cache_path=cache_path)
+    X = design.X
+
+    coefs = numpy.full ((X.shape[1], nstation), numpy.nan, dtype=complex)
+    is_finite = numpy.isfinite (values)
+    patterns, groups = numpy.unique (is_finite.T, axis=0, return_inverse=True)
+    for group, is_good in enumerate (patterns):
+        columns = numpy.where (groups.ravel () == group)[0]
+        if is_good.sum () <= X.shape[1]: continue
+        coefs[:, columns] = design.solve (values[is_good][:, columns], is_good=is_good)[0]
+
+    results = {'names':list (names), 'freq':get_frequencies (names),
+               'mean_u':coefs[0].real, 'mean_v':coefs[0].imag}
+    results.update (to_ellipses (coefs))
+    return results
+
+def to_table (results, stations):
+
+    # Tidy table: constituent x station, flattened in that order
+    nconsti, nstation = len (results['names']), len (stations)
+    shape = (nconsti, nstation)
+    table = {'station':numpy.broadcast_to (numpy.asarray (stations)[None, :], shape),
+             'tide':numpy.broadcast_to (numpy.asarray (results['names'])[:, None], shape),
+             'freq':numpy.broadcast_to (numpy.asarray (results['freq'])[:, None], shape)}
+    table.update ({key:results[key] for key in ellipse_keys})
+    return pandas.DataFrame ({key:numpy.asarray (value).ravel () for key, value in table.items ()})
+
+def current_analysis (u_dataframe, v_dataframe, names=None, latitude=None, cache_path=None):
+
+    # u_dataframe / v_dataframe: east / north time-series with the same
+    # datetime index and one column per station
+    hours = to_hours (u_dataframe.index)
+    if names is None: names = select_constituents (hours[-1] - hours[0], rayleigh=rayleigh)
+    results = fit_currents (hours, u_dataframe.values, v_dataframe[u_dataframe.columns].values, names,
+                            latitude=latitude, cache_path=cache_path)
+    return to_table (results, list (u_dataframe.columns))
+
+def analyze_station_currents (currents_file, names=None, cache_path=None):
+
+    # Ellipses of every station in a currents store (see ofs_store.py)
+    u = ofs_store.read_heights (currents_file, name='u').to_dataframe (columns='node')
+    v = ofs_store.read_heights (currents_file, name='v').to_dataframe (columns='node')
+    return current_analysis (u, v, names=names, cache_path=cache_path)
+
+def analyze_field_currents (fields_file, names=None, nodes_per_block=None, cache_path=None):
+
+    # Ellipses of every wet node of a fields store holding "u" / "v",
+    # (nconsti, nnode) each, a block of nodes at a time. Every block shares
+    # the design of the store's time axis.
+    hours = to_hours (ofs_store.read_times (fields_file))
+    if names is None: names = select_constituents (hours[-1] - hours[0], rayleigh=rayleigh)
+    nnode = len (ofs_store.read_nodes (fields_file))
+
+    results = {key:numpy.full ((len (names), nnode), numpy.nan) for key in ellipse_keys}
+    results.update ({'mean_u':numpy.full (nnode, numpy.nan), 'mean_v':numpy.full (nnode, numpy.nan)})
+    blocks = zip (ofs_store.iter_node_blocks (fields_file, name='u', nodes_per_block=nodes_per_block),
+                  ofs_store.iter_node_blocks (fields_file, name='v', nodes_per_block=nodes_per_block))
+    for (nodes, u), (_, v) in blocks:
+        block = fit_currents (hours, u.T, v.T, names, cache_path=cache_path)
+        for key in ellipse_keys + ['mean_u', 'mean_v']: results[key][..., nodes] = block[key]
+
+    results.update ({'names':list (names), 'freq':get_frequencies (names)})
+    return results
@@ -0,0 +1,169 @@
+#!/home/elims/envs/py37/bin/python
+
+## This python precomputes what a harmonic analysis needs on a given time
+## axis and constituent list: the nodal factors f and arguments V+u, the
+## design matrix X (mean, f cos (V+u), f sin (V+u)), the normal equations
+## X^T X and their Cholesky factor. These are the same for every station,
+## for the ofs and coops passes and for reruns on the same record, so a
+## design is kept in memory and on disk keyed by the time axis, the
+## constituents and the latitude:
+##
+##   <cachePath>/ha_design_<key>.h5
+##     /hours, /f, /arguments (V+u; deg), /X, /gram, /cholesky,
+##     /unscaled ((X^T X)^-1)
+##     attributes: names, latitude
+##
+## The nodal approximations in constituents.py do not depend on latitude,
+## so callers without a latitude (None) share one design for all
+## stations; the key keeps them apart once latitude matters.
+##
+## Series with gaps reuse the full normal equations minus the rows they
+## miss, instead of building a new matrix.
+##
+## Only the normal equations and their factors stay in memory between
+## calls; X (time x parameter, ~50 MB for a year of 6-minute data) is
+## rebuilt by each design that needs it and freed with it.
+#########################################################################
+
+#####################################
+## Import packages
+#####################################
+import numpy, h5py, hashlib, os
+from constituents import get_arguments
+
+#####################################
+## Define constants
+#####################################
+# Default folder of the on-disk designs; None keeps them in memory only
+cachePath = None
+
+# Normal equations (and factors) of designs kept in memory by one process
+n_designs_in_memory = 8
+
+# Bump when the contents of a design change
+cache_version = 1
+
+# Arrays of a design, as stored on disk, and those kept in memory
+design_arrays = ['hours', 'f', 'arguments', 'X', 'gram', 'cholesky', 'unscaled']
+factor_arrays = ['gram', 'cholesky', 'unscaled']
+
+#####################################
+## Define functions
+#####################################
+_factors = {}
+
+def get_key (hours, names, latitude=None):
+
+    # Hash of the exact time axis, the ordered constituents and the latitude
+    digest = hashlib.sha1 ()
+    digest.update (numpy.ascontiguousarray (hours, dtype=numpy.float64).tobytes ())
+    digest.update (','.join (names).encode ())
+    digest.update ('{0}|{1}'.format (None if latitude is None else round (float (latitude), 4),
+                                     cache_version).encode ())
+    return digest.hexdigest ()
+
+def cho_solve (cholesky, rhs):
+
+    # (L L^T) x = rhs with the lower triangular L
+    return numpy.linalg.solve (cholesky.T, numpy.linalg.solve (cholesky, rhs))
+
+class Design (object):
+
+    def __init__ (self, hours, names, latitude=None, f=None, arguments=None, X=None, gram=None,
+                  cholesky=None, unscaled=None):
+
+        self.hours = numpy.asarray (hours, dtype=float)
+        self.names = list (names)
+        self.latitude = latitude
+
+        # Nodal factors and arguments (ntime, nconsti), and the design
+        # matrix; built on first use when not given
+        self.f, self.arguments, self._X = f, arguments, X
+
+        # Normal equations of the complete series, factorized once
+        if gram is None:
+            gram = self.X.T.dot (self.X)
+            cholesky = numpy.linalg.cholesky (gram)
+            unscaled = cho_solve (cholesky, numpy.eye (len (gram)))
+        self.gram, self.cholesky, self.unscaled = gram, cholesky, unscaled
+
+    @property
+    def X (self):
+
+        if self._X is None:
+            self.arguments, self.f = get_arguments (self.hours, self.names)
+            radians = numpy.radians (self.arguments)
+            self._X = numpy.hstack ([numpy.ones ((len (radians), 1)),
+                                     self.f * numpy.cos (radians), self.f * numpy.sin (radians)])
+        return self._X
+
+    def solve (self, values, is_good=None):
+
+        # Least-squares coefficients of values (ntime or ngood, ncolumn)
+        # and the unscaled covariance (X^T X)^-1 of the rows used
+        if is_good is None or is_good.all ():
+            return self.unscaled.dot (self.X.T.dot (values)), self.unscaled
+
+        # Remove the missing rows from the normal equations, or build
+        # them from the good rows when those are fewer
+        X = self.X[is_good]
+        if is_good.sum () * 2 < len (is_good):
+            gram = X.T.dot (X)
+        else:
+            missing = self.X[~is_good]
+            gram = self.gram - missing.T.dot (missing)
+        cholesky = numpy.linalg.cholesky (gram)
+        return cho_solve (cholesky, X.T.dot (values)), cho_solve (cholesky, numpy.eye (len (gram)))
+
+def get_design_file (key, cache_path):
+
+    return os.path.join (cache_path, 'ha_design_' + key + '.h5')
+
+def write_design (afile, design):
+
+    # Write into a temporary file and swap it in when complete; f and
+    # the arguments are there once X is built
+    design.X
+    with h5py.File (afile + '.tmp', 'w') as f:
+        for name in design_arrays:
+            f.create_dataset (name, data=getattr (design, name))
+        f.attrs['names'] = ','.join (design.names)
+        f.attrs['latitude'] = numpy.nan if design.latitude is None else design.latitude
+    os.replace (afile + '.tmp', afile)
+
+def read_design (afile):
+
+    with h5py.File (afile, 'r') as f:
+        arrays = {name:f[name][:] for name in design_arrays}
+        names = f.attrs['names'].split (',')
+        latitude = None if numpy.isnan (f.attrs['latitude']) else float (f.attrs['latitude'])
+    return Design (names=names, latitude=latitude, **arrays)
+
+def get_design (hours, names, latitude=None, cache_path=None):
+
+    # Normal equations from memory, else the design from disk, else
+    # computed (and saved)
+    if cache_path is None: cache_path = cachePath
+    key = get_key (hours, names, latitude=latitude)
+    if key in _factors: return Design (hours, names, latitude=latitude, **_factors[key])
+
+    afile = None if cache_path is None else get_design_file (key, cache_path)
+    if afile is not None and os.path.exists (afile):
+        try:
+            design = read_design (afile)
+        except (OSError, KeyError):
+            print ('Cannot read {0}; recomputing the design.'.format (afile))
+            design = None
+    else:
+        design = None
+
+    if design is None:
+        design = Design (hours, names, latitude=latitude)
+        if afile is not None:
+            if not os.path.exists (cache_path): os.makedirs (cache_path)
+            write_design (afile, design)
+
+    # Forget the oldest factors once too many are held
+    if len (_factors) >= n_designs_in_memory: _factors.pop (next (iter (_factors)))
+    _factors[key] = {name:getattr (design, name) for name in factor_arrays}
+    return design
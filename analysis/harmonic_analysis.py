@@ -0,0 +1,110 @@
+#!/home/elims/envs/py37/bin/python
+
+## This python performs harmonic analysis on many time-series at once.
+## All columns of ofs_preds.csv / coops_preds.csv share one time axis, so
+## one design matrix is factorized and solved for every station as a
+## multi right-hand-side least-squares problem, instead of one t_tide
+## call per station. The design and its factorized normal equations come
+## from design_cache.py, so they are built once per time axis and reused
+## across stations, the ofs / coops passes and reruns.
+##
+## Amplitudes are nodally corrected and phases are Greenwich phase lags
+## (deg), as in the t_tide tables. Errors are 95% confidence intervals
+## from the least-squares covariance assuming white residuals; t_tide's
+## default colored-noise bootstrap is not reproduced.
+#########################################################################
+
+#####################################
+## Import packages
+#####################################
+import numpy, pandas
+from constituents import get_frequencies, select_constituents, to_hours
+from design_cache import get_design
+
+#####################################
+## Define constants
+#####################################
+rayleigh = 1.
+confidence_factor = 1.96 # 95%
+
+#####################################
+## Define functions
+#####################################
+def fit_constituents (hours, values, names, latitude=None, cache_path=None):
+
+    # values: (ntime, nstation) on the same time axis. Columns with gaps are
+    # solved together with the other columns that share the same gaps.
+    values = numpy.asarray (values, dtype=float)
+    if values.ndim == 1: values = values[:, None]
+    ntime, nstation = values.shape
+    nconsti = len (names)
+    design = get_design (hours, names, latitude=latitude, cache_path=cache_path)
+    X = design.X
+
+    coefs = numpy.full ((X.shape[1], nstation), numpy.nan)
+    variances = numpy.full ((X.shape[1], nstation), numpy.nan)
+    covariances = numpy.full ((nconsti, nstation), numpy.nan)
+    percents = numpy.full (nstation, numpy.nan)
+
+    is_finite = numpy.isfinite (values)
+    patterns, groups = numpy.unique (is_finite.T, axis=0, return_inverse=True)
+    for group, is_good in enumerate (patterns):
+        columns = numpy.where (groups.ravel () == group)[0]
+        if is_good.sum () <= X.shape[1]: continue
+        subX, subvalues = X[is_good], values[is_good][:, columns]
+        subcoefs, unscaled = design.solve (subvalues, is_good=is_good)
+
+        # White-noise residual variance per station
+        residuals = subvalues - subX.dot (subcoefs)
+        sigma2 = (residuals**2).sum (axis=0) / (len (subvalues) - subX.shape[1])
+        coefs[:, columns] = subcoefs
+        variances[:, columns] = numpy.outer (numpy.diag (unscaled), sigma2)
+        covariances[:, columns] = numpy.outer (unscaled[1:1+nconsti, 1+nconsti:].diagonal (), sigma2)
+
+        # percent var predicted / var original
+        tides = subX[:, 1:].dot (subcoefs[1:])
+        percents[columns] = tides.var (axis=0) / subvalues.var (axis=0) * 100.
+
+    amps, amp_errs, phases, pha_errs = to_amp_phase (coefs, variances, covariances)
+    return {'names':list (names), 'freq':get_frequencies (names), 'mean':coefs[0],
+            'amp':amps, 'amp_err':amp_errs, 'pha':phases, 'pha_err':pha_errs,
+            'snr':(amps / amp_errs)**2, 'percent':percents}
+
+def to_amp_phase (coefs, variances, covariances):
+
+    # coefs / variances: (1 + 2*nconsti, ...) of [mean, a, b]; covariances:
+    # (nconsti, ...) between a and b. a cos (V+u) + b sin (V+u) = A cos (V+u-g)
+    nconsti = len (covariances)
+    a, b = coefs[1:1+nconsti], coefs[1+nconsti:]
+    var_a, var_b = variances[1:1+nconsti], variances[1+nconsti:]
+    amps = numpy.hypot (a, b)
+    phases = numpy.mod (numpy.degrees (numpy.arctan2 (b, a)), 360.)
+
+    # Linear error propagation to amplitude and phase
+    var_amp = (a**2 * var_a + b**2 * var_b + 2 * a * b * covariances) / amps**2
+    var_pha = (b**2 * var_a + a**2 * var_b - 2 * a * b * covariances) / amps**4
+    amp_errs = confidence_factor * numpy.sqrt (var_amp)
+    pha_errs = numpy.degrees (confidence_factor * numpy.sqrt (var_pha))
+    return amps, amp_errs, phases, pha_errs
+
+def to_tables (results, stations):
+
+    # Same layout as read_dat: one table per station and a percent per station
+    tables = {}
+    for index, station in enumerate (stations):
+        tables[station] = pandas.DataFrame ({'tide':results['names'], 'freq':results['freq'],
+                                             'amp':results['amp'][:, index],
+                                             'amp_err':results['amp_err'][:, index],
+                                             'pha':results['pha'][:, index],
+                                             'pha_err':results['pha_err'][:, index],
+                                             'snr':results['snr'][:, index]})
+    return pandas.Series (results['percent'], index=stations), tables
+
+def harmonic_analysis (dataframe, names=None, latitude=None, cache_path=None):
+
+    # dataframe: time-series with a datetime index, one column per station
+    hours = to_hours (dataframe.index)
+    if names is None: names = select_constituents (hours[-1] - hours[0], rayleigh=rayleigh)
+    results = fit_constituents (hours, dataframe.values, names, latitude=latitude,
+                                cache_path=cache_path)
+    return to_tables (results, list (dataframe.columns))
@@ -0,0 +1,363 @@
+#!/home/elims/envs/py37/bin/python
+
+## This python serves tide predictions at any point near the OFS stations
+## over HTTP. The harmonic constants of every OFS station (see
+## ofs_store.write_constants; --build fits them from the heights store)
+## and a spatial index of their coordinates stay in memory. A point's
+## constants are the inverse-distance blend of its n_neighbors nearest
+## stations, taken on the cos / sin coefficients so that phases blend
+## properly, and its water levels are synthesized from those.
+##
+##   GET  /predict?lat=38.98&lon=-76.48&begin=2020-01-01&end=2020-01-02[&interval=6]
+##        {"lat":..., "lon":..., "nodes":[...], "distances_km":[...],
+##         "times":["2020-01-01T00:00", ...], "heights":[...]}
+##   POST /predict/batch
+##        {"points":[{"lat":..., "lon":...}, ...], "begin":..., "end":..., "interval":6}
+##        {"times":[...], "points":[{"lat":..., "lon":..., "heights":[...]}, ...]}
+##   GET  /health
+##
+## Heights are in meters (MLLW), times in GMT and intervals in minutes.
+## Points, time windows and whole answers are kept in LRU caches, so a
+## hot location is answered without any trigonometry.
+##
+## Usage: prediction_service.py [--constants FILE] [--build] [--port N]
+##
+## The stores and the spatial index come from the custodian scripts; run
+## as a script, this puts them on the path, and importers do it themselves
+## (see run_t_tide.py).
+#########################################################################
+
+#####################################
+## Import packages
+#####################################
+import numpy, pandas, json, threading, sys, os, argparse
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qsl
+from constituents import to_hours
+from tide_prediction import get_basis
+
+#####################################
+## Define constants
+#####################################
+outpath = '/home/elims/projects/cbofs/outputs/'
+heightsFile = outpath + 'ofs_all_heights.h5'
+constantsFile = outpath + 'ofs_constants.h5'
+
+host = '127.0.0.1'
+port = 8765
+
+# Points further than max_distance_km from every OFS station get no answer
+n_neighbors = 3
+max_distance_km = 10.
+
+# Bounds on one request
+max_points = 1000
+max_times = 24 * 10 * 31
+default_interval = 6
+
+# Entries kept in each LRU cache
+n_cached_points = 4096
+n_cached_windows = 64
+n_cached_answers = 1024
+
+# Points closer than this (deg; ~1 m) share cache entries
+point_decimals = 5
+
+#####################################
+## Define functions
+#####################################
+class LRUCache (object):
+
+    # Least recently used entries are dropped first; safe across threads
+    def __init__ (self, size):
+
+        self.size = size
+        self.entries = OrderedDict ()
+        self.lock = threading.Lock ()
+        self.hits, self.misses = 0, 0
+
+    def get (self, key, make):
+
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end (key)
+                return self.entries[key]
+            self.misses += 1
+
+        # Made outside the lock; two threads may both make a missing entry
+        value = make ()
+        with self.lock:
+            self.entries[key] = value
+            while len (self.entries) > self.size: self.entries.popitem (last=False)
+        return value
+
+    def stats (self):
+
+        return {'entries':len (self.entries), 'hits':self.hits, 'misses':self.misses}
+
+class TidePredictor (object):
+
+    def __init__ (self, constants):
+
+        # constants: as from ofs_store.read_constants
+        import spatial_index
+        self.names = constants['names']
+        self.stations = constants['stations']
+        phases = numpy.radians (constants['pha'])
+        self.coefs = numpy.vstack ([constants['amp'] * numpy.cos (phases),
+                                    constants['amp'] * numpy.sin (phases)])
+        self.means = constants['mean']
+
+        # Stations without a fit are left out of the index
+        is_fitted = numpy.isfinite (self.coefs).all (axis=0) & numpy.isfinite (self.means)
+        lats = numpy.where (is_fitted, self.stations['lat'], numpy.nan)
+        lons = numpy.where (is_fitted, self.stations['lon'], numpy.nan)
+        self.node_index = spatial_index.NodeIndex (lats, lons)
+
+        self.points = LRUCache (n_cached_points)
+        self.windows = LRUCache (n_cached_windows)
+        self.answers = LRUCache (n_cached_answers)
+
+    def locate (self, lat, lon):
+
+        # Blended (2*nconsti + 1) coefficients (mean last), stations used
+        # and their distances (km); None if no station is close enough
+        distances, indices = self.node_index.query ([lat], [lon], k=n_neighbors,
+                                                    max_distance=max_distance_km)
+        distances, indices = distances[0], indices[0]
+        is_found = indices >= 0
+        if not is_found.any (): return None
+        distances, indices = distances[is_found], indices[is_found]
+
+        # A point on top of a station takes that station alone
+        if distances[0] < 1e-6:
+            weights = numpy.array ([1.])
+            distances, indices = distances[:1], indices[:1]
+        else:
+            weights = 1. / distances**2
+            weights /= weights.sum ()
+        coefs = numpy.r_[self.coefs[:, indices].dot (weights), self.means[indices].dot (weights)]
+        return coefs, indices, distances
+
+    def get_point (self, lat, lon):
+
+        key = (round (lat, point_decimals), round (lon, point_decimals))
+        return self.points.get (key, lambda: self.locate (*key))
+
+    def get_window (self, begin, end, interval):
+
+        # Times and their basis with a column of ones for the mean
+        def make ():
+            times = pandas.date_range (begin, end, freq='{0}min'.format (interval))
+            basis = get_basis (to_hours (times), self.names)
+            return times, numpy.hstack ([basis, numpy.ones ((len (times), 1))])
+        return self.windows.get ((begin, end, interval), make)
+
+    def predict (self, lat, lon, begin, end, interval):
+
+        key = (round (lat, point_decimals), round (lon, point_decimals), begin, end, interval)
+        def make ():
+            point = self.get_point (lat, lon)
+            if point is None: return None
+            times, basis = self.get_window (begin, end, interval)
+            return basis.dot (point[0]), point[1], point[2]
+        return self.answers.get (key, make)
+
+    def predict_batch (self, lats, lons, begin, end, interval):
+
+        # All points on one basis with one matrix product; None for
+        # points without a station nearby
+        points = [self.get_point (lat, lon) for lat, lon in zip (lats, lons)]
+        times, basis = self.get_window (begin, end, interval)
+        found = [index for index, point in enumerate (points) if point is not None]
+        heights = [None] * len (points)
+        if len (found) > 0:
+            values = basis.dot (numpy.stack ([points[index][0] for index in found], axis=1))
+            for column, index in enumerate (found): heights[index] = values[:, column]
+        return times, heights
+
+    def stats (self):
+
+        return {'stations':len (self.node_index.nodes), 'constituents':self.names,
+                'caches':{'points':self.points.stats (), 'windows':self.windows.stats (),
+                          'answers':self.answers.stats ()}}
+
+def parse_window (params):
+
+    # begin / end as 'YYYY-MM-DD[ HH:MM]' (GMT), interval in minutes. Times
+    # with a timezone are taken to GMT and made naive like the basis times.
+    begin, end = pandas.Timestamp (params['begin']), pandas.Timestamp (params['end'])
+    if pandas.isnull (begin) or pandas.isnull (end):
+        raise ValueError ('Need both begin and end times.')
+    begin, end = [time if time.tz is None else time.tz_convert (None) for time in (begin, end)]
+    interval = int (params.get ('interval', default_interval))
+    if interval <= 0 or end < begin:
+        raise ValueError ('Need begin <= end and a positive interval.')
+    if (end - begin) / pandas.Timedelta (minutes=interval) + 1 > max_times:
+        raise ValueError ('At most {0} times per request.'.format (max_times))
+    return begin, end, interval
+
+def parse_point (lat, lon):
+
+    # Finite latitude / longitude (deg) within +/- 90 / +/- 180
+    lat, lon = float (lat), float (lon)
+    if not (numpy.isfinite (lat) and numpy.isfinite (lon) and -90. <= lat <= 90. and -180. <= lon <= 180.):
+        raise ValueError ('Need finite lat / lon with -90 <= lat <= 90 and -180 <= lon <= 180.')
+    return lat, lon
+
+to_times = lambda times: [time.strftime ('%Y-%m-%dT%H:%M') for time in times]
+to_heights = lambda heights: numpy.round (heights, 4).tolist ()
+
+class PredictionHandler (BaseHTTPRequestHandler):
+
+    # The server carries the predictor (see serve)
+    def send_json (self, status, content):
+
+        body = json.dumps (content).encode ()
+        self.send_response (status)
+        self.send_header ('Content-Type', 'application/json')
+        self.send_header ('Content-Length', str (len (body)))
+        self.end_headers ()
+        self.wfile.write (body)
+
+    def do_GET (self):
+
+        url = urlsplit (self.path)
+        params = dict (parse_qsl (url.query))
+        predictor = self.server.predictor
+        if url.path == '/health':
+            self.send_json (200, predictor.stats ())
+            return
+        if url.path != '/predict':
+            self.send_json (404, {'error':'Unknown path {0}.'.format (url.path)})
+            return
+
+        try:
+            lat, lon = parse_point (params['lat'], params['lon'])
+            begin, end, interval = parse_window (params)
+        except (KeyError, ValueError, TypeError) as error:
+            self.send_json (400, {'error':'Bad request: {0}'.format (error)})
+            return
+
+        answer = predictor.predict (lat, lon, begin, end, interval)
+        if answer is None:
+            self.send_json (404, {'error':'No OFS station within {0} km.'.format (max_distance_km)})
+            return
+        heights, indices, distances = answer
+        times, _ = predictor.get_window (begin, end, interval)
+        self.send_json (200, {'lat':lat, 'lon':lon, 'nodes':predictor.stations['node'][indices].tolist (),
+                              'distances_km':numpy.round (distances, 3).tolist (),
+                              'times':to_times (times), 'heights':to_heights (heights)})
+
+    def do_POST (self):
+
+        url = urlsplit (self.path)
+        if url.path != '/predict/batch':
+            self.send_json (404, {'error':'Unknown path {0}.'.format (url.path)})
+            return
+
+        try:
+            request = json.loads (self.rfile.read (int (self.headers.get ('Content-Length', 0))))
+            points = request['points']
+            if len (points) > max_points:
+                raise ValueError ('At most {0} points per request.'.format (max_points))
+            points = [parse_point (point['lat'], point['lon']) for point in points]
+            lats = [lat for lat, _ in points]
+            lons = [lon for _, lon in points]
+            begin, end, interval = parse_window (request)
+        except (KeyError, ValueError, TypeError) as error:
+            self.send_json (400, {'error':'Bad request: {0}'.format (error)})
+            return
+
+        times, heights = self.server.predictor.predict_batch (lats, lons, begin, end, interval)
+        self.send_json (200, {'times':to_times (times),
+                              'points':[{'lat':lat, 'lon':lon,
+                                         'heights':None if values is None else to_heights (values)}
+                                        for lat, lon, values in zip (lats, lons, heights)]})
+
+    def log_message (self, format, *args):
+
+        # Keep the console quiet; one line per request is too much here
+        pass
+
+def build_constants (heights_file=None, constants_file=None, names=None, cache_path=None,
+                     screen=False):
+
+    # Fit every OFS station in the heights store and save the constants.
+    # With screen, constituents without energy are not fitted and flagged
+    # stations (see spectral_screening.py) are left without constants.
+    import ofs_store
+    from harmonic_analysis import fit_constituents, rayleigh
+    from constituents import select_constituents
+    if heights_file is None: heights_file = heightsFile
+    if constants_file is None: constants_file = constantsFile
+
+    is_good = None
+    if screen:
+        import spectral_screening
+        screening = spectral_screening.screen_heights (heights_file, names=names)
+        names = spectral_screening.prune_constituents (screening)
+        is_good = spectral_screening.is_good (screening)
+        print ('{0} constituents at {1} of {2} stations after screening'.format (
+               len (names), is_good.sum (), len (is_good)))
+
+    heights = ofs_store.read_heights (heights_file)
+    hours = to_hours (heights.times)
+    if names is None: names = select_constituents (hours[-1] - hours[0], rayleigh=rayleigh)
+    values = heights.values if is_good is None else heights.values[:, is_good]
+    results = fit_constituents (hours, values, names, cache_path=cache_path)
+
+    # Stations left out keep NaN constants, which the predictor skips
+    amps, phases, means = results['amp'], results['pha'], results['mean']
+    if is_good is not None:
+        shape = (len (names), len (is_good))
+        amps, phases, means = numpy.full (shape, numpy.nan), numpy.full (shape, numpy.nan), \
+                              numpy.full (len (is_good), numpy.nan)
+        amps[:, is_good], phases[:, is_good], means[is_good] = results['amp'], results['pha'], results['mean']
+    ofs_store.write_constants (constants_file, results['names'], amps, phases, means, heights.stations)
+    return constants_file
+
+def serve (constants_file=None, host_name=None, port_number=None):
+
+    import ofs_store
+    if constants_file is None: constants_file = constantsFile
+    if host_name is None: host_name = host
+    if port_number is None: port_number = port
+
+    server = ThreadingHTTPServer ((host_name, port_number), PredictionHandler)
+    server.predictor = TidePredictor (ofs_store.read_constants (constants_file))
+    print ('Serving {0} stations on http://{1}:{2}'.format (len (server.predictor.node_index.nodes),
+                                                           host_name, server.server_address[1]))
+    return server
+
+#####################################
+## Script starts here!
+#####################################
+
+if __name__ == '__main__':
+
+    # Shared with the custodian scripts
+    sys.path.append (os.path.join (os.path.dirname (os.path.abspath (__file__)), '..', 'custodian'))
+
+    parser = argparse.ArgumentParser (description='Serve OFS tide predictions at any point.')
+    parser.add_argument ('--constants', default=constantsFile, help='HDF5 file of harmonic constants')
+    parser.add_argument ('--heights', default=heightsFile, help='OFS heights store to fit with --build')
+    parser.add_argument ('--build', action='store_true', help='fit the constants first')
+    parser.add_argument ('--screen', action='store_true',
+                         help='with --build, only fit the constituents and stations that pass an FFT screening')
+    parser.add_argument ('--host', default=host)
+    parser.add_argument ('--port', type=int, default=port)
+    args = parser.parse_args ()
+
+    if args.build or not os.path.exists (args.constants):
+        build_constants (heights_file=args.heights, constants_file=args.constants, screen=args.screen)
+
+    server = serve (args.constants, host_name=args.host, port_number=args.port)
+    try:
+        server.serve_forever ()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close ()
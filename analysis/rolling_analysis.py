@@ -0,0 +1,179 @@
+#!/home/elims/envs/py37/bin/python
+
+## This python tracks harmonic constants over time: one least-squares fit
+## per window of days, either rolling (a fixed number of days) or
+## expanding (from the first day), stepped by whole days.
+##
+## Windows are not refitted from scratch. The normal equations are sums
+## over samples, so they are summed once per day,
+##
+##   X^T X and, per station, X^T y, y^T y and the number of good samples,
+##
+## and turned into running (prefix) sums over days. The normal equations
+## of any window are then the difference of two prefix sums. Stations
+## with gaps also keep, per day, the X^T X of the samples they miss, which
+## is taken off the window's X^T X; they are solved a chunk of stations at
+## a time to bound that memory. Each window costs one small batched solve
+## per group of stations, whatever its length.
+##
+## Amplitudes are nodally corrected and phases are Greenwich phase lags
+## (deg) with 95% errors, as in harmonic_analysis.py.
+#########################################################################
+
+#####################################
+## Import packages
+#####################################
+import numpy, pandas
+from constituents import select_constituents, to_hours
+from design_cache import get_design
+from harmonic_analysis import to_amp_phase, rayleigh
+
+#####################################
+## Define constants
+#####################################
+# Windows missing more than this fraction of samples are left as NaN
+min_coverage = 0.9
+
+# Bytes of the daily X^T X of missing samples held at once; stations with
+# gaps are solved in chunks that fit (1 year and 69 parameters take ~14
+# MB per station)
+max_missing_bytes = 512 * 1024**2
+
+#####################################
+## Define functions
+#####################################
+def get_day_starts (times):
+
+    # Row where each calendar day starts, plus the end of the record
+    days = pandas.DatetimeIndex (times).normalize ()
+    starts = numpy.r_[0, numpy.where (days[1:] != days[:-1])[0] + 1, len (days)]
+    return days[starts[:-1]], starts
+
+def get_daily_sums (X, values, starts):
+
+    # Normal equation terms of each day: X^T X, shared by all stations,
+    # and per station X^T y, y^T y and the number of good samples
+    ndays, nparam, nstation = len (starts) - 1, X.shape[1], values.shape[1]
+    is_good = numpy.isfinite (values)
+    filled = numpy.where (is_good, values, 0.)
+
+    sums = {'gram':numpy.zeros ((ndays, nparam, nparam)),
+            'rhs':numpy.zeros ((ndays, nparam, nstation)),
+            'yy':numpy.zeros ((ndays, nstation)),
+            'n':numpy.zeros ((ndays, nstation))}
+    for day in range (ndays):
+        rows = slice (starts[day], starts[day+1])
+        subX, subvalues = X[rows], filled[rows]
+        sums['gram'][day] = subX.T.dot (subX)
+        sums['rhs'][day] = subX.T.dot (subvalues)
+        sums['yy'][day] = (subvalues**2).sum (axis=0)
+        sums['n'][day] = is_good[rows].sum (axis=0)
+    return sums
+
+def to_prefix_sums (sums):
+
+    # prefix[key][d] is the sum over days [0, d)
+    return {key:numpy.concatenate ([numpy.zeros_like (value[:1]), numpy.cumsum (value, axis=0)])
+            for key, value in sums.items ()}
+
+def get_missing_prefix (X, is_good, starts):
+
+    # Prefix sums over days of the X^T X of the rows each station (column
+    # of is_good) misses, (ndays + 1, nstation, nparam, nparam), summed in
+    # place so that only one such array is held
+    ndays, nparam = len (starts) - 1, X.shape[1]
+    missing = numpy.zeros ((ndays + 1, is_good.shape[1], nparam, nparam))
+    for day in range (ndays):
+        rows = slice (starts[day], starts[day+1])
+        absent = ~is_good[rows]
+        if absent.any ():
+            missing[day+1] = numpy.einsum ('ts,tp,tq->spq', absent.astype (float), X[rows], X[rows],
+                                           optimize=True)
+        missing[day+1] += missing[day]
+    return missing
+
+def get_station_groups (is_good, counts, nrows, ndays, nparam):
+
+    # Complete stations first, then chunks of the stations with gaps that
+    # have at least one window with enough samples; the others stay NaN
+    is_gappy = ~is_good.all (axis=0)
+    is_fitted = (counts >= min_coverage * nrows[:, None]).any (axis=0)
+    gappy = numpy.where (is_gappy & is_fitted)[0]
+    nchunk = max (1, max_missing_bytes // ((ndays + 1) * nparam**2 * 8))
+    groups = [(numpy.where (~is_gappy)[0], False)]
+    groups += [(gappy[start:start+nchunk], True) for start in range (0, len (gappy), nchunk)]
+    return [(columns, has_gaps) for columns, has_gaps in groups if len (columns) > 0]
+
+def solve_window (prefix, columns, missing, begin, end, nrows):
+
+    # Coefficients, variances and a-b covariances of the stations in
+    # columns over days [begin, end); nrows is the number of samples in
+    # those days and missing the prefix sums of the X^T X they miss (None
+    # for complete stations)
+    gram = prefix['gram'][end] - prefix['gram'][begin]
+    rhs = (prefix['rhs'][end][:, columns] - prefix['rhs'][begin][:, columns]).T
+    yy = prefix['yy'][end][columns] - prefix['yy'][begin][columns]
+    n = prefix['n'][end][columns] - prefix['n'][begin][columns]
+    nstation, nparam = rhs.shape
+    nconsti = (nparam - 1) // 2
+
+    grams = numpy.repeat (gram[None, :, :], nstation, axis=0)
+    if missing is not None: grams -= missing[end] - missing[begin]
+
+    # Stations without enough samples are solved on a dummy system
+    is_valid = (n >= min_coverage * nrows) & (n > nparam)
+    grams[~is_valid] = numpy.eye (nparam)
+
+    inverses = numpy.linalg.inv (grams)
+    coefs = numpy.einsum ('spq,sq->sp', inverses, rhs)
+
+    # Residual sum of squares is y^T y - c^T X^T y at the least-squares c
+    sigma2 = (yy - (coefs * rhs).sum (axis=1)) / numpy.maximum (n - nparam, 1)
+    variances = numpy.diagonal (inverses, axis1=1, axis2=2) * sigma2[:, None]
+    covariances = numpy.diagonal (inverses[:, 1:1+nconsti, 1+nconsti:], axis1=1, axis2=2) * \
+                  sigma2[:, None]
+
+    coefs[~is_valid], variances[~is_valid], covariances[~is_valid] = numpy.nan, numpy.nan, numpy.nan
+    return coefs.T, variances.T, covariances.T, n
+
+def rolling_analysis (dataframe, names=None, window_days=29, step_days=1, expanding=False,
+                      latitude=None, cache_path=None):
+
+    # dataframe: time-series with a datetime index, one column per station.
+    # Returns one row per window end, station and constituent. With
+    # expanding windows, the first window is window_days long.
+    values = numpy.asarray (dataframe.values, dtype=float)
+    hours = to_hours (dataframe.index)
+    if names is None: names = select_constituents (window_days * 24., rayleigh=rayleigh)
+    design = get_design (hours, names, latitude=latitude, cache_path=cache_path)
+
+    days, starts = get_day_starts (dataframe.index)
+    prefix = to_prefix_sums (get_daily_sums (design.X, values, starts))
+
+    ends = numpy.arange (window_days, len (days) + 1, step_days)
+    begins = numpy.zeros_like (ends) if expanding else ends - window_days
+    nrows = starts[ends] - starts[begins]
+    nobs = (prefix['n'][ends] - prefix['n'][begins]).astype (int)
+
+    nconsti, nstation = len (names), values.shape[1]
+    results = {key:numpy.full ((len (ends), nconsti, nstation), numpy.nan)
+               for key in ['amp', 'amp_err', 'pha', 'pha_err']}
+    is_good = numpy.isfinite (values)
+    for columns, has_gaps in get_station_groups (is_good, nobs, nrows, len (days), design.X.shape[1]):
+        missing = get_missing_prefix (design.X, is_good[:, columns], starts) if has_gaps else None
+        for index, (begin, end) in enumerate (zip (begins, ends)):
+            coefs, variances, covariances, _ = solve_window (prefix, columns, missing, begin, end,
+                                                             nrows[index])
+            amps, amp_errs, phases, pha_errs = to_amp_phase (coefs, variances, covariances)
+            results['amp'][index][:, columns], results['amp_err'][index][:, columns] = amps, amp_errs
+            results['pha'][index][:, columns], results['pha_err'][index][:, columns] = phases, pha_errs
+
+    # Tidy table: window x constituent x station, flattened in that order
+    shape = (len (ends), nconsti, nstation)
+    table = {'begin':numpy.broadcast_to (numpy.asarray (days[begins])[:, None, None], shape),
+             'end':numpy.broadcast_to (numpy.asarray (days[ends - 1])[:, None, None], shape),
+             'station':numpy.broadcast_to (numpy.asarray (dataframe.columns)[None, None, :], shape),
+             'tide':numpy.broadcast_to (numpy.asarray (names)[None, :, None], shape),
+             'nobs':numpy.broadcast_to (nobs[:, None, :], shape)}
+    table.update (results)
+    return pandas.DataFrame ({key:value.ravel () for key, value in table.items ()})
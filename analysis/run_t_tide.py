@@ -9,15 +9,13 @@
 #####################################
 ## Import packages
 #####################################
-import pandas, numpy, glob, os
+import pandas, numpy, sys, os
+from harmonic_analysis import harmonic_analysis
+from t_tide_parser import load_tables
 
-import matplotlib
-matplotlib.use ('Agg')
-import matplotlib.pyplot as plt
-import matplotlib.gridspec as gridspec
-plt.rc ('text', usetex=False)
-plt.rc ('font', family='sans-serif')
-plt.rc ('font', serif='Computer Modern Roman')
+# Shared with the custodian scripts
+sys.path.append (os.path.join (os.path.dirname (os.path.abspath (__file__)), '..', 'custodian'))
+import run_report
 
 #####################################
 ## Define constants
@@ -27,77 +25,127 @@ plt.rc ('font', serif='Computer Modern Roman')
 #matlab.exe -nodisplay -nosplash -nodesktop -r "run('C:\\Users\\elim.thompson\\Documents\\ofsRD\\ofs-tide-prediction\\analysis\\run_t_tide.m');exit;"
 
 tTidePath = 'C:\\Users\\elim.thompson\\Documents\\ofsRD\\outputs\\t_tide\\'
+ofsFile = 'C:\\Users\\elim.thompson\\Documents\\ofsRD\\outputs\\ofs_preds.csv'
+coopsFile = 'C:\\Users\\elim.thompson\\Documents\\ofsRD\\outputs\\coops_preds.csv'
 outPath = 'C:\\Users\\elim.thompson\\Documents\\ofsRD\\outputs\\plots\\'
 
 constiNames = ['M2', 'S2', 'N2', 'K1', 'M4', 'O1']
+datColumns = ['tide', 'freq', 'amp', 'amp_err', 'pha', 'pha_err', 'snr']
+
+# Fit all stations in python instead of reading the MATLAB t_tide outputs.
+# Designs (nodal corrections, design matrix and normal equations) are
+# cached under haCachePath and reused by both passes and by reruns.
+runNativeHA = True
+haCachePath = os.path.join (outPath, 'ha_cache')
+
+# Screen both prediction sets with one FFT pass first (see
+# spectral_screening.py): only constituents with energy (plus constiNames)
+# are fitted, and flagged stations are left out. Per-station band
+# energies and flags go to screeningFile.
+screenConstituents = False
+screeningFile = outPath + 'screening.csv'
+
+# Drift of the constants: analyses over windows of each length (days),
+# stepped daily; expanding windows grow from the first day instead.
+# One tidy csv per window length.
+runRollingHA = False
+rollingWindowDays = [29, 365]
+rollingExpanding = False
+rollingFile = outPath + 'rolling_constants_{0}d.csv'
+
+# Tidal current ellipses of every station in the OFS currents store (see
+# custodian/ofs_massager.py, extract_currents), in one tidy csv
+runCurrentHA = False
+currentsFile = 'C:\\Users\\elim.thompson\\Documents\\ofsRD\\outputs\\ofs_all_currents.h5'
+ellipseFile = outPath + 'current_ellipses.csv'
+
+# Plots can be switched off, or all go into one multi-page PDF
+makePlots = True
+multipagePlots = False
+
+# Per-stage time / memory / IO report (see custodian/run_report.py). Set
+# profileStage to a stage name to also dump its cProfile stats.
+reportFile = outPath + 't_tide_report.json'
+profileStage = None
 
 #####################################
 ## Define functions
 #####################################
-extract_station = lambda afile: os.path.basename (afile).split ('.')[0].split ('_')[1][1:]
 extract_results = lambda data, col: {'ofs':extract (data['ofs'], col), 'coops':extract (data['coops'], col)}
 
-def gather_stations ():
-
-    coops_stations = numpy.array ([extract_station (afile) for afile in glob.glob (tTidePath + 'coops_*.dat')])
-    ofs_stations   = numpy.array ([extract_station (afile) for afile in glob.glob (tTidePath + 'ofs_*.dat')])
-    return ofs_stations[numpy.in1d (ofs_stations, coops_stations)]    
-
-def read_dat (station, predType):
-
-    with open (tTidePath + predType + '_x' + station + '.dat') as f:
-        content = f.readlines()
-    f.close ()
-
-    percent = None
-    for index, line in enumerate (content):
-        if line.strip().split (' ')[0] == 'percent':
-            percent = float ( line.strip().split (' ')[4])
-
-    table_start_index = -1
-    for index, line in enumerate (content):
-        if line.strip().split (' ')[0] == 'tide':
-            table_start_index = index
-    if table_start_index == -1:
-        print ('Cannot find table of results.')
-        return None
-    
-    content = content[table_start_index:]
-    content = numpy.array ([[value for value in line.strip().split (' ') if len (value.strip())>0 ] for line in content]).T
-    header = content[:, 0]
-    content = content[:, 1:]
-    content[0] = [aTide.replace ('*', '') for aTide in content[0]]
-    
-    adict = {}
-    for index, column in enumerate (header):
-        values = content[index, :] if index==0 else content[index, :].astype (float)
-        adict[column] = values
-
-    return percent, pandas.DataFrame (adict)
-
 def read_dats ():
 
-    stations = gather_stations ()
-
-    percents = {'ofs':{}, 'coops':{}}
-    data = {'ofs':{}, 'coops':{}}
-    for predType in data.keys ():
-        for station in stations:
-            percent, df = read_dat (station, predType)
-            percents[predType][station] = percent
-            if df is None: continue
-            data[predType][station] = df
-
-    stations = sorted (percents['ofs'])
-    percents_df = {'stations':stations,
-                   'ofs':[percents['ofs'][station] for station in stations],
-                   'coops':[percents['coops'][station] for station in stations]}
-    percents_df = pandas.DataFrame (percents_df)
-    percents_df.index = percents_df.stations
-    percents_df = percents_df.drop (axis=1, columns=['stations'])
+    # All .dat files come from one tidy table (see t_tide_parser.py), parsed
+    # in parallel and cached until the files change
+    table = load_tables (tTidePath)
+    stations = sorted (set (table.station[table.source == 'ofs']) &
+                       set (table.station[table.source == 'coops']))
+
+    percents, data = {}, {}
+    for predType in ['ofs', 'coops']:
+        subtable = table[(table.source == predType) & table.station.isin (stations)]
+        groups = dict (list (subtable.groupby ('station')))
+        percents[predType] = [groups[station].percent.values[0] for station in stations]
+        data[predType] = {station:groups[station][datColumns].reset_index (drop=True)
+                          for station in stations}
 
+    percents_df = pandas.DataFrame (percents, index=pandas.Index (stations, name='stations'))
     return percents_df, data
 
+def read_preds (afile):
+
+    dataframe = pandas.read_csv (afile)
+    dataframe.index = pandas.to_datetime (dataframe['datetime'])
+    return dataframe.drop (axis=1, columns=['datetime'])
+
+def screen_preds (preds):
+
+    # Drops flagged stations from preds in place; returns the constituents
+    # with energy in either prediction set
+    import spectral_screening
+    names, tables = [], []
+    for predType, dataframe in preds.items ():
+        results = spectral_screening.screen_dataframe (dataframe)
+        table = spectral_screening.to_table (results, dataframe.columns)
+        table.insert (0, 'source', predType)
+        tables.append (table)
+        names += spectral_screening.prune_constituents (results, keep=constiNames)
+        preds[predType] = dataframe.loc[:, spectral_screening.is_good (results)]
+    pandas.concat (tables).to_csv (screeningFile)
+
+    names = spectral_screening.sort_constituents (set (names))
+    print ('Fitting {0} screened constituents: {1}'.format (len (names), ' '.join (names)))
+    return names
+
+def fit_preds ():
+
+    # Same outputs as read_dats, from one batched fit per prediction type
+    preds = {predType:read_preds (afile) for predType, afile in [('ofs', ofsFile), ('coops', coopsFile)]}
+    names = screen_preds (preds) if screenConstituents else None
+
+    percents, data = {}, {}
+    for predType, dataframe in preds.items ():
+        percents[predType], data[predType] = harmonic_analysis (dataframe, names=names,
+                                                                cache_path=haCachePath)
+
+    stations = sorted (set (percents['ofs'].index) & set (percents['coops'].index))
+    percents_df = pandas.DataFrame ({predType:percent[stations] for predType, percent in percents.items ()})
+    data = {predType:{station:subdata[station] for station in stations}
+            for predType, subdata in data.items ()}
+    return percents_df, data
+
+def fit_rolling (window_days):
+
+    # Constants of constiNames per window end, station and source
+    from rolling_analysis import rolling_analysis
+    tables = []
+    for predType, afile in [('ofs', ofsFile), ('coops', coopsFile)]:
+        table = rolling_analysis (read_preds (afile), names=constiNames, window_days=window_days,
+                                  expanding=rollingExpanding, cache_path=haCachePath)
+        table.insert (0, 'source', predType)
+        tables.append (table)
+    return pandas.concat (tables, ignore_index=True)
+
 def extract (subdata, col):
 
     this_df = {station:df[col] for station, df in subdata.items()}
@@ -105,8 +153,26 @@ def extract (subdata, col):
     this_df.index = subdata[list (subdata.keys())[0]]['tide']
     return this_df
 
-def plot_percents (percents):
+def get_pyplot ():
 
+    # matplotlib is only imported (and set up) when plots are made
+    import matplotlib
+    matplotlib.use ('Agg')
+    import matplotlib.pyplot as plt
+    import matplotlib.gridspec as gridspec
+    plt.rc ('text', usetex=False)
+    plt.rc ('font', family='sans-serif')
+    plt.rc ('font', serif='Computer Modern Roman')
+    return plt, gridspec
+
+def save_plot (h, afile, pages=None):
+
+    if pages is None: h.savefig (afile)
+    else: pages.savefig (h)
+
+def plot_percents (percents, pages=None):
+
+    plt, gridspec = get_pyplot ()
     h = plt.figure (figsize=(7.5, 5))
     gs = gridspec.GridSpec (1, 1)
     gs.update (bottom=0.15)
@@ -138,12 +204,13 @@ def plot_percents (percents):
 
     ### Store plot as PDF
     plt.suptitle ('T-Tide percentage', fontsize=15)
-    h.savefig (outPath + 't_tide_percentage.pdf')
+    save_plot (h, outPath + 't_tide_percentage.pdf', pages=pages)
     plt.close ('all')
     return
 
-def plot_consti (constiName, df):
+def plot_consti (constiName, df, pages=None):
 
+    plt, gridspec = get_pyplot ()
     h = plt.figure (figsize=(7.5, 5))
     gs = gridspec.GridSpec (2, 1, wspace=0.1)
     gs.update (bottom=0.15)
@@ -208,7 +275,7 @@ def plot_consti (constiName, df):
 
     ### Store plot as PDF
     plt.suptitle ('T-Tide ' + constiName, fontsize=15)
-    h.savefig (outPath + 't_tide_' + constiName + '.pdf')
+    save_plot (h, outPath + 't_tide_' + constiName + '.pdf', pages=pages)
     plt.close ('all')
     return
 
@@ -217,8 +284,24 @@ def plot_consti (constiName, df):
 #####################################
 if __name__ == '__main__':
 
-    ## Step 1. Load T-Tide outputs
-    percents, data = read_dats ()
+    run_report.profile_stage = profileStage
+
+    ## Step 1. Load T-Tide outputs, or run the harmonic analysis here
+    with run_report.stage ('fit_preds' if runNativeHA else 'read_dats'):
+        percents, data = fit_preds () if runNativeHA else read_dats ()
+
+    ## Step 1b. Constants over rolling / expanding windows
+    if runRollingHA:
+        with run_report.stage ('rolling_ha'):
+            for window_days in rollingWindowDays:
+                fit_rolling (window_days).to_csv (rollingFile.format (window_days), index=False)
+
+    ## Step 1c. Tidal current ellipses
+    if runCurrentHA:
+        with run_report.stage ('current_ha'):
+            from current_analysis import analyze_station_currents
+            analyze_station_currents (currentsFile, names=constiNames,
+                                      cache_path=haCachePath).to_csv (ellipseFile, index=False)
 
     ## Step 2. Extract the amp / phases
     amps = extract_results (data, 'amp')
@@ -227,14 +310,25 @@ if __name__ == '__main__':
     phase_errs = extract_results (data, 'pha_err')
 
     ## Step 3. Plots
-    plot_percents (percents)
-    for constiName in constiNames:
-        adict = {'ofs_amps'  : amps['ofs'].loc[constiName,:], 
-                 'ofs_amp_errs': amp_errs['ofs'].loc[constiName,:],
-                 'coops_amps': amps['coops'].loc[constiName,:], 
-                 'coops_amp_errs': amp_errs['coops'].loc[constiName,:],
-                 'ofs_phases'  : phases['ofs'].loc[constiName,:],
-                 'ofs_phase_errs': phase_errs['ofs'].loc[constiName,:],
-                 'coops_phases': phases['coops'].loc[constiName,:],
-                 'coops_phase_errs': phase_errs['coops'].loc[constiName,:]}
-        plot_consti (constiName, pandas.DataFrame (adict))
+    if makePlots:
+        with run_report.stage ('plot'):
+            pages = None
+            if multipagePlots:
+                from matplotlib.backends.backend_pdf import PdfPages
+                pages = PdfPages (outPath + 't_tide_plots.pdf')
+
+            plot_percents (percents, pages=pages)
+            for constiName in constiNames:
+                adict = {'ofs_amps'  : amps['ofs'].loc[constiName,:], 
+                         'ofs_amp_errs': amp_errs['ofs'].loc[constiName,:],
+                         'coops_amps': amps['coops'].loc[constiName,:], 
+                         'coops_amp_errs': amp_errs['coops'].loc[constiName,:],
+                         'ofs_phases'  : phases['ofs'].loc[constiName,:],
+                         'ofs_phase_errs': phase_errs['ofs'].loc[constiName,:],
+                         'coops_phases': phases['coops'].loc[constiName,:],
+                         'coops_phase_errs': phase_errs['coops'].loc[constiName,:]}
+                plot_consti (constiName, pandas.DataFrame (adict), pages=pages)
+            if pages is not None: pages.close ()
+
+    run_report.write_report (reportFile)
+    run_report.print_report ()
@@ -0,0 +1,260 @@
+#!/home/elims/envs/py37/bin/python
+
+## This python screens many time-series with one batched FFT before any
+## harmonic fit. It tells which constituents carry energy and which
+## series look wrong, so that the least-squares fit only runs on the
+## constituents and nodes that matter.
+##
+## Each series is demeaned, its gaps are zero-filled and it is tapered
+## with a Blackman-Harris window. Its one-sided periodogram is scaled so
+## that the bins sum to the variance (m^2), making up for the window
+## energy lost in the gaps. From the periodogram come:
+##
+##   * the energy in each tidal band (long-period, diurnal, semidiurnal,
+##     ...) and above the highest band ("noise");
+##   * an amplitude estimate per candidate constituent, from the
+##     Hann-tapered transforms at the exact constituent frequencies,
+##     solved together so that leakage between them cancels;
+##   * flags for series that are gappy, flat (e.g. dried cells), carry
+##     too little tidal energy, or too much noise.
+##
+## Stores are read a block of series at a time, so memory is bounded by
+## one block whatever the number of nodes. The stores come from the
+## custodian scripts, which callers put on the path (see run_t_tide.py).
+#########################################################################
+
+#####################################
+## Import packages
+#####################################
+import numpy, pandas
+import ofs_store
+from constituents import get_frequencies, select_constituents, to_hours
+from harmonic_analysis import rayleigh
+
+#####################################
+## Define constants
+#####################################
+# Bands in cycles per day; tidal energy is the sum of all but long-period
+bands = {'long_period':(0., 0.5), 'diurnal':(0.8, 1.2), 'semidiurnal':(1.7, 2.2),
+         'terdiurnal':(2.8, 3.2), 'quarter_diurnal':(3.7, 4.3), 'sixth_diurnal':(5.6, 6.4)}
+
+# 4-term Blackman-Harris taper: its sidelobes (-92 dB) keep M2 from
+# leaking into the weaker constituents a few bins away
+window_coeffs = [0.35875, -0.48829, 0.14128, -0.01168]
+
+# A series is flagged when it misses more than 1 - min_coverage of its
+# samples, varies less than min_std (m), has less than min_tidal_fraction
+# of its variance in the tidal bands, or more than max_noise_fraction
+# above them
+min_coverage = 0.8
+min_std = 0.01
+min_tidal_fraction = 0.5
+max_noise_fraction = 0.2
+flag_names = ['gappy', 'flat', 'non_tidal', 'noisy']
+
+# A constituent is kept when its amplitude reaches min_amplitude (m) at
+# min_node_fraction of the unflagged series
+min_amplitude = 0.005
+min_node_fraction = 0.05
+
+# Series transformed at once
+series_per_block = 64
+
+#####################################
+## Define functions
+#####################################
+def get_regular_axis (times):
+
+    # Step (hours), number of steps and position of each time on a
+    # regular axis from the first to the last time
+    hours = to_hours (times)
+    step = numpy.median (numpy.diff (hours))
+    positions = numpy.round ((hours - hours[0]) / step).astype (int)
+    return step, positions[-1] + 1, positions
+
+def get_band_weights (frequencies):
+
+    # (nband + 1, nfreq) 0 / 1: bins of each band, then the bins above
+    # the highest band
+    cpd = frequencies * 24.
+    weights = [(cpd > low) & (cpd < high) for low, high in bands.values ()]
+    weights.append (cpd >= max (high for _, high in bands.values ()))
+    return numpy.array (weights, dtype=float)
+
+def get_window (ntime):
+
+    # 4-term Blackman-Harris taper
+    phases = 2. * numpy.pi * numpy.arange (ntime) / (ntime - 1)
+    return sum (coefficient * numpy.cos (order * phases)
+                for order, coefficient in enumerate (window_coeffs))
+
+def get_anomalies (values):
+
+    # values: (nseries, ntime) on a regular axis, NaN for gaps. Returns the
+    # demeaned values with zeros in the gaps, where they are good, and the
+    # variances and coverages of the series.
+    is_good = numpy.isfinite (values)
+    counts = is_good.sum (axis=1)
+    with numpy.errstate (invalid='ignore', divide='ignore'):
+        means = numpy.where (is_good, values, 0.).sum (axis=1) / counts
+        anomalies = numpy.where (is_good, values - means[:, None], 0.)
+        variances = (anomalies**2).sum (axis=1) / counts
+    return anomalies, is_good, variances, counts / float (values.shape[1])
+
+def get_periodograms (anomalies, is_good):
+
+    # One-sided periodograms (nseries, nfreq) scaled to sum to the variance
+    ntime = anomalies.shape[1]
+    window = get_window (ntime)
+    powers = 2. * numpy.abs (numpy.fft.rfft (anomalies * window, axis=1))**2 / (ntime * (window**2).sum ())
+    powers[:, 0] /= 2.
+    if ntime % 2 == 0: powers[:, -1] /= 2.
+
+    # Gaps take out their share of the window energy
+    with numpy.errstate (invalid='ignore', divide='ignore'):
+        return powers / (is_good.dot (window**2) / (window**2).sum ())[:, None]
+
+def get_lines (ntime, step, names):
+
+    # Hann-tapered exp (-2 pi i f t) of the constituents (ntime, nconsti)
+    # and their coupling G[j, k] = sum (w exp (2 pi i (f_k - f_j) t)) / sum (w)
+    hours = numpy.arange (ntime) * step
+    window = numpy.hanning (ntime)
+    lines = numpy.exp (-2j * numpy.pi * numpy.outer (hours, get_frequencies (names)))
+    tapered = lines * window[:, None]
+    return tapered, tapered.T.dot (lines.conj ()) / window.sum ()
+
+def get_line_amplitudes (anomalies, is_good, lines, coupling):
+
+    # Amplitudes (nconsti, nseries) of all constituents at once: the
+    # tapered transforms at their frequencies are solved through the
+    # coupling, so that a strong line leaking into its neighbours is
+    # taken back out of them
+    window = numpy.hanning (anomalies.shape[1])
+    with numpy.errstate (invalid='ignore', divide='ignore'):
+        transforms = anomalies.dot (lines) / is_good.dot (window)[:, None]
+    return 2. * numpy.abs (numpy.linalg.solve (coupling, transforms.T))
+
+def screen_block (values, step, names):
+
+    # Screening results of (nseries, ntime) values sampled every step hours
+    frequencies = numpy.fft.rfftfreq (values.shape[1], d=step)
+    band_weights = get_band_weights (frequencies)
+    lines, coupling = get_lines (values.shape[1], step, names)
+
+    results = {key:[] for key in ['amp', 'bands', 'noise', 'variance', 'coverage']}
+    for start in range (0, len (values), series_per_block):
+        anomalies, is_good, variances, coverage = get_anomalies (values[start:start+series_per_block])
+        energies = band_weights.dot (get_periodograms (anomalies, is_good).T)
+        results['amp'].append (get_line_amplitudes (anomalies, is_good, lines, coupling))
+        results['bands'].append (energies[:-1])
+        results['noise'].append (energies[-1])
+        results['variance'].append (variances)
+        results['coverage'].append (coverage)
+    return {key:numpy.concatenate (value, axis=-1) for key, value in results.items ()}
+
+def get_flags (results):
+
+    # Bit k set for flag_names[k]
+    with numpy.errstate (invalid='ignore', divide='ignore'):
+        tidal = results['bands'][1:].sum (axis=0) / results['variance']
+        noise = results['noise'] / results['variance']
+    checks = [~(results['coverage'] >= min_coverage),
+              ~(results['variance'] >= min_std**2),
+              ~(tidal >= min_tidal_fraction),
+              noise > max_noise_fraction]
+    flags = numpy.zeros (len (results['variance']), dtype=int)
+    for bit, check in enumerate (checks): flags |= check.astype (int) << bit
+    return flags, tidal, noise
+
+def get_candidates (step, ntime, names=None):
+
+    # Resolvable constituents below the Nyquist frequency
+    if names is None: names = select_constituents (step * ntime, rayleigh=rayleigh)
+    nyquist = 0.5 / step
+    return [name for name, frequency in zip (names, get_frequencies (names)) if frequency < nyquist]
+
+def finish (results, names):
+
+    flags, tidal, noise = get_flags (results)
+    results.update ({'names':list (names), 'freq':get_frequencies (names), 'flags':flags,
+                     'tidal_fraction':tidal, 'noise_fraction':noise})
+    return results
+
+def screen_dataframe (dataframe, names=None):
+
+    # dataframe: time-series with a datetime index, one column per series
+    step, ntime, positions = get_regular_axis (dataframe.index)
+    values = numpy.full ((dataframe.shape[1], ntime), numpy.nan)
+    values[:, positions] = numpy.asarray (dataframe.values, dtype=float).T
+    names = get_candidates (step, ntime, names=names)
+    return finish (screen_block (values, step, names), names)
+
+def screen_blocks (blocks, nseries, step, ntime, positions, names=None):
+
+    # blocks: (series slice, (nseries in block, ntime stored) values)
+    names = get_candidates (step, ntime, names=names)
+    results = {'amp':numpy.full ((len (names), nseries), numpy.nan),
+               'bands':numpy.full ((len (bands), nseries), numpy.nan)}
+    results.update ({key:numpy.full (nseries, numpy.nan) for key in ['noise', 'variance', 'coverage']})
+    for series, stored in blocks:
+        values = numpy.full ((len (stored), ntime), numpy.nan)
+        values[:, positions] = stored
+        block = screen_block (values, step, names)
+        for key, value in block.items (): results[key][..., series] = value
+    return finish (results, names)
+
+def screen_heights (heights_file, names=None, stations_per_block=None, name='heights'):
+
+    # Every station of a heights (or currents, with name) store
+    if stations_per_block is None: stations_per_block = ofs_store.station_chunk * 16
+    step, ntime, positions = get_regular_axis (ofs_store.read_times (heights_file))
+    nstation = len (ofs_store.read_stations (heights_file))
+    blocks = ((slice (start, min (start + stations_per_block, nstation)),
+               ofs_store.read_heights (heights_file, name=name,
+                                       stations=numpy.arange (start, min (start + stations_per_block,
+                                                                          nstation))).values.T)
+              for start in range (0, nstation, stations_per_block))
+    return screen_blocks (blocks, nstation, step, ntime, positions, names=names)
+
+def screen_fields (fields_file, name='zeta', names=None, nodes_per_block=None):
+
+    # Every wet node of a fields store
+    step, ntime, positions = get_regular_axis (ofs_store.read_times (fields_file))
+    nnode = len (ofs_store.read_nodes (fields_file))
+    blocks = ofs_store.iter_node_blocks (fields_file, name=name, nodes_per_block=nodes_per_block)
+    return screen_blocks (blocks, nnode, step, ntime, positions, names=names)
+
+def is_good (results):
+
+    return results['flags'] == 0
+
+def prune_constituents (results, keep=None):
+
+    # Candidates that reach min_amplitude at min_node_fraction of the
+    # unflagged series, plus those in keep, in frequency order
+    good = is_good (results)
+    amps = results['amp'][:, good]
+    fractions = (amps >= min_amplitude).mean (axis=1) if good.any () else numpy.zeros (len (amps))
+    kept = [name for name, fraction in zip (results['names'], fractions) if fraction >= min_node_fraction]
+    kept += [name for name in ([] if keep is None else keep) if name not in kept]
+    return sort_constituents (kept)
+
+def sort_constituents (names):
+
+    # Frequency order like the t_tide tables
+    return sorted (names, key=lambda name: get_frequencies ([name])[0])
+
+def to_table (results, stations):
+
+    # One row per series: band energies (m^2), fractions and flags
+    table = pandas.DataFrame (results['bands'].T, index=pandas.Index (stations, name='station'),
+                              columns=list (bands.keys ()))
+    table['noise'] = results['noise']
+    table['variance'] = results['variance']
+    table['coverage'] = results['coverage']
+    table['tidal_fraction'] = results['tidal_fraction']
+    table['noise_fraction'] = results['noise_fraction']
+    table['flags'] = [','.join (flag for bit, flag in enumerate (flag_names) if flags & (1 << bit))
+                      for flags in results['flags']]
+    return table
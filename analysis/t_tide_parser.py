@@ -0,0 +1,141 @@
+#!/home/elims/envs/py37/bin/python
+
+## This python reads the t_tide .dat outputs of all stations into one tidy
+## table: one row per station, prediction type (source) and constituent,
+## with the percent variance of the station repeated on its rows.
+##
+## Files are parsed in parallel, and the table is cached in a columnar
+## HDF5 file next to the .dat files together with the mtime and size of
+## each source file. A later run only re-parses the files that have
+## changed (or are new) since they were cached.
+#########################################################################
+
+#####################################
+## Import packages
+#####################################
+import numpy, pandas, h5py, glob, os, re
+from concurrent.futures import ProcessPoolExecutor
+
+#####################################
+## Define constants
+#####################################
+cacheName = 't_tide_tables.h5'
+
+# Number of processes parsing files in parallel; 1 parses serially.
+n_workers = os.cpu_count ()
+
+columns = ['station', 'source', 'tide', 'freq', 'amp', 'amp_err', 'pha', 'pha_err', 'snr', 'percent']
+string_columns = ['station', 'source', 'tide']
+
+percent_pattern = re.compile (r'percent var predicted/var original\s*=\s*([-+.0-9eE]+)')
+
+#####################################
+## Define functions
+#####################################
+def split_name (afile):
+
+    # e.g. ofs_x8575512.dat -> ('8575512', 'ofs')
+    source, station = os.path.basename (afile).split ('.')[0].split ('_', 1)
+    return station[1:], source
+
+def parse_dat (afile):
+
+    # One pass: the percent line comes before the table of results
+    station, source = split_name (afile)
+    percent, rows = numpy.nan, None
+    with open (afile) as f:
+        for line in f:
+            words = line.split ()
+            if len (words) == 0: continue
+            if rows is None:
+                if words[0] == 'percent':
+                    match = percent_pattern.search (line)
+                    if match: percent = float (match.group (1))
+                elif words[0] == 'tide':
+                    header = words
+                    rows = []
+                continue
+            rows.append (words)
+
+    if rows is None:
+        print ('Cannot find table of results in {0}.'.format (afile))
+        return None
+
+    # Significant constituents are starred by t_tide
+    values = numpy.array (rows, dtype=object).T
+    table = {column:values[index].astype (float) for index, column in enumerate (header)
+             if column != 'tide'}
+    table['tide'] = [tide.replace ('*', '') for tide in values[header.index ('tide')]]
+    table = pandas.DataFrame (table)
+    table['station'], table['source'], table['percent'] = station, source, percent
+    return table.reindex (columns=columns)
+
+def parse_dats (afiles, nworkers=None):
+
+    if nworkers is None: nworkers = n_workers
+    if len (afiles) < 2 or nworkers < 2: return [parse_dat (afile) for afile in afiles]
+    with ProcessPoolExecutor (max_workers=nworkers) as executor:
+        return list (executor.map (parse_dat, afiles, chunksize=max (1, len (afiles) // (4 * nworkers))))
+
+def get_signatures (afiles):
+
+    stats = [os.stat (afile) for afile in afiles]
+    return {os.path.basename (afile):(stat.st_mtime_ns, stat.st_size) for afile, stat in zip (afiles, stats)}
+
+def write_cache (afile, table, signatures):
+
+    with h5py.File (afile + '.tmp', 'w') as f:
+        for column in columns:
+            values = table[column].values
+            if column in string_columns: values = values.astype ('S')
+            f.create_dataset ('table/' + column, data=values)
+        # Source file of each row, for partial invalidation
+        f.create_dataset ('table/file', data=table['file'].values.astype ('S'))
+        names = sorted (signatures)
+        f.create_dataset ('files/name', data=numpy.array (names, dtype='S'))
+        f.create_dataset ('files/mtime', data=numpy.array ([signatures[name][0] for name in names], dtype=numpy.int64))
+        f.create_dataset ('files/size', data=numpy.array ([signatures[name][1] for name in names], dtype=numpy.int64))
+    os.replace (afile + '.tmp', afile)
+
+def read_cache (afile):
+
+    # (table with a file column, {file name: (mtime, size)}) or None
+    if not os.path.exists (afile): return None, {}
+    with h5py.File (afile, 'r') as f:
+        table = pandas.DataFrame ({column:f['table/' + column][:] for column in columns + ['file']})
+        names = f['files/name'][:].astype (str)
+        signatures = dict (zip (names, zip (f['files/mtime'][:], f['files/size'][:])))
+    for column in string_columns + ['file']:
+        table[column] = table[column].str.decode ('utf-8')
+    return table, signatures
+
+def load_tables (tTidePath, nworkers=None, use_cache=True):
+
+    # Tidy table of all .dat files under tTidePath
+    afiles = sorted (glob.glob (os.path.join (tTidePath, '*.dat')))
+    signatures = get_signatures (afiles)
+    cacheFile = os.path.join (tTidePath, cacheName)
+    cached, cached_signatures = read_cache (cacheFile) if use_cache else (None, {})
+
+    stale = [afile for afile in afiles if cached_signatures.get (os.path.basename (afile)) !=
+             signatures[os.path.basename (afile)]]
+    if cached is not None and len (stale) == 0 and len (cached_signatures) == len (signatures):
+        return cached.drop (axis=1, columns=['file'])
+
+    tables = []
+    for afile, table in zip (stale, parse_dats (stale, nworkers=nworkers)):
+        if table is None: continue
+        table['file'] = os.path.basename (afile)
+        tables.append (table)
+
+    # Keep cached rows of unchanged files that still exist
+    if cached is not None:
+        stale_names = set (os.path.basename (afile) for afile in stale)
+        is_kept = cached.file.isin (signatures.keys ()) & ~cached.file.isin (stale_names)
+        tables.insert (0, cached[is_kept])
+    table = pandas.concat (tables, ignore_index=True) if len (tables) > 0 else \
+            pandas.DataFrame (columns=columns + ['file'])
+    table = table.sort_values (['source', 'station'], kind='mergesort').reset_index (drop=True)
+
+    if use_cache: write_cache (cacheFile, table, signatures)
+    return table.drop (axis=1, columns=['file'])
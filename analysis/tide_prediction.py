@@ -0,0 +1,81 @@
+#!/home/elims/envs/py37/bin/python
+
+## This python turns harmonic constituents back into water levels at many
+## points at once. For each block of times, the astronomical arguments
+## and nodal factors are computed once and shared by all points, so the
+## prediction is one (time x 2*constituent) by (2*constituent x point)
+## matrix product. Times and points are processed in blocks to bound
+## memory, and blocks can be written straight into an on-disk array.
+#########################################################################
+
+#####################################
+## Import packages
+#####################################
+import numpy, pandas
+from constituents import get_arguments, to_hours
+
+#####################################
+## Define constants
+#####################################
+# ~1 month of 6-minute times by 4096 points per block
+time_chunk = 7440
+point_chunk = 4096
+
+#####################################
+## Define functions
+#####################################
+def get_coefficients (amps, phases):
+
+    # amps / phases (deg): constituent x point tables, e.g. the output of
+    # run_t_tide.extract. Returns the (2*nconsti, npoint) matrix acting
+    # on [f cos (V+u), f sin (V+u)].
+    phases = numpy.radians (phases.loc[amps.index, amps.columns].values)
+    return numpy.vstack ([amps.values * numpy.cos (phases), amps.values * numpy.sin (phases)])
+
+def get_basis (hours, names):
+
+    # (ntime, 2*nconsti) [f cos (V+u), f sin (V+u)] shared by all points
+    arguments, f = get_arguments (hours, names)
+    arguments = numpy.radians (arguments)
+    return numpy.hstack ([f * numpy.cos (arguments), f * numpy.sin (arguments)])
+
+def iter_predictions (times, amps, phases, means=None, tchunk=None, pchunk=None):
+
+    # Yields (time slice, point slice, block of heights)
+    if tchunk is None: tchunk = time_chunk
+    if pchunk is None: pchunk = point_chunk
+    names = list (amps.index)
+    coefs = get_coefficients (amps, phases)
+    offsets = numpy.zeros (coefs.shape[1]) if means is None else \
+              means.loc[amps.columns].values.astype (float)
+    hours = to_hours (times)
+
+    for tstart in range (0, len (hours), tchunk):
+        tslice = slice (tstart, min (tstart + tchunk, len (hours)))
+        subhours = hours[tslice]
+
+        # Astronomical arguments and nodal factors are shared by all points
+        basis = get_basis (subhours, names)
+
+        for pstart in range (0, coefs.shape[1], pchunk):
+            pslice = slice (pstart, min (pstart + pchunk, coefs.shape[1]))
+            yield tslice, pslice, basis.dot (coefs[:, pslice]) + offsets[pslice]
+
+def predict (times, amps, phases, means=None, out=None, dtype=numpy.float32,
+             tchunk=None, pchunk=None):
+
+    # Predicted heights (time x point). With out (e.g. a numpy memmap or an
+    # h5py dataset of shape (ntime, npoint)), blocks are written into it
+    # and nothing is held in memory.
+    times = pandas.DatetimeIndex (times)
+    as_frame = out is None
+    if as_frame: out = numpy.empty ((len (times), amps.shape[1]), dtype=dtype)
+
+    for tslice, pslice, block in iter_predictions (times, amps, phases, means=means,
+                                                   tchunk=tchunk, pchunk=pchunk):
+        out[tslice, pslice] = block.astype (dtype)
+
+    if not as_frame: return out
+    dataframe = pandas.DataFrame (out, index=times, columns=amps.columns)
+    dataframe.index.name = 'datetime'
+    return dataframe
@@ -0,0 +1,160 @@
+#!/home/elims/envs/py37/bin/python
+
+## This python times the main steps of the pipeline on a synthetic CBOFS
+## archive (see synthetic_ofs.py) and appends the results as one JSON line
+## per run to a results file, so runs can be compared across changes:
+##
+##   {"time": ..., "commit": ..., "python": ..., "params": {...},
+##    "results": {"read_one_file": {"n": 5, "min": ..., "median": ..., "mean": ...}, ...}}
+##
+## Times are in seconds. With --compare, the medians are printed next to
+## those of the last recorded run with the same parameters.
+##
+## Usage: run_benchmarks.py [--stations N] [--days N] [--cycles N] [--repeat N]
+##                          [--output results.jsonl] [--compare]
+#########################################################################
+
+#####################################
+## Import packages
+#####################################
+import numpy, time, json, os, sys, tempfile, shutil, platform, subprocess, argparse
+
+benchpath = os.path.dirname (os.path.abspath (__file__))
+sys.path.insert (0, os.path.join (benchpath, '..', 'custodian'))
+sys.path.insert (0, os.path.join (benchpath, '..', 'analysis'))
+
+import synthetic_ofs, ofs_massager, ofs_obs_massager, ofs_store, spatial_index, run_t_tide
+
+#####################################
+## Define constants
+#####################################
+# Outside the repository, next to the CO-OPS API cache (see coops_api.py)
+resultsFile = os.path.join (os.path.expanduser ('~'), '.cache', 'ofs-tide-predictions', 'benchmarks.jsonl')
+
+#####################################
+## Define functions
+#####################################
+def time_it (function, repeat=3):
+
+    # Wall times (s) of repeated calls and the last return value
+    times = []
+    for _ in range (repeat):
+        start = time.perf_counter ()
+        value = function ()
+        times.append (time.perf_counter () - start)
+    return times, value
+
+def summarize (times):
+
+    return {'n':len (times), 'min':min (times), 'median':float (numpy.median (times)),
+            'mean':float (numpy.mean (times))}
+
+def get_commit ():
+
+    try:
+        return subprocess.check_output (['git', 'rev-parse', '--short', 'HEAD'], cwd=benchpath,
+                                        stderr=subprocess.DEVNULL).decode ().strip ()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks (workpath, nstations=100, ndays=7, ncycles=4, repeat=3, nworkers=None):
+
+    if nworkers is None: nworkers = ofs_massager.n_workers
+    results = {}
+    datapath = os.path.join (workpath, 'data')
+    afiles = synthetic_ofs.make_stations_files (datapath, nstations=nstations, ndays=ndays,
+                                                ncycles=ncycles)
+
+    ## OFS stations files
+    times, _ = time_it (lambda: ofs_massager.read_one_file (afiles[0]), repeat=max (repeat, 5))
+    results['read_one_file'] = summarize (times)
+    times, _ = time_it (lambda: ofs_massager.collect_ofs_data (nworkers=1, allfiles=afiles), repeat=repeat)
+    results['collect_ofs_data_serial'] = summarize (times)
+    times, heights = time_it (lambda: ofs_massager.collect_ofs_data (nworkers=nworkers, allfiles=afiles),
+                              repeat=repeat)
+    results['collect_ofs_data_parallel'] = summarize (times)
+    ofsdata = heights.to_dataframe ()
+
+    ## Round-trips of the time-series through csv and the HDF5 store
+    csvFile = os.path.join (workpath, 'ofs_preds.csv')
+    heightsFile = os.path.join (workpath, 'ofs_all_heights.h5')
+    results['csv_write'] = summarize (time_it (lambda: ofsdata.to_csv (csvFile), repeat=repeat)[0])
+    results['csv_read'] = summarize (time_it (lambda: run_t_tide.read_preds (csvFile), repeat=repeat)[0])
+    results['store_write'] = summarize (time_it (lambda: ofs_store.write_heights (heightsFile, heights),
+                                                 repeat=repeat)[0])
+    results['store_read'] = summarize (time_it (lambda: ofs_store.read_heights (heightsFile), repeat=repeat)[0])
+
+    ## Matching CO-OPS stations to OFS stations
+    ofsstations = ofs_store.read_stations (heightsFile)
+    metadata = synthetic_ofs.make_metadata ()
+    times, node_index = time_it (lambda: spatial_index.NodeIndex (ofsstations['lat'], ofsstations['lon']),
+                                 repeat=repeat)
+    results['node_index_build'] = summarize (times)
+    times, _ = time_it (lambda: ofs_obs_massager.match_stations_by_ofs_indices (
+                        metadata.copy (), ofsstations, node_index=node_index), repeat=max (repeat, 5))
+    results['match_stations_by_ofs_indices'] = summarize (times)
+
+    ## t_tide outputs: the first read parses, the others load the cache
+    run_t_tide.tTidePath = os.path.join (workpath, 't_tide') + os.sep
+    synthetic_ofs.make_dat_files (run_t_tide.tTidePath, metadata.id.values)
+    times, _ = time_it (run_t_tide.read_dats, repeat=1)
+    results['read_dats_parse'] = summarize (times)
+    times, _ = time_it (run_t_tide.read_dats, repeat=max (repeat, 5))
+    results['read_dats_cached'] = summarize (times)
+
+    return results
+
+def find_previous (records, params):
+
+    matches = [record for record in records if record.get ('params') == params]
+    return matches[-1] if len (matches) > 0 else None
+
+def read_records (afile):
+
+    if not os.path.exists (afile): return []
+    with open (afile) as f:
+        return [json.loads (line) for line in f if len (line.strip ()) > 0]
+
+def print_results (results, previous=None):
+
+    for name, summary in results.items ():
+        line = '| {0:<32s} {1:10.4f} s'.format (name, summary['median'])
+        if previous is not None and name in previous['results']:
+            before = previous['results'][name]['median']
+            line += '  ({0:.2f}x of {1})'.format (summary['median'] / before, previous['commit'])
+        print (line)
+
+#####################################
+## Script starts here!
+#####################################
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser (description='Benchmark the OFS pipeline on synthetic data.')
+    parser.add_argument ('--stations', type=int, default=100)
+    parser.add_argument ('--days', type=int, default=7)
+    parser.add_argument ('--cycles', type=int, default=4)
+    parser.add_argument ('--repeat', type=int, default=3)
+    parser.add_argument ('--nworkers', type=int, default=None)
+    parser.add_argument ('--output', default=resultsFile, help='JSON lines file to append to')
+    parser.add_argument ('--compare', action='store_true', help='compare with the last matching run')
+    args = parser.parse_args ()
+
+    params = {'stations':args.stations, 'days':args.days, 'cycles':args.cycles, 'repeat':args.repeat}
+    workpath = tempfile.mkdtemp (prefix='ofs_bench_')
+    try:
+        results = run_benchmarks (workpath, nstations=args.stations, ndays=args.days,
+                                  ncycles=args.cycles, repeat=args.repeat, nworkers=args.nworkers)
+    finally:
+        shutil.rmtree (workpath)
+
+    previous = find_previous (read_records (args.output), params) if args.compare else None
+    print_results (results, previous=previous)
+
+    record = {'time':time.strftime ('%Y-%m-%dT%H:%M:%S'), 'commit':get_commit (),
+              'python':platform.python_version (), 'machine':platform.machine (),
+              'ncpu':os.cpu_count (), 'params':params, 'results':results}
+    outdir = os.path.dirname (os.path.abspath (args.output))
+    if not os.path.exists (outdir): os.makedirs (outdir)
+    with open (args.output, 'a') as f:
+        f.write (json.dumps (record) + '\n')
@@ -0,0 +1,124 @@
+#!/home/elims/envs/py37/bin/python
+
+## This python writes a small synthetic CBOFS archive for benchmarking
+## the pipeline without the real outputs. Stations files carry the same
+## variables that ofs_massager.read_one_file reads (lat_rho, lon_rho,
+## zeta on ocean_time x station, dstart) in YYYYMM/ sub-folders named
+## like the NOS files. Water levels are a few tidal constituents plus
+## noise, continuous from one cycle to the next.
+##
+## It can also write t_tide-style .dat outputs and a CO-OPS-like station
+## table for the comparison steps.
+#########################################################################
+
+#####################################
+## Import packages
+#####################################
+import numpy, pandas, xarray, os
+
+#####################################
+## Define constants
+#####################################
+ofs_start_date = pandas.to_datetime ("2016-01-01 00:00:00")
+n_minutes_per_step = 6
+
+# Chesapeake Bay box: (min lat, max lat, min lon, max lon)
+bbox = (36.8, 39.6, -77.4, -75.6)
+
+# name: (frequency in cycles / hour, amplitude in meters)
+constituents = {'M2':(0.0805114, 0.30), 'S2':(0.0833333, 0.05), 'N2':(0.0789992, 0.07),
+                'K1':(0.0417807, 0.06), 'O1':(0.0387307, 0.05), 'M4':(0.1610228, 0.01)}
+
+#####################################
+## Define functions
+#####################################
+def get_stations (nstations, seed=0):
+
+    random = numpy.random.RandomState (seed)
+    lats = random.uniform (bbox[0], bbox[1], nstations)
+    lons = random.uniform (bbox[2], bbox[3], nstations)
+    phases = random.uniform (0, 2 * numpy.pi, (len (constituents), nstations))
+    return lats, lons, phases
+
+def get_heights (hours, phases, noise=0.02, seed=0):
+
+    # (ntime, nstation) water levels at hours since ofs_start_date
+    random = numpy.random.RandomState (seed)
+    heights = numpy.zeros ((len (hours), phases.shape[1]), dtype=numpy.float32)
+    for (frequency, amplitude), phase in zip (constituents.values (), phases):
+        heights += amplitude * numpy.cos (2 * numpy.pi * frequency * hours[:, None] - phase[None, :])
+    return heights + noise * random.standard_normal (heights.shape).astype (numpy.float32)
+
+def make_stations_files (datapath, nstations=100, ndays=7, ncycles=4, nhours=48, seed=0):
+
+    # One file per cycle, each with nhours of 6-minute forecast data
+    lats, lons, phases = get_stations (nstations, seed=seed)
+    nsteps = nhours * 60 // n_minutes_per_step + 1
+    cycle_hours = 24 // ncycles
+
+    afiles = []
+    for day in range (ndays):
+        date = ofs_start_date + pandas.Timedelta (days=day)
+        subpath = os.path.join (datapath, date.strftime ('%Y%m'))
+        if not os.path.exists (subpath): os.makedirs (subpath)
+        for cycle in range (ncycles):
+            dstart = day + cycle * cycle_hours / 24.
+            hours = dstart * 24 + numpy.arange (nsteps) * n_minutes_per_step / 60.
+            heights = get_heights (hours, phases, seed=seed + day * ncycles + cycle)
+            dataset = xarray.Dataset ({'zeta':(('ocean_time', 'station'), heights),
+                                       'lat_rho':(('station',), lats),
+                                       'lon_rho':(('station',), lons),
+                                       'dstart':((), dstart)},
+                                      coords={'ocean_time':hours * 3600.})
+            afile = os.path.join (subpath, 'nos.cbofs.stations.forecast.{0}.t{1:02d}z.nc'.format (
+                                  date.strftime ('%Y%m%d'), cycle * cycle_hours))
+            dataset.to_netcdf (afile)
+            afiles.append (afile)
+    return afiles
+
+def make_metadata (nstations=12, seed=1):
+
+    # CO-OPS-like station table (id, name, lat, lon) inside the same box
+    lats, lons, _ = get_stations (nstations, seed=seed)
+    ids = [str (8570000 + index) for index in range (nstations)]
+    return pandas.DataFrame ({'id':ids, 'name':ids, 'lat':lats, 'lon':lons})
+
+def make_dat_files (tTidePath, stations, seed=0):
+
+    # t_tide outputs of ofs and coops for each station
+    if not os.path.exists (tTidePath): os.makedirs (tTidePath)
+    random = numpy.random.RandomState (seed)
+    names = sorted (constituents, key=lambda name: constituents[name][0])
+    for source in ['ofs', 'coops']:
+        for station in stations:
+            lines = ['file name: {0}_x{1}.dat'.format (source, station),
+                     'nobs = 8784,  ngood = 8784,  record length (days) = 366.00',
+                     'rayleigh criterion = 1.0', '',
+                     'var(x)= 0.0916   var(xp)= 0.0894   var(xres)= 0.0023',
+                     'percent var predicted/var original= {0:.1f} %'.format (random.uniform (80, 99)), '',
+                     '     tide   freq       amp     amp_err    pha    pha_err     snr']
+            for name in names:
+                frequency, amplitude = constituents[name]
+                lines.append ('    *{0:<4s}  {1:.7f}  {2:9.4f}  {3:8.4f}  {4:8.2f}  {5:8.2f}  {6:8.2g}'.format (
+                              name, frequency, amplitude * random.uniform (0.9, 1.1), 0.003,
+                              random.uniform (0, 360), random.uniform (0, 5), 1e4))
+            with open (os.path.join (tTidePath, '{0}_x{1}.dat'.format (source, station)), 'w') as f:
+                f.write ('\n'.join (lines) + '\n')
+
+#####################################
+## Script starts here!
+#####################################
+
+if __name__ == '__main__':
+
+    import argparse
+    parser = argparse.ArgumentParser (description='Write synthetic CBOFS stations files.')
+    parser.add_argument ('datapath')
+    parser.add_argument ('--stations', type=int, default=100)
+    parser.add_argument ('--days', type=int, default=7)
+    parser.add_argument ('--cycles', type=int, default=4)
+    args = parser.parse_args ()
+
+    afiles = make_stations_files (args.datapath, nstations=args.stations, ndays=args.days,
+                                  ncycles=args.cycles)
+    print ('{0} files written under {1}'.format (len (afiles), args.datapath))
@@ -0,0 +1,88 @@
+#!/home/elims/envs/py37/bin/python
+
+## This python keeps CO-OPS API responses in a local sqlite file so that
+## re-runs do not download the same station metadata and predictions
+## again. Entries are keyed by the normalized request, i.e. the API path
+## and its sorted query parameters, so the host and parameter order do
+## not matter. The file is capped in size and evicts the least recently
+## used entries first.
+#########################################################################
+
+#####################################
+## Import packages
+#####################################
+import sqlite3, json, zlib, time, threading, os
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+#####################################
+## Define functions
+#####################################
+def normalize_request (api):
+
+    parts = urlsplit (api)
+    query = sorted ((key.lower (), value.strip ()) for key, value in parse_qsl (parts.query))
+    return parts.path.rstrip ('/') + '?' + urlencode (query)
+
+class ResponseCache (object):
+
+    def __init__ (self, afile, max_bytes):
+
+        self.afile = afile
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock ()
+        self.nhits, self.nmisses = 0, 0
+
+        folder = os.path.dirname (afile)
+        if len (folder) > 0 and not os.path.exists (folder): os.makedirs (folder)
+
+        # Shared by all threads; every access goes through self.lock
+        self.connection = sqlite3.connect (afile, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute ('CREATE TABLE IF NOT EXISTS responses (' +
+                                     'key TEXT PRIMARY KEY, body BLOB, size INTEGER, ' +
+                                     'created REAL, accessed REAL, expires REAL)')
+            self.connection.execute ('CREATE INDEX IF NOT EXISTS accessed ON responses (accessed)')
+
+    def get (self, api, allow_expired=False):
+
+        # Returns the cached json content, or None when missing / expired
+        key, now = normalize_request (api), time.time ()
+        with self.lock, self.connection:
+            row = self.connection.execute ('SELECT body, expires FROM responses WHERE key=?',
+                                           (key,)).fetchone ()
+            if row is None or (row[1] is not None and row[1] < now and not allow_expired):
+                self.nmisses += 1
+                return None
+            self.connection.execute ('UPDATE responses SET accessed=? WHERE key=?', (now, key))
+            self.nhits += 1
+        return json.loads (zlib.decompress (row[0]).decode ('utf-8'))
+
+    def put (self, api, content, ttl=None):
+
+        # ttl in seconds; None keeps the entry until it is evicted
+        key, now = normalize_request (api), time.time ()
+        body = zlib.compress (json.dumps (content).encode ('utf-8'))
+        expires = None if ttl is None else now + ttl
+        with self.lock, self.connection:
+            self.connection.execute ('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)',
+                                     (key, body, len (body), now, now, expires))
+            self.evict ()
+
+    def evict (self):
+
+        # Drop least recently used entries until the cache fits; the caller
+        # holds the lock.
+        total = self.connection.execute ('SELECT COALESCE (SUM (size), 0) FROM responses').fetchone ()[0]
+        if total <= self.max_bytes: return
+        rows = self.connection.execute ('SELECT key, size FROM responses ORDER BY accessed').fetchall ()
+        dropped = []
+        for key, size in rows:
+            if total <= self.max_bytes: break
+            dropped.append ((key,))
+            total -= size
+        self.connection.executemany ('DELETE FROM responses WHERE key=?', dropped)
+
+    def clear (self):
+
+        with self.lock, self.connection:
+            self.connection.execute ('DELETE FROM responses')
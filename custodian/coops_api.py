@@ -0,0 +1,167 @@
+#!/home/elims/envs/py37/bin/python
+
+## This python talks to the CO-OPS tidesandcurrents APIs. One pooled
+## session is shared by a bounded number of threads; failed requests are
+## retried with backoff, and long date ranges are split into chunks the
+## datagetter accepts and stitched back together by the caller. Good
+## responses are kept in an on-disk cache (see api_cache.py); in offline
+## mode, requests are answered from that cache only.
+#########################################################################
+
+#####################################
+## Import packages
+#####################################
+import pandas, requests, threading, time, os
+import run_report
+from urllib.parse import urlsplit, parse_qsl
+from api_cache import ResponseCache
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+#####################################
+## Define constants
+#####################################
+# Point this at a local server to test without the real API
+api_host = 'https://tidesandcurrents.noaa.gov'
+
+dataAPI_params = {'product':'predictions', 'datum':'MLLW', 'time_zone':'gmt', 'units':'metric'}
+metadataAPI_params = {'units':dataAPI_params['units']}
+
+dataAPI_template = '{host}/api/datagetter?' + \
+                   'begin_date={begin_date}&end_date={end_date}&station={station}&' + \
+                   'product={product}&datum={datum}&time_zone={time_zone}&units={units}&format=json'
+
+metadataAPI_template = '{host}/mdapi/v1.0/webapi/stations/' + \
+                       '{station}.json?units={units}'
+
+date_format = '%Y%m%d %H:%M'
+
+# The datagetter caps how much 6-minute data one request may return
+max_days_per_request = 31
+
+# Concurrency, retries and timeout (seconds)
+n_connections = 8
+n_retries = 5
+backoff_factor = 0.5
+timeout = 60
+
+# Response cache. Past data never changes and stays until evicted; station
+# metadata and data reaching the last day expire after their TTL (seconds).
+use_cache = True
+offline = False
+cache_file = os.path.join (os.path.expanduser ('~'), '.cache', 'ofs-tide-predictions', 'coops_api.sqlite')
+cache_max_bytes = 2 * 1024**3
+metadata_ttl = 7 * 24 * 3600
+recent_ttl = 3600
+
+#####################################
+## Define functions
+#####################################
+get_data_api = lambda **params: dataAPI_template.format (host=api_host, **params)
+get_metadata_api = lambda **params: metadataAPI_template.format (host=api_host, **params)
+
+_session, _cache = None, None
+_session_lock = threading.Lock ()
+
+def get_session ():
+
+    # One session for all threads, with a connection pool per host that is
+    # as big as the number of concurrent requests.
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry (total=n_retries, backoff_factor=backoff_factor,
+                           status_forcelist=[429, 500, 502, 503, 504],
+                           raise_on_status=False)
+            adapter = HTTPAdapter (pool_connections=n_connections,
+                                   pool_maxsize=n_connections, max_retries=retry)
+            _session = requests.Session ()
+            _session.mount ('http://', adapter)
+            _session.mount ('https://', adapter)
+    return _session
+
+def get_cache ():
+
+    global _cache
+    if not use_cache: return None
+    with _session_lock:
+        if _cache is None: _cache = ResponseCache (cache_file, cache_max_bytes)
+    return _cache
+
+def get_ttl (api):
+
+    parts = urlsplit (api)
+    if '/mdapi/' in parts.path: return metadata_ttl
+
+    end_date = dict (parse_qsl (parts.query)).get ('end_date')
+    if end_date is None: return recent_ttl
+    yesterday = pandas.Timestamp.utcnow ().tz_localize (None) - pandas.Timedelta (days=1)
+    return recent_ttl if pandas.to_datetime (end_date) > yesterday else None
+
+def pull_data (api):
+
+    cache = get_cache ()
+    if cache is not None:
+        content = cache.get (api, allow_expired=offline)
+        run_report.count ('api_cache_hits' if content is not None else 'api_cache_misses')
+        if content is not None: return content
+    if offline:
+        print ('Not in cache while offline. Please check API:\n{0}.'.format (api))
+        return None
+
+    start = time.perf_counter ()
+    try:
+        response = get_session ().get (api, timeout=timeout)
+    except requests.exceptions.RequestException as error:
+        run_report.count ('api_failures')
+        print ('Connection failed with {0}.'.format (error))
+        return None
+    finally:
+        run_report.count ('api_requests')
+        run_report.observe ('api_latency', time.perf_counter () - start)
+    if not response.status_code == 200:
+        run_report.count ('api_failures')
+        print ('Connection failed with {0}.'.format (response.status_code))
+        return None
+    run_report.count ('api_bytes', len (response.content))
+
+    try:
+        content = response.json()
+    except ValueError:
+        print ('Failed to collect data. Please check API:\n{0}.'.format (api))
+        return None
+    if 'error' in content:
+        print ('Error encountered: {0}.'.format (content['error']['message']))
+        return None
+    if len (content) == 0:
+        print ('Empty content encounted. Please check API:\n{0}.'.format (api))
+        return None
+
+    if cache is not None: cache.put (api, content, ttl=get_ttl (api))
+    return content
+
+def pull_many (apis, nworkers=None):
+
+    # Contents come back in the same order as apis
+    if nworkers is None: nworkers = n_connections
+    if len (apis) < 2 or nworkers < 2: return [pull_data (api) for api in apis]
+    with ThreadPoolExecutor (max_workers=nworkers) as executor:
+        return list (executor.map (pull_data, apis))
+
+def split_date_range (begin_date, end_date, max_days=None):
+
+    # Consecutive chunks share their boundary time stamp; the caller
+    # drops the duplicates when stitching.
+    if max_days is None: max_days = max_days_per_request
+    begin, end = pandas.to_datetime (begin_date), pandas.to_datetime (end_date)
+    step = pandas.Timedelta (days=max_days)
+
+    chunks = []
+    while begin < end:
+        chunk_end = min (begin + step, end)
+        chunks.append ((begin.strftime (date_format), chunk_end.strftime (date_format)))
+        begin = chunk_end
+    if len (chunks) == 0:
+        chunks.append ((begin.strftime (date_format), end.strftime (date_format)))
+    return chunks
@@ -0,0 +1,314 @@
+#!/home/elims/envs/py37/bin/python
+
+## This python downloads a year of CBOFS forecast outputs (stations or
+## fields) from the NOS server into one folder per month. Files are pulled
+## by a bounded pool of threads. Partial downloads are kept as .part files
+## and resumed (HTTP Range / FTP REST); files already on disk with the
+## same size as on the server are skipped. Each file gets a quick NetCDF
+## header check, and truncated ones are renamed to .bad so that they are
+## not picked up by the massagers.
+##
+## Usage: download_netcdf.py <stations|fields> <year> <datapath> [--url URL]
+##
+## --url may point at a local HTTP or FTP server holding YYYYMM/ folders
+## with the same file names, e.g. `python -m http.server` in a test folder.
+#########################################################################
+
+#####################################
+## Import packages
+#####################################
+import requests, ftplib, struct, re, os, argparse, threading
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+#####################################
+## Define constants
+#####################################
+region = 'cbofs'
+base_url = 'ftp://tidepool.nos.noaa.gov/pub/outgoing/ofs/' + region + '/netcdf/'
+file_pattern = r'nos\.' + region + r'\.{filetype}\.forecast\.{yyyymm}\d\d\.t\d\dz\.nc'
+
+# Concurrency, retries, timeout (seconds) and bytes per read
+n_workers = 4
+n_retries = 5
+timeout = 120
+block_size = 1024**2
+
+# Magic numbers of netCDF classic (CDF1 / CDF2 / CDF5) and netCDF-4 (HDF5)
+cdf_magic = b'CDF'
+hdf5_magic = b'\x89HDF\r\n\x1a\n'
+
+# Bytes per value of the netCDF classic types
+cdf_type_sizes = {1:1, 2:1, 3:2, 4:4, 5:4, 6:8, 7:1, 8:2, 9:4, 10:8, 11:8}
+
+#####################################
+## Define functions
+#####################################
+_session = None
+_session_lock = threading.Lock ()
+
+def get_session ():
+
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry (total=n_retries, backoff_factor=0.5,
+                           status_forcelist=[429, 500, 502, 503, 504])
+            adapter = HTTPAdapter (pool_connections=n_workers, pool_maxsize=n_workers,
+                                   max_retries=retry)
+            _session = requests.Session ()
+            _session.mount ('http://', adapter)
+            _session.mount ('https://', adapter)
+    return _session
+
+def is_ftp (url): return urlsplit (url).scheme == 'ftp'
+
+def open_ftp (url):
+
+    # One connection per call; ftplib connections are not thread-safe
+    parts = urlsplit (url)
+    ftp = ftplib.FTP (timeout=timeout)
+    ftp.connect (parts.hostname, parts.port or 21)
+    ftp.login (parts.username or 'anonymous', parts.password or '')
+    return ftp, parts.path
+
+def list_names (url):
+
+    # Entries directly under url, from the FTP listing or the HTML index
+    if is_ftp (url):
+        ftp, path = open_ftp (url)
+        try:
+            names = [name.rstrip ('/').split ('/')[-1] for name in ftp.nlst (path)]
+        finally:
+            ftp.close ()
+        return names
+
+    response = get_session ().get (url, timeout=timeout)
+    response.raise_for_status ()
+    hrefs = re.findall (r'href="([^"?#]+)"', response.text)
+    return [href.rstrip ('/').split ('/')[-1] for href in hrefs]
+
+def list_months (year, url=None):
+
+    if url is None: url = base_url
+    names = list_names (url)
+    return sorted (set (name for name in names if re.fullmatch (str (year) + r'\d\d', name)))
+
+def list_files (filetype, yyyymm, url=None):
+
+    # (file url, file name) of the requested file type in a month
+    if url is None: url = base_url
+    month_url = url.rstrip ('/') + '/' + yyyymm + '/'
+    pattern = file_pattern.format (filetype=filetype, yyyymm=yyyymm)
+    names = sorted (set (name for name in list_names (month_url) if re.fullmatch (pattern, name)))
+    return [(month_url + name, name) for name in names]
+
+def get_remote_size (url):
+
+    if is_ftp (url):
+        ftp, path = open_ftp (url)
+        try:
+            ftp.voidcmd ('TYPE I')
+            return ftp.size (path)
+        finally:
+            ftp.close ()
+
+    response = get_session ().head (url, timeout=timeout, allow_redirects=True)
+    response.raise_for_status ()
+    size = response.headers.get ('Content-Length')
+    return None if size is None else int (size)
+
+def fetch (url, partfile, offset):
+
+    # Append url from byte offset onwards to partfile
+    if is_ftp (url):
+        ftp, path = open_ftp (url)
+        try:
+            ftp.voidcmd ('TYPE I')
+            with open (partfile, 'ab' if offset > 0 else 'wb') as f:
+                ftp.retrbinary ('RETR ' + path, f.write, blocksize=block_size,
+                                rest=offset if offset > 0 else None)
+        finally:
+            ftp.close ()
+        return
+
+    headers = {'Range':'bytes={0}-'.format (offset)} if offset > 0 else {}
+    with get_session ().get (url, headers=headers, stream=True, timeout=timeout) as response:
+        response.raise_for_status ()
+        # Server ignored the range: start over
+        mode = 'ab' if offset > 0 and response.status_code == 206 else 'wb'
+        with open (partfile, mode) as f:
+            for block in response.iter_content (chunk_size=block_size):
+                f.write (block)
+
+def read_cdf_string (f, size_bytes):
+
+    nchars = struct.unpack ('>' + size_bytes, f.read (struct.calcsize (size_bytes)))[0]
+    f.read (nchars + (-nchars) % 4)
+
+def get_cdf_size (f, version):
+
+    # Smallest file size implied by a netCDF classic header: the end of the
+    # last fixed-size variable or of the last record.
+    count = 'Q' if version == 5 else 'I'
+    offset = 'Q' if version in [2, 5] else 'I'
+    read = lambda code: struct.unpack ('>' + code, f.read (struct.calcsize (code)))[0]
+
+    numrecs = read (count)
+    tag, ndims = read ('I'), read (count)
+    dims = []
+    for _ in range (ndims):
+        read_cdf_string (f, count)
+        dims.append (read (count))
+
+    # Global attributes are skipped
+    tag, natts = read ('I'), read (count)
+    for _ in range (natts):
+        read_cdf_string (f, count)
+        nc_type, nvalues = read ('I'), read (count)
+        nbytes = nvalues * cdf_type_sizes[nc_type]
+        f.read (nbytes + (-nbytes) % 4)
+
+    tag, nvars = read ('I'), read (count)
+    fixed_end, records = 0, []
+    for _ in range (nvars):
+        read_cdf_string (f, count)
+        dimids = [read (count) for _ in range (read (count))]
+        tag, natts = read ('I'), read (count)
+        for _ in range (natts):
+            read_cdf_string (f, count)
+            nc_type, nvalues = read ('I'), read (count)
+            nbytes = nvalues * cdf_type_sizes[nc_type]
+            f.read (nbytes + (-nbytes) % 4)
+        nc_type, _, begin = read ('I'), read (count), read (offset)
+
+        # Sizes from the dimensions; vsize overflows for > 4 GiB variables
+        is_record = len (dimids) > 0 and dims[dimids[0]] == 0
+        nvalues = 1
+        for dimid in dimids[1:] if is_record else dimids: nvalues *= dims[dimid]
+        nbytes = nvalues * cdf_type_sizes[nc_type]
+        if is_record: records.append ((begin, nbytes))
+        else: fixed_end = max (fixed_end, begin + nbytes)
+
+    # Records interleave all record variables, each padded to 4 bytes
+    if len (records) == 0 or numrecs in [0, 2**32 - 1, 2**64 - 1]: return fixed_end
+    recsize = records[0][1] if len (records) == 1 else sum (nbytes + (-nbytes) % 4 for _, nbytes in records)
+    return max ([fixed_end] + [begin + (numrecs - 1) * recsize + nbytes for begin, nbytes in records])
+
+def get_hdf5_size (f, start):
+
+    # End-of-file address from the HDF5 superblock (relative to its base)
+    f.seek (start + len (hdf5_magic))
+    version = f.read (1)[0]
+    if version in [0, 1]:
+        f.seek (start + 13)
+        noffset = f.read (1)[0]
+        f.seek (start + (24 if version == 0 else 28))
+    else:
+        noffset = f.read (1)[0]
+        f.seek (start + 12)
+    code = {4:'<I', 8:'<Q'}[noffset]
+    base, _, eof = [struct.unpack (code, f.read (noffset))[0] for _ in range (3)]
+    return base + eof
+
+def check_netcdf (afile):
+
+    # True if afile starts like a netCDF file and is not shorter than its
+    # header says it should be
+    try:
+        size = os.path.getsize (afile)
+        with open (afile, 'rb') as f:
+            magic = f.read (4)
+            if magic[:3] == cdf_magic and magic[3] in [1, 2, 5]:
+                return size >= get_cdf_size (f, magic[3])
+            # The HDF5 superblock sits at 0, 512, 1024, 2048 ... bytes
+            start = 0
+            while start + len (hdf5_magic) <= size:
+                f.seek (start)
+                if f.read (len (hdf5_magic)) == hdf5_magic:
+                    return size >= get_hdf5_size (f, start)
+                start = 512 if start == 0 else start * 2
+    except (struct.error, KeyError, IndexError, OSError):
+        pass
+    return False
+
+def download_one (url, afile):
+
+    # Returns 'skipped', 'downloaded', 'bad' or 'failed'
+    try:
+        remote_size = get_remote_size (url)
+    except (requests.exceptions.RequestException, ftplib.all_errors) as error:
+        print ('|    - {0} failed: {1}'.format (os.path.basename (afile), error))
+        return 'failed'
+
+    if os.path.exists (afile) and remote_size is not None and \
+       os.path.getsize (afile) == remote_size:
+        return 'skipped'
+    # Already found truncated on the server and not replaced since
+    if os.path.exists (afile + '.bad') and remote_size is not None and \
+       os.path.getsize (afile + '.bad') == remote_size:
+        return 'bad'
+
+    partfile = afile + '.part'
+    for _ in range (n_retries):
+        offset = os.path.getsize (partfile) if os.path.exists (partfile) else 0
+        # A .part longer than the remote file is stale
+        if remote_size is not None and offset > remote_size: offset = 0
+        try:
+            if remote_size is None or offset < remote_size: fetch (url, partfile, offset)
+        except (requests.exceptions.RequestException, ftplib.all_errors) as error:
+            print ('|    - {0} interrupted ({1}); resuming'.format (os.path.basename (afile), error))
+            continue
+        if remote_size is None or os.path.getsize (partfile) == remote_size: break
+    else:
+        print ('|    - {0} failed after {1} tries'.format (os.path.basename (afile), n_retries))
+        return 'failed'
+
+    if not check_netcdf (partfile):
+        os.replace (partfile, afile + '.bad')
+        print ('|    - {0} is truncated or not netCDF; kept as .bad'.format (os.path.basename (afile)))
+        return 'bad'
+    os.replace (partfile, afile)
+    return 'downloaded'
+
+def download_netcdf (filetype, year, datapath, url=None, months=None, nworkers=None):
+
+    if url is None: url = base_url
+    if nworkers is None: nworkers = n_workers
+    if months is None: months = list_months (year, url=url)
+    print ('|    - {0} months are available for {1}'.format (len (months), year))
+
+    jobs = []
+    for yyyymm in months:
+        subdatapath = os.path.join (datapath, yyyymm)
+        if not os.path.exists (subdatapath): os.makedirs (subdatapath)
+        jobs += [(fileurl, os.path.join (subdatapath, name))
+                 for fileurl, name in list_files (filetype, yyyymm, url=url)]
+    print ('|    - {0} {1} files are listed'.format (len (jobs), filetype))
+
+    with ThreadPoolExecutor (max_workers=nworkers) as executor:
+        statuses = list (executor.map (lambda job: download_one (*job), jobs))
+
+    counts = {status:statuses.count (status) for status in ['downloaded', 'skipped', 'bad', 'failed']}
+    print ('|    - {downloaded} downloaded, {skipped} skipped, {bad} bad, {failed} failed'.format (**counts))
+    return dict (zip ([afile for _, afile in jobs], statuses))
+
+#####################################
+## Script starts here!
+#####################################
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser (description='Download CBOFS forecast outputs.')
+    parser.add_argument ('filetype', choices=['stations', 'fields'])
+    parser.add_argument ('year')
+    parser.add_argument ('datapath')
+    parser.add_argument ('--url', default=base_url, help='server holding YYYYMM/ folders')
+    parser.add_argument ('--months', nargs='*', help='YYYYMM to download; all if omitted')
+    parser.add_argument ('--nworkers', type=int, default=n_workers)
+    args = parser.parse_args ()
+
+    download_netcdf (args.filetype, args.year, args.datapath, url=args.url,
+                     months=args.months, nworkers=args.nworkers)
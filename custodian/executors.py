@@ -0,0 +1,87 @@
+#!/home/elims/envs/py37/bin/python
+
+## This python hands out independent tasks, e.g. one per month sub-folder
+## of the archive, to a pluggable executor. Every executor has the same
+## map () as concurrent.futures and gives results back in task order:
+##
+##   'serial'  - in this process
+##   'process' - a local process pool
+##   'dask'    - a dask.distributed scheduler at the given address, or a
+##               LocalCluster on this machine when there is none
+##
+## Workers of a remote scheduler must be able to import the custodian/
+## scripts (e.g. via PYTHONPATH) and see the same data and output paths.
+#########################################################################
+
+#####################################
+## Import packages
+#####################################
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor
+
+#####################################
+## Define constants
+#####################################
+kinds = ['serial', 'process', 'dask']
+
+#####################################
+## Define functions
+#####################################
+class SerialExecutor (Executor):
+
+    def map (self, function, *iterables, timeout=None, chunksize=1):
+
+        # Lazy, so each task only runs when its result is asked for
+        return map (function, *iterables)
+
+class DaskExecutor (Executor):
+
+    def __init__ (self, address=None, nworkers=None):
+
+        # dask is only needed when asked for
+        try:
+            from dask.distributed import Client, LocalCluster
+        except ImportError:
+            raise ImportError ('The dask executor needs dask.distributed to be installed.')
+
+        self.cluster = None
+        if address is None:
+            # One single-threaded process per worker, as in the process pool
+            self.cluster = LocalCluster (n_workers=nworkers, threads_per_worker=1, processes=True,
+                                         dashboard_address=None)
+            address = self.cluster
+        self.client = Client (address)
+
+    def submit (self, function, *args, **kwargs):
+
+        return self.client.submit (function, *args, pure=False, **kwargs)
+
+    def map (self, function, *iterables, timeout=None, chunksize=1):
+
+        # All tasks go to the scheduler at once; results are gathered in
+        # order and released from the workers as soon as they are read.
+        futures = self.client.map (function, *iterables, pure=False)
+        futures.reverse ()
+        def results ():
+            try:
+                while len (futures) > 0:
+                    yield futures.pop ().result (timeout=timeout)
+            finally:
+                self.client.cancel (futures)
+        return results ()
+
+    def shutdown (self, wait=True, **kwargs):
+
+        self.client.close ()
+        if self.cluster is not None: self.cluster.close ()
+
+def get_executor (kind='process', nworkers=None, address=None):
+
+    # A process pool of one worker is just a slower serial executor
+    if nworkers is None: nworkers = os.cpu_count ()
+    if kind == 'process' and nworkers <= 1: kind = 'serial'
+
+    if kind == 'serial': return SerialExecutor ()
+    if kind == 'process': return ProcessPoolExecutor (max_workers=nworkers)
+    if kind == 'dask': return DaskExecutor (address=address, nworkers=nworkers)
+    raise ValueError ('Unknown executor {0}; expected one of {1}.'.format (kind, kinds))
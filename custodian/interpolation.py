@@ -0,0 +1,278 @@
+#!/home/elims/envs/py37/bin/python
+
+## This python builds the weights that interpolate OFS node values onto
+## arbitrary target points (e.g. gauges), once, as a sparse matrix
+##
+##   W (ntarget, nnode), target values = W . node values
+##
+## so that thousands of targets cost one sparse matrix product, whether
+## the node values are time-series (nnode, ntime) or complex harmonic
+## constants amp * exp (i pha) (nnode, nconsti).
+##
+## A target inside a wet triangle takes the barycentric weights of its 3
+## corners. With grid indices (fields store), triangles are the halves of
+## the rho-grid cells whose corners are wet, so that no triangle crosses
+## land. Without them (stations store), triangles come from a Delaunay
+## triangulation of the nodes minus those with an edge longer than
+## max_edge_km, which are the ones spanning land or open boundaries.
+## Targets outside every triangle fall back to an inverse-distance stencil
+## of their nearest wet nodes, and those beyond max_distance_km of any
+## node get no weights (NaN).
+#########################################################################
+
+#####################################
+## Import packages
+#####################################
+import numpy, pickle, hashlib, os
+from scipy.sparse import csr_matrix
+from scipy.spatial import cKDTree, Delaunay
+import spatial_index
+
+#####################################
+## Define constants
+#####################################
+earth_radius = 6373. # km
+
+# Delaunay triangles with a longer edge are dropped (no grid indices)
+max_edge_km = 5.
+
+# Triangles, by nearest centroid, tried for each target
+n_candidates = 12
+
+# Inverse-distance fallback: up to n_neighbors nodes within max_distance_km,
+# and no further than max_spread times the nearest one, so that a node
+# across a point of land does not creep into a coastal stencil
+n_neighbors = 4
+max_distance_km = 10.
+max_spread = 2.
+idw_power = 2
+
+# Targets located at once; bounds the candidate arrays
+points_per_block = 65536
+
+# Stencil of each target
+stencil_names = numpy.array (['none', 'triangle', 'idw'])
+
+#####################################
+## Define functions
+#####################################
+weights_file_of = lambda storefile: os.path.splitext (storefile)[0] + '.weights.pkl'
+
+def to_plane (lats, lons, origin):
+
+    # Local (x, y) in km around origin (lat, lon)
+    lats = numpy.asarray (lats, dtype=float)
+    lons = numpy.asarray (lons, dtype=float)
+    x = earth_radius * numpy.cos (numpy.radians (origin[0])) * numpy.radians (lons - origin[1])
+    y = earth_radius * numpy.radians (lats - origin[0])
+    return numpy.stack ([x, y], axis=-1)
+
+def get_checksum (lats, lons, target_lats, target_lons, etas=None, xis=None):
+
+    # Identifies the nodes, the targets and the settings the weights are for
+    md5 = hashlib.md5 ()
+    for array in [lats, lons, target_lats, target_lons]:
+        md5.update (numpy.ascontiguousarray (array, dtype=float).tobytes ())
+    if etas is not None:
+        md5.update (numpy.ascontiguousarray (etas, dtype=numpy.int64).tobytes ())
+        md5.update (numpy.ascontiguousarray (xis, dtype=numpy.int64).tobytes ())
+    md5.update (str ((max_edge_km, n_neighbors, max_distance_km, max_spread, idw_power)).encode ())
+    return md5.hexdigest ()
+
+def get_grid_triangles (etas, xis, is_wet):
+
+    # Wet cells give two triangles; cells with one dry corner give the
+    # triangle of the other three
+    etas, xis = numpy.asarray (etas, dtype=int), numpy.asarray (xis, dtype=int)
+    lookup = numpy.full ((etas.max () + 2, xis.max () + 2), -1, dtype=int)
+    wet = numpy.where (is_wet)[0]
+    lookup[etas[wet], xis[wet]] = wet
+
+    # Corners of the cell starting at each wet node, counter-clockwise
+    corners = numpy.stack ([wet, lookup[etas[wet], xis[wet] + 1],
+                            lookup[etas[wet] + 1, xis[wet] + 1],
+                            lookup[etas[wet] + 1, xis[wet]]], axis=1)
+    is_corner = corners >= 0
+    nwet = is_corner.sum (axis=1)
+
+    full = corners[nwet == 4]
+    triangles = [full[:, [0, 1, 2]], full[:, [0, 2, 3]]]
+    partial = corners[nwet == 3]
+    dry = numpy.argmin (partial >= 0, axis=1)
+    for corner in range (4):
+        keep = [index for index in range (4) if index != corner]
+        triangles.append (partial[dry == corner][:, keep])
+    return numpy.concatenate (triangles)
+
+def get_delaunay_triangles (points, is_wet, max_edge=None):
+
+    # Delaunay triangles of the wet nodes without overly long edges
+    if max_edge is None: max_edge = max_edge_km
+    wet = numpy.where (is_wet)[0]
+    if len (wet) < 3: return numpy.zeros ((0, 3), dtype=int)
+    triangles = wet[Delaunay (points[wet]).simplices]
+    corners = points[triangles]
+    edges = numpy.linalg.norm (corners - numpy.roll (corners, 1, axis=1), axis=2)
+    return triangles[(edges <= max_edge).all (axis=1)]
+
+def locate_triangles (points, vertices, triangles):
+
+    # Triangle containing each point (-1 if none) and the barycentric
+    # weights of its corners
+    npoint = len (points)
+    found = numpy.full (npoint, -1, dtype=int)
+    weights = numpy.zeros ((npoint, 3))
+    if len (triangles) == 0 or npoint == 0: return found, weights
+
+    k = min (n_candidates, len (triangles))
+    tree = cKDTree (vertices[triangles].mean (axis=1))
+    for start in range (0, npoint, points_per_block):
+        block = slice (start, min (start + points_per_block, npoint))
+        _, candidates = tree.query (points[block], k=k)
+        candidates = candidates.reshape (len (candidates), -1)
+
+        corners = vertices[triangles[candidates]]
+        v0 = corners[:, :, 1] - corners[:, :, 0]
+        v1 = corners[:, :, 2] - corners[:, :, 0]
+        v2 = points[block][:, None, :] - corners[:, :, 0]
+        with numpy.errstate (divide='ignore', invalid='ignore'):
+            denominator = v0[..., 0] * v1[..., 1] - v1[..., 0] * v0[..., 1]
+            l1 = (v2[..., 0] * v1[..., 1] - v1[..., 0] * v2[..., 1]) / denominator
+            l2 = (v0[..., 0] * v2[..., 1] - v2[..., 0] * v0[..., 1]) / denominator
+        barycentric = numpy.stack ([1. - l1 - l2, l1, l2], axis=-1)
+        is_inside = (barycentric >= -1e-9).all (axis=-1) & (denominator != 0)
+
+        # First (closest centroid) candidate that holds the point
+        first = numpy.argmax (is_inside, axis=1)
+        is_found = is_inside[numpy.arange (len (first)), first]
+        rows = numpy.where (is_found)[0]
+        found[block][rows] = candidates[rows, first[rows]]
+        weights[block][rows] = numpy.clip (barycentric[rows, first[rows]], 0., 1.)
+    return found, weights
+
+def get_idw_stencils (lats, lons, node_index):
+
+    # Nodes and normalized inverse-distance weights, (npoint, n_neighbors)
+    # with -1 / 0 for unused slots
+    distances, indices = node_index.query (lats, lons, k=n_neighbors, max_distance=max_distance_km)
+    is_used = (indices >= 0) & (distances <= max_spread * distances[:, :1])
+
+    # A point on top of a node takes that node alone
+    on_node = distances[:, 0] < 1e-6
+    is_used[on_node, 1:] = False
+    with numpy.errstate (divide='ignore'):
+        weights = numpy.where (is_used, 1. / distances**idw_power, 0.)
+    weights[on_node, 0] = 1.
+    totals = weights.sum (axis=1, keepdims=True)
+    weights = numpy.divide (weights, totals, out=numpy.zeros_like (weights), where=totals > 0)
+    return numpy.where (is_used, indices, -1), weights, distances[:, 0]
+
+class InterpolationWeights (object):
+
+    def __init__ (self, lats, lons, target_lats, target_lons, etas=None, xis=None, node_index=None):
+
+        lats = numpy.asarray (lats, dtype=float)
+        lons = numpy.asarray (lons, dtype=float)
+        target_lats = numpy.atleast_1d (numpy.asarray (target_lats, dtype=float))
+        target_lons = numpy.atleast_1d (numpy.asarray (target_lons, dtype=float))
+        self.checksum = get_checksum (lats, lons, target_lats, target_lons, etas=etas, xis=xis)
+        ntarget, nnode = len (target_lats), len (lats)
+
+        # Nodes without coordinates (e.g. masked) are never used
+        is_wet = numpy.isfinite (lats) & numpy.isfinite (lons)
+        if node_index is None: node_index = spatial_index.NodeIndex (lats, lons)
+        origin = (numpy.nanmean (lats), numpy.nanmean (lons))
+        vertices = to_plane (numpy.where (is_wet, lats, origin[0]), numpy.where (is_wet, lons, origin[1]),
+                             origin)
+        points = to_plane (target_lats, target_lons, origin)
+
+        if etas is not None:
+            triangles = get_grid_triangles (etas, xis, is_wet)
+        else:
+            triangles = get_delaunay_triangles (vertices, is_wet)
+        found, barycentric = locate_triangles (points, vertices, triangles)
+
+        # Triangle stencils first, inverse distance for the rest
+        self.stencils = numpy.zeros (ntarget, dtype=numpy.int8)
+        in_triangle = found >= 0
+        self.stencils[in_triangle] = 1
+        columns = numpy.full ((ntarget, max (3, n_neighbors)), -1, dtype=int)
+        values = numpy.zeros (columns.shape)
+        columns[in_triangle, :3] = triangles[found[in_triangle]]
+        values[in_triangle, :3] = barycentric[in_triangle]
+
+        idw_columns, idw_values, self.nearest_dist = get_idw_stencils (target_lats, target_lons,
+                                                                       node_index)
+        outside = numpy.where (~in_triangle & (idw_columns[:, 0] >= 0))[0]
+        self.stencils[outside] = 2
+        columns[outside, :n_neighbors] = idw_columns[outside]
+        values[outside, :n_neighbors] = idw_values[outside]
+
+        # Exact zeros (e.g. a target on a triangle edge) are not stored
+        is_used = (columns >= 0) & (values > 0)
+        rows = numpy.broadcast_to (numpy.arange (ntarget)[:, None], columns.shape)
+        self.matrix = csr_matrix ((values[is_used], (rows[is_used], columns[is_used])),
+                                  shape=(ntarget, nnode))
+        if (self.stencils == 0).any ():
+            print ('{0} of {1} targets have no wet node within {2} km.'.format (
+                   (self.stencils == 0).sum (), ntarget, max_distance_km))
+
+    def get_stencils (self):
+
+        return stencil_names[self.stencils]
+
+    def get_nodes (self):
+
+        # Nodes that any target uses, sorted
+        return numpy.unique (self.matrix.indices)
+
+    def apply (self, values, nodes=None):
+
+        # values: (nnode, ...) at every node, or at the given nodes (e.g.
+        # get_nodes ()) only. Returns (ntarget, ...); NaN where no stencil.
+        values = numpy.asarray (values)
+        matrix = self.matrix if nodes is None else self.matrix[:, numpy.asarray (nodes, dtype=int)]
+        shape = values.shape[1:]
+        results = numpy.asarray (matrix.dot (values.reshape (len (values), -1)))
+        if numpy.issubdtype (results.dtype, numpy.integer): results = results.astype (float)
+        results[self.stencils == 0] = numpy.nan
+        return results.reshape ((len (results),) + shape)
+
+    def save (self, afile):
+
+        with open (afile + '.tmp', 'wb') as f:
+            pickle.dump (self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace (afile + '.tmp', afile)
+
+def load_weights (afile, checksum=None):
+
+    # Returns None if missing, or if built for other nodes / targets
+    if not os.path.exists (afile): return None
+    with open (afile, 'rb') as f:
+        weights = pickle.load (f)
+    if checksum is not None and weights.checksum != checksum: return None
+    return weights
+
+def get_weights (lats, lons, target_lats, target_lons, etas=None, xis=None, node_index=None,
+                 afile=None):
+
+    # Reuse the persisted weights when they match; otherwise build and save
+    if afile is not None:
+        checksum = get_checksum (lats, lons, numpy.atleast_1d (target_lats), numpy.atleast_1d (target_lons),
+                                 etas=etas, xis=xis)
+        weights = load_weights (afile, checksum=checksum)
+        if weights is not None: return weights
+
+    weights = InterpolationWeights (lats, lons, target_lats, target_lons, etas=etas, xis=xis,
+                                    node_index=node_index)
+    if afile is not None: weights.save (afile)
+    return weights
+
+def interpolate_constants (weights, amps, phases, nodes=None):
+
+    # amps (m) / phases (deg): (nconsti, nnode), or at the given nodes.
+    # Constants are blended as complex amplitudes, so that phases near
+    # 0 / 360 deg and amplitudes across a phase change blend properly.
+    complexes = numpy.asarray (amps) * numpy.exp (1j * numpy.radians (phases))
+    results = weights.apply (complexes.T, nodes=nodes).T
+    return numpy.abs (results), numpy.mod (numpy.degrees (numpy.angle (results)), 360.)
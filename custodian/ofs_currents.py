@@ -0,0 +1,91 @@
+#!/home/elims/envs/py37/bin/python
+
+## This python pulls the horizontal currents out of CBOFS netcdf files,
+## for both the station files and the gridded "fields" files:
+##
+##   * one depth level is kept: 'surface' (top s_rho layer), 'bottom'
+##     (first s_rho layer), an s_rho index, or 'depth_averaged' (ubar /
+##     vbar);
+##   * field velocities sit on the staggered u / v points and are moved
+##     to the rho points by averaging the (wet) faces on either side;
+##   * ROMS velocities are along the grid axes; with an 'angle' variable
+##     they are rotated to east / north.
+##
+## Velocities are in m/s.
+#########################################################################
+
+#####################################
+## Import packages
+#####################################
+import numpy
+
+#####################################
+## Define constants
+#####################################
+# Depth level of the currents extracted by default
+default_level = 'surface'
+
+# Variables for each kind of level
+level_variables = {'depth_averaged':('ubar', 'vbar')}
+layer_variables = ('u', 'v')
+
+#####################################
+## Define functions
+#####################################
+def get_variables (level):
+
+    return level_variables.get (level, layer_variables)
+
+def select_level (values, level, axis):
+
+    # One s_rho layer of values; depth-averaged values have no layer axis
+    if level in level_variables: return values
+    layer = {'surface':-1, 'bottom':0}.get (level, level)
+    return numpy.take (values, int (layer), axis=axis)
+
+def rotate (u, v, angles):
+
+    # Grid-axis components to east / north; angles (rad) broadcast to u
+    if angles is None: return u, v
+    cosines, sines = numpy.cos (angles), numpy.sin (angles)
+    return u * cosines - v * sines, u * sines + v * cosines
+
+def average_faces (values, axis):
+
+    # Mean of the two faces around each rho point along axis, ignoring dry
+    # (NaN) faces; the outermost rho points take their only face
+    values = numpy.moveaxis (values, axis, -1)
+    shape = values.shape[:-1] + (values.shape[-1] + 1,)
+    sums, counts = numpy.zeros (shape), numpy.zeros (shape)
+    is_wet = numpy.isfinite (values)
+    filled = numpy.where (is_wet, values, 0.)
+    for offset in [0, 1]:
+        sums[..., offset:offset+values.shape[-1]] += filled
+        counts[..., offset:offset+values.shape[-1]] += is_wet
+    with numpy.errstate (invalid='ignore'):
+        averages = sums / counts
+    return numpy.moveaxis (averages, -1, axis)
+
+def read_station_currents (one_data, steps, stations, level=None):
+
+    # (nstep, nstation) east / north velocities at the OFS stations.
+    # Station files are (ocean_time, station[, s_rho]).
+    if level is None: level = default_level
+    uname, vname = get_variables (level)
+    u = select_level (one_data.variables[uname][steps, stations].values, level, axis=2)
+    v = select_level (one_data.variables[vname][steps, stations].values, level, axis=2)
+    angles = one_data.variables['angle'][stations].values if 'angle' in one_data.variables else None
+    return rotate (u.astype (float), v.astype (float), angles)
+
+def read_field_currents (one_data, steps, level=None):
+
+    # (nstep, eta_rho, xi_rho) east / north velocities on the rho grid.
+    # Field files are (ocean_time[, s_rho], eta_u, xi_u) and
+    # (ocean_time[, s_rho], eta_v, xi_v).
+    if level is None: level = default_level
+    uname, vname = get_variables (level)
+    u = select_level (one_data.variables[uname][steps].values.astype (float), level, axis=1)
+    v = select_level (one_data.variables[vname][steps].values.astype (float), level, axis=1)
+    u, v = average_faces (u, axis=2), average_faces (v, axis=1)
+    angles = one_data.variables['angle'].values if 'angle' in one_data.variables else None
+    return rotate (u, v, angles)
@@ -0,0 +1,154 @@
+#!/home/elims/envs/py37/bin/python
+
+## This python streams the water levels from CBOFS "fields" files (the
+## full curvilinear grid) into a chunked, node-major HDF5 array. Only wet
+## nodes (mask_rho == 1) are kept. Each file is decoded a few time steps
+## at a time and written out in whole chunks, so memory is bounded by
+## one chunk of times over the wet nodes no matter how long the record.
+#########################################################################
+
+#####################################
+## Import packages
+#####################################
+import numpy, pandas, xarray, glob, os
+from natsort import natsorted
+import ofs_store, ofs_currents
+from ofs_massager import get_cycle_start, lead_window
+
+#####################################
+## Define constants
+#####################################
+fieldspath = '/home/elims/projects/cbofs/fields/'
+outpath = '/home/elims/projects/cbofs/outputs/'
+fieldsFile = outpath + 'ofs_fields_zeta.h5'
+
+# Time steps decoded from a file at once
+steps_per_read = 6
+
+# Also keep the east / north currents on the rho grid as the "u" / "v"
+# fields, at this level (see ofs_currents.py); None for water levels only
+current_level = None
+
+#####################################
+## Define functions
+#####################################
+def list_fields_files ():
+
+    allSubPaths = natsorted (glob.glob (fieldspath + '*/'))
+    return [afile for subpath in allSubPaths
+            for afile in natsorted (glob.glob (subpath + '*.nc'))]
+
+def read_grid (afile):
+
+    one_data = xarray.open_dataset (afile, decode_times=False)
+    lats = one_data.variables['lat_rho'].values
+    lons = one_data.variables['lon_rho'].values
+    if 'mask_rho' in one_data.variables:
+        is_wet = one_data.variables['mask_rho'].values == 1
+    else:
+        is_wet = numpy.isfinite (lats) & numpy.isfinite (lons)
+    one_data.close ()
+
+    etas, xis = numpy.where (is_wet)
+    return lats[etas, xis], lons[etas, xis], etas, xis, lats.shape
+
+def get_times (one_data):
+
+    # ocean_time is in e.g. "seconds since 2016-01-01 00:00:00"
+    ocean_time = one_data.variables['ocean_time']
+    units, reference = ocean_time.attrs['units'].split (' since ')
+    unit = {'seconds':'s', 'minutes':'min', 'hours':'h', 'days':'D'}[units.strip ().lower ()]
+    return pandas.to_datetime (reference) + pandas.to_timedelta (ocean_time.values, unit=unit)
+
+def iter_fields_file (afile, flat_nodes, names=('zeta',), leads=None, after=None, level=None):
+
+    # Yields (times, {name: (nnode, nstep) values}) within the lead window
+    # and after the given time, steps_per_read time steps at a time. The
+    # names "u" / "v" are the currents at level.
+    if leads is None: leads = lead_window
+    one_data = xarray.open_dataset (afile, decode_times=False)
+
+    times = get_times (one_data)
+    cycle = get_cycle_start (one_data)
+    lead_hours = (times - cycle) / pandas.Timedelta (hours=1)
+    is_kept = (lead_hours >= leads[0]) & (lead_hours < leads[1])
+    if after is not None: is_kept &= times > after
+    steps = numpy.where (is_kept)[0]
+
+    for index in range (0, len (steps), steps_per_read):
+        substeps = steps[index:index+steps_per_read]
+        window = slice (substeps[0], substeps[-1] + 1)
+        arrays = {}
+        if 'u' in names or 'v' in names:
+            arrays['u'], arrays['v'] = ofs_currents.read_field_currents (one_data, window, level=level)
+        for name in names:
+            if name not in arrays: arrays[name] = one_data.variables[name][window].values
+
+        blocks = {}
+        for name in names:
+            block = arrays[name]
+            block = block.reshape (len (block), -1)[substeps - substeps[0]][:, flat_nodes]
+            blocks[name] = block.T.astype (numpy.float32)
+        yield times[substeps], blocks
+
+    one_data.close ()
+
+def collect_fields_data (allfiles=None, names=None, leads=None):
+
+    if names is None: names = ('zeta',) if current_level is None else ('zeta', 'u', 'v')
+    if allfiles is None: allfiles = list_fields_files ()
+    if len (allfiles) == 0:
+        print ('No netcdf files found under {0}.'.format (fieldspath))
+        return
+
+    # The grid and wet nodes come from the first file
+    if not os.path.exists (fieldsFile):
+        lats, lons, etas, xis, grid_shape = read_grid (allfiles[0])
+        attrs = None if current_level is None else {'level':str (current_level)}
+        ofs_store.create_fields (fieldsFile, lats, lons, etas, xis, grid_shape, names=names, attrs=attrs)
+    nodes = ofs_store.read_nodes (fieldsFile)
+    grid_shape = ofs_store.read_grid_shape (fieldsFile)
+    flat_nodes = nodes.eta.values * grid_shape[1] + nodes.xi.values
+
+    # Anything at or before the last stored time is skipped
+    last_time = ofs_store.read_last_time (fieldsFile)
+    buffered_times, buffered = [], {name:[] for name in names}
+    nbuffered, nwritten = 0, 0
+    for afile in allfiles:
+        for times, blocks in iter_fields_file (afile, flat_nodes, names=names, leads=leads,
+                                               after=last_time, level=current_level):
+            buffered_times.append (times)
+            for name in names:
+                buffered[name].append (blocks[name])
+            nbuffered += len (times)
+            last_time = times[-1]
+
+            # Write whole chunks of times; keep the remainder for later
+            if nbuffered >= ofs_store.fields_time_chunk:
+                nflush = nbuffered - nbuffered % ofs_store.fields_time_chunk
+                buffered_times, buffered, nbuffered = flush_fields (buffered_times, buffered, nflush)
+                nwritten += nflush
+
+    flush_fields (buffered_times, buffered, nbuffered)
+    nwritten += nbuffered
+    print ('{0} time steps at {1} wet nodes written'.format (nwritten, len (nodes)))
+
+def flush_fields (buffered_times, buffered, nflush):
+
+    if nflush == 0: return buffered_times, buffered, 0
+    times = buffered_times[0].append (buffered_times[1:]) if len (buffered_times) > 1 else buffered_times[0]
+    blocks = {name:numpy.concatenate (values, axis=1) for name, values in buffered.items ()}
+    ofs_store.append_fields (fieldsFile, times[:nflush],
+                             {name:values[:, :nflush] for name, values in blocks.items ()})
+
+    nleft = len (times) - nflush
+    if nleft == 0: return [], {name:[] for name in buffered}, 0
+    return [times[nflush:]], {name:[values[:, nflush:]] for name, values in blocks.items ()}, nleft
+
+#####################################
+## Script starts here!
+#####################################
+
+if __name__ == '__main__':
+
+    collect_fields_data ()
@@ -9,125 +9,477 @@
 #####################################
 ## Import packages
 #####################################
-import numpy, pandas, xarray, glob
-from datetime import datetime
+import numpy, pandas, xarray, glob, os, json, hashlib
+import ofs_store, ofs_currents, run_report, executors
+from station_registry import StationHeights, find_nodes, make_registry
 from natsort import natsorted
-
-import matplotlib
-matplotlib.use ('Agg')
-import matplotlib.pyplot as plt
-import matplotlib.gridspec as gridspec
-plt.rc ('text', usetex=False)
-plt.rc ('font', family='sans-serif')
-plt.rc ('font', serif='Computer Modern Roman')
+from functools import partial
 
 #####################################
 ## Define constants
 #####################################
 datapath = '/home/elims/projects/cbofs/data/'
 outpath = '/home/elims/projects/cbofs/outputs/'
+heightsFile = outpath + 'ofs_all_heights.h5'
+manifestFile = outpath + 'ofs_manifest.json'
 
 ofs_start_date = pandas.to_datetime ("2016-01-01 00:00:00")
 n_minutes_per_day = 24 * 60
+n_minutes_per_step = 6
+
+# Forecast hours kept from each cycle i.e. [begin, end)
+lead_window = (0, 6)
+
+# Number of processes reading netcdf files in parallel; 1 reads serially.
+n_workers = os.cpu_count ()
+
+# Only read files that are new / changed since the last run. Files are
+# compared by size and mtime, or by md5 checksum if use_checksum is set.
+incremental = True
+use_checksum = False
+
+# Plots (see ofs_plotter.py) can be switched off entirely. With
+# multipage_plots, all stations go into a few multi-page PDFs instead of
+# one PDF per station.
+make_plots = True
+multipage_plots = False
+
+# Per-stage time / memory / IO report (see run_report.py). Set
+# profile_stage to a stage name to also dump its cProfile stats.
+reportFile = outpath + 'ofs_massager_report.json'
+profile_stage = None
+
+# Keep the full forecast of every cycle (cycle x lead x station) for lead
+# time studies; the lead_window series is then taken from that store so
+# each file is still only read once.
+store_cycles = True
+cycleFile = outpath + 'ofs_all_cycles.h5'
+
+# Files are read by executor_kind (see executors.py): 'process' for a
+# local pool of n_workers, 'dask' for a dask.distributed scheduler at
+# scheduler_address (a local cluster if None), or 'serial'. With
+# partition_by_month, each month sub-folder is one task whose partial
+# result is then merged into the stores; partial cycle stores are written
+# under partitionPath, which remote workers must share.
+executor_kind = 'process'
+scheduler_address = None
+partition_by_month = False
+partitionPath = outpath + 'partitions/'
+
+# Also keep the east / north currents of the same stations and times, at
+# current_level (see ofs_currents.py), in a store laid out like the heights
+extract_currents = False
+current_level = 'surface'
+currentsFile = outpath + 'ofs_all_currents.h5'
 
 #####################################
 ## Define functions
 #####################################
-def read_one_file (afile):
+def select_stations (lats, lons, indices=None, bbox=None, station_ids=None):
+
+    # Start with every station, then narrow down by each given criterion
+    selected = numpy.ones (len (lats), dtype=bool)
+
+    # Explicit OFS station indices
+    if indices is not None:
+        is_index = numpy.zeros (len (lats), dtype=bool)
+        is_index[numpy.array (indices, dtype=int)] = True
+        selected &= is_index
+
+    # Bounding box as (min lat, max lat, min lon, max lon)
+    if bbox is not None:
+        minlat, maxlat, minlon, maxlon = bbox
+        selected &= (lats >= minlat) & (lats <= maxlat) & \
+                    (lons >= minlon) & (lons <= maxlon)
+
+    # CO-OPS station IDs resolved to their nearest OFS station
+    if station_ids is not None:
+        from ofs_obs_massager import pull_stations, get_distance
+        metadata = pull_stations ({sid:sid for sid in station_ids})
+        if metadata is None: return None
+        is_nearest = numpy.zeros (len (lats), dtype=bool)
+        for row in metadata.itertuples ():
+            distances = get_distance ((row.lat, row.lon), (lats, lons))
+            is_nearest[numpy.nanargmin (distances)] = True
+        selected &= is_nearest
+
+    return numpy.where (selected)[0]
+
+def get_cycle_start (one_data):
+
+    # dstart is in days since ofs_start_date
+    start_min = float (one_data.variables['dstart'].values) * n_minutes_per_day
+    return ofs_start_date + pandas.to_timedelta (start_min, unit='min')
+
+def get_registry (one_data, stations=None):
+
+    # Typed station registry of the requested OFS stations (all by default)
+    nstation = one_data.variables['lat_rho'].shape[0]
+    nodes = numpy.arange (nstation) if stations is None else numpy.arange (nstation)[stations]
+    lats = one_data.variables['lat_rho'].values[nodes]
+    lons = one_data.variables['lon_rho'].values[nodes]
+
+    # Station names are kept when the file has them, as (station, char)
+    names = None
+    if 'name_station' in one_data.variables:
+        chars = one_data.variables['name_station'].values[nodes]
+        if chars.ndim == 2: chars = [b''.join (row) for row in chars]
+        names = [name.decode ('utf-8', 'ignore').strip () if isinstance (name, bytes) else
+                 str (name).strip () for name in chars]
+    return make_registry (lats, lons, nodes=nodes, names=names)
+
+def get_steps (leads=None):
+
+    # Time steps of the lead window (hours) in one forecast
+    if leads is None: leads = lead_window
+    n_steps_per_hour = 60 // n_minutes_per_step
+    return slice (int (leads[0] * n_steps_per_hour), int (leads[1] * n_steps_per_hour))
+
+def read_currents_of (one_data, times, steps, stations, registry):
 
+    # {'u':, 'v':} StationHeights of east / north currents at current_level
+    u, v = ofs_currents.read_station_currents (one_data, steps, stations, level=current_level)
+    return {'u':StationHeights (times, u, registry), 'v':StationHeights (times, v, registry)}
+
+def read_one_file (afile, stations=None, leads=None, currents=False):
+
+    # With currents, {'heights':, 'u':, 'v':} read from the same open file
     one_data = xarray.open_dataset (afile, decode_times=False)
-    
-    # Get lat / lon of the stations
-    lats = one_data.variables['lat_rho'].data
-    lons = one_data.variables['lon_rho'].data
-    
-    # collect water level - only 6 hours i.e. 10 * 6
-    heights = one_data.variables['zeta'].data[:60, :].T # meters; MLLW
+
+    # Only decode the requested stations and lead times; slicing the
+    # lazy variables before .values keeps the rest on disk.
+    registry = get_registry (one_data, stations=stations)
+    if stations is None: stations = slice (None)
+    steps = get_steps (leads)
+
+    # collect water level - only 6 hours i.e. 10 * 6 by default
+    heights = one_data.variables['zeta'][steps, stations].values # meters; MLLW
 
     # collect time
-    start_min = one_data.variables['dstart'].data * n_minutes_per_day
-    start_day = ofs_start_date + pandas.offsets.Minute (start_min) 
-    times = [start_day + index * pandas.offsets.Minute (6) for index in range (heights.shape[1])]
+    times = get_cycle_start (one_data) + pandas.to_timedelta (
+            (steps.start + numpy.arange (heights.shape[0])) * n_minutes_per_step, unit='min')
+    heights = StationHeights (times, heights, registry)
+    if currents:
+        heights = dict (heights=heights, **read_currents_of (one_data, times, steps, stations, registry))
 
     # Close file before leaving
     one_data.close ()
 
-    # Convert data into a dataframe
-    adict = {'datetime': times}
-    for index, (lat, lon) in enumerate (zip (lats, lons)):
-        column = str (lat) + '_' + str (lon)
-        adict[column] = heights[index]
+    return heights
+
+def concat_parts (parts):
+
+    # Merge the parts of many files: StationHeights, or dicts of them
+    if isinstance (parts[0], dict):
+        return {name:StationHeights.concat ([part[name] for part in parts]) for name in parts[0]}
+    return StationHeights.concat (parts)
+
+def read_one_cycle (afile, stations=None, leads=None, currents=False):
+
+    # The whole forecast of one cycle: start time, (nlead, nstation) heights
+    # and, with currents, the lead window currents as read_one_file
+    one_data = xarray.open_dataset (afile, decode_times=False)
+    registry = get_registry (one_data, stations=stations) if currents else None
+    if stations is None: stations = slice (None)
+    start = get_cycle_start (one_data)
+    heights = one_data.variables['zeta'][:, stations].values.astype (numpy.float32)
+
+    parts = None
+    if currents:
+        steps = get_steps (leads)
+        nstep = len (range (*steps.indices (heights.shape[0])))
+        times = start + pandas.to_timedelta ((steps.start + numpy.arange (nstep)) * n_minutes_per_step,
+                                             unit='min')
+        parts = read_currents_of (one_data, times, steps, stations, registry)
+    one_data.close ()
+    return start, heights, parts
+
+def store_cycles_of (cycle_file, allfiles, stations=None, nworkers=None, kind=None,
+                     leads=None, currents=False):
+
+    # Store the full forecasts of allfiles, a few chunks of cycles at a time,
+    # and return the cycle start times and, with currents, the merged
+    # lead window currents.
+    if nworkers is None: nworkers = n_workers
+    if kind is None: kind = executor_kind
+
+    one_data = xarray.open_dataset (allfiles[0], decode_times=False)
+    registry = get_registry (one_data, stations=stations)
+    one_data.close ()
+
+    reader = partial (read_one_cycle, stations=stations, leads=leads, currents=currents)
+    nworkers = max (1, min (nworkers, len (allfiles)))
+    nbatch = ofs_store.cycle_chunk * nworkers
+    starts, parts = [], []
+    with executors.get_executor (kind, nworkers=nworkers, address=scheduler_address) as executor:
+        for index in range (0, len (allfiles), nbatch):
+            batch = allfiles[index:index+nbatch]
+            with run_report.stage ('decode'):
+                cycles = list (executor.map (reader, batch))
+            with run_report.stage ('store_cycles'):
+                # Forecasts of different lengths are padded to the longest
+                nlead = max (heights.shape[0] for _, heights, _ in cycles)
+                values = numpy.full ((len (cycles), nlead, len (registry)), numpy.nan, dtype=numpy.float32)
+                for row, (_, heights, _) in enumerate (cycles): values[row, :len (heights)] = heights
+                starts += [start for start, _, _ in cycles]
+                parts += [part for _, _, part in cycles if part is not None]
+                ofs_store.append_cycles (cycle_file, [start for start, _, _ in cycles], values,
+                                         registry, n_minutes_per_step)
+    return starts, concat_parts (parts) if len (parts) > 0 else None
+
+def store_month_cycles (month, stations=None, leads=None, currents=False, partition_path=None):
+
+    # One month task: its forecasts go into a partial cycle store of its own.
+    # The path comes from the caller, as remote workers import this module
+    # with its default constants.
+    if partition_path is None: partition_path = partitionPath
+    if not os.path.exists (partition_path): os.makedirs (partition_path)
+    partfile = os.path.join (partition_path, 'ofs_cycles_{0}.h5'.format (
+                             os.path.basename (os.path.dirname (month[0]))))
+    if os.path.exists (partfile): os.remove (partfile)
+
+    # The task itself runs in a worker: read its month serially
+    starts, parts = store_cycles_of (partfile, month, stations=stations, nworkers=1, kind='serial',
+                                     leads=leads, currents=currents)
+    return partfile, starts, parts
+
+def collect_ofs_cycles (cycle_file, allfiles, stations=None, leads=None, nworkers=None,
+                        by_month=False, currents=False):
+
+    # Store the full forecasts of allfiles and return their lead window
+    # series like collect_ofs_data, and their currents (None without).
+    if nworkers is None: nworkers = n_workers
+    if leads is None: leads = lead_window
+
+    if by_month:
+        # Map: one partial store per month; reduce: merge them in month order
+        months = get_months (allfiles)
+        nworkers = max (1, min (nworkers, len (months)))
+        starts, parts = [], []
+        storer = partial (store_month_cycles, stations=stations, leads=leads, currents=currents,
+                          partition_path=partitionPath)
+        with run_report.stage ('partitions'):
+            with executors.get_executor (executor_kind, nworkers=nworkers,
+                                         address=scheduler_address) as executor:
+                for partfile, month_starts, month_parts in executor.map (storer, months):
+                    with run_report.stage ('merge_cycles'):
+                        ofs_store.merge_cycles (cycle_file, partfile)
+                    os.remove (partfile)
+                    starts += month_starts
+                    if month_parts is not None: parts.append (month_parts)
+        currents = concat_parts (parts) if len (parts) > 0 else None
+    else:
+        starts, currents = store_cycles_of (cycle_file, allfiles, stations=stations, nworkers=nworkers,
+                                            leads=leads, currents=currents)
 
-    dataframe = pandas.DataFrame (adict)
-    dataframe.index = pandas.to_datetime (dataframe.datetime)
-    dataframe = dataframe.drop (axis=1, columns=['datetime'])
+    # Lead window series over the time span of these cycles
+    begin = min (starts) + pandas.Timedelta (hours=leads[0])
+    end = max (starts) + pandas.Timedelta (hours=leads[1]) - pandas.Timedelta (minutes=n_minutes_per_step)
+    return ofs_store.read_lead_window (cycle_file, leads, begin=begin, end=end), currents
 
-    return dataframe
+def resolve_stations (afile, indices=None, bbox=None, station_ids=None):
 
-def collect_ofs_data ():
+    # Station criteria are resolved once against the first file
+    if indices is None and bbox is None and station_ids is None: return None
+
+    one_data = xarray.open_dataset (afile, decode_times=False)
+    lats = one_data.variables['lat_rho'].values
+    lons = one_data.variables['lon_rho'].values
+    one_data.close ()
+
+    return select_stations (lats, lons, indices=indices, bbox=bbox, station_ids=station_ids)
+
+def read_files (allfiles, stations=None, leads=None, currents=False):
+
+    # Read a group of files (e.g. one month sub-folder) and merge them once
+    if len (allfiles) == 0: return None
+    return concat_parts ([read_one_file (afile, stations=stations, leads=leads, currents=currents)
+                          for afile in allfiles])
+
+def list_ofs_files ():
 
     allSubPaths = natsorted (glob.glob (datapath + '*/'))
+    return [afile for subpath in allSubPaths
+            for afile in natsorted (glob.glob (subpath + '*.nc'))]
+
+def get_months (allfiles):
+
+    # Month partitions: files grouped by their YYYYMM/ sub-folder, in order
+    months = {}
+    for afile in allfiles:
+        months.setdefault (os.path.dirname (afile), []).append (afile)
+    return [months[subpath] for subpath in natsorted (months)]
+
+def collect_ofs_data (nworkers=None, by_month=None, indices=None, bbox=None,
+                      station_ids=None, leads=None, allfiles=None, cycle_file=None,
+                      currents_file=None, complete=True):
+
+    # With a cycle_file, full forecasts are kept there (see collect_ofs_cycles);
+    # with a currents_file, currents of the same stations are appended there
+    if nworkers is None: nworkers = n_workers
+    if by_month is None: by_month = partition_by_month
+    if allfiles is None: allfiles = list_ofs_files ()
+    if len (allfiles) == 0:
+        print ('No netcdf files found under {0}.'.format (datapath))
+        return None
+
+    # Turn station criteria into OFS station indices
+    stations = resolve_stations (allfiles[0], indices=indices, bbox=bbox,
+                                 station_ids=station_ids)
+
+    # Currents are read in the same pass over the files as the heights
+    currents = currents_file is not None
+    if cycle_file is not None:
+        heights, currents = collect_ofs_cycles (cycle_file, allfiles, stations=stations, leads=leads,
+                                                nworkers=nworkers, by_month=by_month, currents=currents)
+    else:
+        heights = read_ofs_files (allfiles, stations=stations, leads=leads, nworkers=nworkers,
+                                  by_month=by_month, currents=currents)
+        if currents: heights, currents = heights['heights'], {name:heights[name] for name in ['u', 'v']}
+
+    if currents_file is not None:
+        with run_report.stage ('currents'):
+            ofs_store.append_series (currents_file, currents, attrs={'level':str (current_level)})
+
+    # Drop out any station that have NaN values. Incremental batches keep
+    # them (complete=False); see append_increment.
+    if not complete: return heights
+    heights = heights.dropna ()
+    print ('{0} stations with full time-series'.format (len (heights.stations)))
+    return heights
+
+def read_ofs_files (allfiles, stations=None, leads=None, nworkers=None, by_month=False,
+                    currents=False):
+
+    # One task per file, or per month sub-folder to cut down on the
+    # number of arrays passed back from the workers. With currents,
+    # {'heights':, 'u':, 'v':} as read_one_file.
+    if by_month:
+        reader, tasks = read_files, get_months (allfiles)
+    else:
+        reader, tasks = read_one_file, allfiles
+    reader = partial (reader, stations=stations, leads=leads, currents=currents)
 
     # Collect all data
-    dataframe = None
-    for subpath in allSubPaths:
-        allfiles = natsorted (glob.glob (subpath + '*.nc'))
-        for afile in allfiles:
-            subdf = read_one_file (afile)
-            if dataframe is None:
-                dataframe = subdf
+    with run_report.stage ('decode'):
+        nworkers = max (1, min (nworkers, len (tasks)))
+        chunksize = max (1, len (tasks) // (nworkers * 4))
+        with executors.get_executor (executor_kind, nworkers=nworkers,
+                                     address=scheduler_address) as executor:
+            parts = list (executor.map (reader, tasks, chunksize=chunksize))
+
+    # Merge everything in one go instead of growing the array per file
+    with run_report.stage ('concat'):
+        return concat_parts (parts)
+
+def get_signature (afile, checksum=False):
+
+    stat = os.stat (afile)
+    signature = {'size':stat.st_size, 'mtime':stat.st_mtime}
+    if checksum:
+        md5 = hashlib.md5 ()
+        with open (afile, 'rb') as f:
+            for block in iter (lambda: f.read (1 << 20), b''):
+                md5.update (block)
+        signature['md5'] = md5.hexdigest ()
+    return signature
+
+def load_manifest (manifest_file=None):
+
+    if manifest_file is None: manifest_file = manifestFile
+    if not os.path.exists (manifest_file): return {}
+    with open (manifest_file) as f:
+        return json.load (f)
+
+def save_manifest (manifest, manifest_file=None):
+
+    if manifest_file is None: manifest_file = manifestFile
+    # Write to a temporary file first so a crash never leaves half a manifest
+    with open (manifest_file + '.tmp', 'w') as f:
+        json.dump (manifest, f, indent=1, sort_keys=True)
+    os.replace (manifest_file + '.tmp', manifest_file)
+
+def find_new_files (allfiles, manifest, checksum=False):
+
+    newfiles = []
+    for afile in allfiles:
+        signature = manifest.get (afile)
+        if signature is None:
+            newfiles.append (afile)
+            continue
+
+        # Unchanged size and mtime: skip without reading the file
+        current = get_signature (afile)
+        if current['size'] == signature['size'] and \
+           current['mtime'] == signature['mtime']: continue
+
+        # Only pay for the checksum when size / mtime moved; a file that was
+        # only touched keeps its md5 and takes the new mtime in the manifest
+        if checksum and 'md5' in signature and current['size'] == signature['size']:
+            md5 = get_signature (afile, checksum=True)['md5']
+            if md5 == signature['md5']:
+                manifest[afile] = {**current, 'md5':md5}
                 continue
-            dataframe = dataframe.append (subdf)
-    
-    # Drop out any station that have NaN values. 
-    dataframe = dataframe.dropna (axis=1, how='any')
-    print ('{0} stations with full time-series'.format (len (dataframe.columns)))
-    return dataframe
-
-def plot_one_file (data):
-
-    h = plt.figure (figsize=(15, 5))
-    gs = gridspec.GridSpec (1, 1)
-    gs.update (bottom=0.15)
-
-    axis = h.add_subplot (gs[0])
-    xvalues = numpy.arange (len (data))
-    yvalues = data.values
-    axis.plot (xvalues[numpy.isfinite (yvalues)], yvalues[numpy.isfinite (yvalues)],
-                color='blue', alpha=0.7, linewidth=0.5, linestyle='-')
-
-    ##  Format x-axis
-    axis.set_xlim ([min(xvalues), max(xvalues)])
-    is_xticks = xvalues % 8760 == 0
-    axis.set_xticks (xvalues[is_xticks])    
-    axis.get_xaxis ().set_ticklabels ([])
-    times = numpy.array (list (data.index))
-    xticklabels = [datetime.strftime (atime, '%Y-%m-%d\n%H:%M')
-                   for atime in times[is_xticks]]
-    axis.set_xticklabels (xticklabels)
-    axis.tick_params (axis='x', labelsize=8, labelrotation=30)
-    ##  Format y-axis
-    axis.set_ylim ([min(yvalues)-0.5, max(yvalues) + 0.5])
-    axis.tick_params (axis='y', labelsize=8)
-    axis.set_ylabel ('MLLW Height [meters]', fontsize=10)       
-    ##  Plot grid lines
-    for ytick in axis.yaxis.get_majorticklocs():
-        axis.axhline (y=ytick, color='gray', alpha=0.3, linestyle=':', linewidth=0.2)
-    for xtick in axis.xaxis.get_majorticklocs():
-        axis.axvline (x=xtick, color='gray', alpha=0.3, linestyle=':', linewidth=0.2)
-
-    ### Store plot as PDF
-    lat, lon = data.name.split ('_')
-    lat, lon = '{0:.4f}'.format (float (lat)), '{0:.4f}'.format (float (lon))
-    plt.suptitle ('OFS Height at (lat, lon) = ({0}, {1})'.format (lat, lon), fontsize=15)
-    h.savefig (outpath + 'ofs_stations/ofs_height_' + lat + '_' + lon + '.pdf')
-    plt.close ('all')
-    return
-
-def plot_heights (dataframe):
-
-    for column in dataframe.columns:
-        plot_one_file (dataframe[column])
+        newfiles.append (afile)
+    return newfiles
+
+def update_ofs_data (nworkers=None, checksum=None, **kwargs):
+
+    if checksum is None: checksum = use_checksum
+
+    # Without a previous store, this is the same as a full collection
+    cycle_file, currents_file = kwargs.get ('cycle_file'), kwargs.get ('currents_file')
+    has_stores = os.path.exists (heightsFile) and (cycle_file is None or os.path.exists (cycle_file)) and \
+                 (currents_file is None or os.path.exists (currents_file))
+    manifest = load_manifest () if has_stores else {}
+
+    allfiles = list_ofs_files ()
+    newfiles = find_new_files (allfiles, manifest, checksum=checksum)
+    print ('{0} new or changed files out of {1}'.format (len (newfiles), len (allfiles)))
+    if len (newfiles) == 0: return None, manifest
+
+    # On top of existing stores, read the stored station set, whatever the
+    # criteria; the cycle store has every station read, the heights store
+    # only the complete ones
+    if has_stores:
+        nodes = ofs_store.read_stations (cycle_file if cycle_file is not None else heightsFile)['node']
+        kwargs.update ({'indices':nodes, 'bbox':None, 'station_ids':None, 'complete':False})
+
+    heights = collect_ofs_data (nworkers=nworkers, allfiles=newfiles, **kwargs)
+    for afile in newfiles:
+        manifest[afile] = get_signature (afile, checksum=checksum)
+    return heights, manifest
+
+def append_increment (heights, heights_file=None):
+
+    # Rows of an incremental batch go onto the stored stations. A station
+    # with a gap in the batch (or missing from it) no longer has a full
+    # time-series and leaves the store, as a full run would drop it.
+    if heights_file is None: heights_file = heightsFile
+    if not os.path.exists (heights_file):
+        ofs_store.write_heights (heights_file, heights.dropna ())
+        return
+
+    stored = ofs_store.read_stations (heights_file)['node']
+    positions = find_nodes (heights.stations, stored)
+    heights = heights.select (positions[positions >= 0])
+    is_complete = numpy.isfinite (heights.values).all (axis=0)
+    incomplete = numpy.r_[stored[positions < 0], heights.stations['node'][~is_complete]]
+
+    ofs_store.append_heights (heights_file, heights)
+    if len (incomplete) > 0:
+        ofs_store.drop_stations (heights_file, incomplete)
+        print ('{0} stations with gaps dropped from {1}'.format (len (incomplete), heights_file))
+
+def plot_heights (heights, nworkers=None):
+
+    # matplotlib is only imported when plots are made
+    import ofs_plotter
+    items = [(station['lat'], station['lon'], heights.times, heights.values[:, index])
+             for index, station in enumerate (heights.stations)]
+    multipage_file = 'ofs_heights.pdf' if multipage_plots else None
+    ofs_plotter.render (ofs_plotter.HeightFigure, items, outpath + 'ofs_stations/',
+                        nworkers=nworkers, multipage_file=multipage_file)
 
 #####################################
 ## Script starts here!
@@ -135,7 +487,39 @@ def plot_heights (dataframe):
 
 if __name__ == '__main__':
 
-    dataframe = collect_ofs_data ()
-    plot_heights (dataframe)
+    run_report.profile_stage = profile_stage
+
+    ## New rows are appended to the store; a full run rewrites it
+    cycle_file = cycleFile if store_cycles else None
+    currents_file = currentsFile if extract_currents else None
+    if incremental:
+        with run_report.stage ('ingest'):
+            heights, manifest = update_ofs_data (cycle_file=cycle_file, currents_file=currents_file)
+        if heights is None:
+            print ('Nothing new to ingest.')
+            # Keep the new mtimes of files that were only touched
+            if os.path.exists (heightsFile): save_manifest (manifest)
+            run_report.write_report (reportFile)
+            exit ()
+        with run_report.stage ('store'):
+            append_increment (heights)
+    else:
+        with run_report.stage ('ingest'):
+            allfiles = list_ofs_files ()
+            if store_cycles and os.path.exists (cycleFile): os.remove (cycleFile)
+            if extract_currents and os.path.exists (currentsFile): os.remove (currentsFile)
+            heights = collect_ofs_data (allfiles=allfiles, cycle_file=cycle_file,
+                                        currents_file=currents_file)
+            manifest = {afile:get_signature (afile, checksum=use_checksum) for afile in allfiles}
+        with run_report.stage ('store'):
+            ofs_store.write_heights (heightsFile, heights)
+
+    ## Only record the ingested files once the output is safely written
+    save_manifest (manifest)
+
+    if make_plots:
+        with run_report.stage ('plot'):
+            plot_heights (ofs_store.read_heights (heightsFile))
 
-    dataframe.to_csv (outpath + 'ofs_all_heights.csv')
\ No newline at end of file
+    run_report.write_report (reportFile)
+    run_report.print_report ()
@@ -9,24 +9,21 @@
 #####################################
 ## Import packages
 #####################################
-import numpy, pandas, requests
-from datetime import datetime
-
-import matplotlib
-matplotlib.use ('Agg')
-import matplotlib.pyplot as plt
-import matplotlib.gridspec as gridspec
-plt.rc ('text', usetex=False)
-plt.rc ('font', family='sans-serif')
-plt.rc ('font', serif='Computer Modern Roman')
+import numpy, pandas
+import ofs_store, spatial_index, interpolation, run_report, skill_metrics
+from coops_api import dataAPI_params, metadataAPI_params, get_data_api, get_metadata_api, \
+                      pull_many, split_date_range
 
 #####################################
 ## Define constants
 #####################################
 outpath = '/home/elims/projects/cbofs/outputs/'
-ofsAllFile = outpath + 'ofs_all_heights.csv'
+ofsAllFile = outpath + 'ofs_all_heights.h5'
+ofsIndexFile = spatial_index.index_file_of (ofsAllFile)
+ofsWeightsFile = interpolation.weights_file_of (ofsAllFile)
 ofsFile = outpath + 'ofs_preds.csv'
 coopsFile = outpath + 'coops_preds.csv'
+skillFile = outpath + 'skill_metrics.csv'
 
 stations = {'8575512':'Annapolis', '8571892':'Cambridge', '8577330':'Solomons Island',
             '8574680':'Baltimore', '8573927':'Chesapeake City', '8635750':'Lewisetta',
@@ -34,83 +31,81 @@ stations = {'8575512':'Annapolis', '8571892':'Cambridge', '8577330':'Solomons Is
             '8636580':'Windmill Point', '8637689':'Yorktown', '8632200':'Kiptopeke Beach',
             '8638610':'Sewells Point'}
 
-dataAPI_params = {'product':'predictions', 'datum':'MLLW', 'time_zone':'gmt', 'units':'metric'}
-metadataAPI_params = {'units':dataAPI_params['units']}
+earth_radius = 6373. # km
 
-dataAPI_template = 'https://tidesandcurrents.noaa.gov/api/datagetter?' + \
-                   'begin_date={begin_date}&end_date={end_date}&station={station}&' + \
-                   'product={product}&datum={datum}&time_zone={time_zone}&units={units}&format=json'
+# OFS series at the stations are interpolated from the surrounding OFS
+# nodes (see interpolation.py) instead of taken at the nearest node.
+# Stations without a stencil still take their nearest node.
+interpolate_ofs = True
 
-metadataAPI_template = 'https://tidesandcurrents.noaa.gov/mdapi/v1.0/webapi/stations/' + \
-                       '{station}.json?units={units}'
+# Plots (see ofs_plotter.py) can be switched off entirely, or go into a
+# few multi-page PDFs instead of one PDF per station.
+make_plots = True
+multipage_plots = False
 
-earth_radius = 6373. # km
+# Per-stage time / memory / IO / API report (see run_report.py). Set
+# profile_stage to a stage name to also dump its cProfile stats.
+reportFile = outpath + 'ofs_obs_massager_report.json'
+profile_stage = None
 
 #####################################
 ## Define functions
 #####################################
-def pull_data (api):
-
-    response = requests.get (api)
-    if not response.status_code == 200:
-        print ('Connection failed with {0}.'.format (response.status_code))
-        return None
-    
-    content = response.json()
-    if 'error' in content:
-        print ('Error encountered: {0}.'.format (content['error']['message']))
-        return None
-    if len (content) == 0:
-        print ('Empty content encounted. Please check API:\n{0}.'.format (api))
-        return None
-
-    try:
-        return content
-    except:
-        print ('Failed to collect data. Please check API:\n{0}.'.format (api))
-    return None    
-
-def pull_heights (**params):
-
-    params = {**params, **dataAPI_params}
-    api = dataAPI_template.format (**params)
-
-    content = pull_data (api)
-    if content is None: return None
+def to_heights (content, station):
 
     data = numpy.array ([[aTime['t'], aTime['v']] for aTime in content['predictions']]).T
     dataframe = pandas.DataFrame ({'datetime':data[0], 'predicted':data[1].astype (float)})
     dataframe.index = pandas.to_datetime (dataframe.datetime)
     dataframe = dataframe.drop (axis=1, columns=['datetime'])
-    dataframe.columns = [params['station']]
+    dataframe.columns = [station]
     return dataframe
 
-def pull_coops_pred (metadata, begin_date, end_date):
+def stitch_heights (contents, station):
 
-    params = {'begin_date':begin_date, 'end_date':end_date}
-    coopsdata = None
-    for row in metadata.itertuples ():
-        params['station'] = row.id
-        pred = pull_heights (**params)
+    # Put the date-range chunks of one station back together
+    if any (content is None for content in contents): return None
+    dataframe = pandas.concat ([to_heights (content, station) for content in contents])
+    return dataframe[~dataframe.index.duplicated (keep='first')]
 
-        if coopsdata is None:
-            coopsdata = pred
-            continue
+def get_chunk_apis (station, begin_date, end_date):
 
-        coopsdata = coopsdata.merge (pred,left_index=True, right_index=True)
+    return [get_data_api (**{**dataAPI_params, 'station':station,
+                             'begin_date':begin, 'end_date':end})
+            for begin, end in split_date_range (begin_date, end_date)]
 
-    return coopsdata
+def pull_heights (nworkers=None, **params):
 
-def pull_stations ():
+    apis = get_chunk_apis (params['station'], params['begin_date'], params['end_date'])
+    return stitch_heights (pull_many (apis, nworkers=nworkers), params['station'])
 
+def pull_coops_pred (metadata, begin_date, end_date, nworkers=None):
+
+    # All chunks of all stations go through the same pool
+    allapis = {row.id:get_chunk_apis (row.id, begin_date, end_date)
+               for row in metadata.itertuples ()}
+    contents = pull_many ([api for apis in allapis.values () for api in apis], nworkers=nworkers)
+
+    preds, start = [], 0
+    for station, apis in allapis.items ():
+        pred = stitch_heights (contents[start:start+len (apis)], station)
+        start += len (apis)
+        if pred is None:
+            print ('Failed to pull predictions at {0}.'.format (station))
+            return None
+        preds.append (pred)
+
+    return pandas.concat (preds, axis=1, join='inner')
+
+def pull_stations (station_names=None, nworkers=None):
+
+    if station_names is None: station_names = stations
     from_api = {'id':[], 'name':[], 'lat':[], 'lon':[]}
 
-    for sid, name in stations.items():
+    apis = [get_metadata_api (**{**metadataAPI_params, 'station':sid}) for sid in station_names]
+    contents = pull_many (apis, nworkers=nworkers)
 
-        params = {**{'station':sid}, **dataAPI_params}
-        api = metadataAPI_template.format (**params)
+    for (sid, name), content in zip (station_names.items(), contents):
 
-        content = pull_data (api)
         if content is None: return None
         metadata = content['stations'][0]
 
@@ -136,101 +131,63 @@ def get_distance (pos1, pos2):
 
     return earth_radius * c # km
 
-def match_stations_by_ofs_indices (metadata, ofsdata):
+def match_stations_by_ofs_indices (metadata, ofsstations, node_index=None):
 
-    ofslats, ofslons = numpy.array ([column.split ('_') for column in ofsdata.columns]).T
-    ofslats = ofslats.astype (float)
-    ofslons = ofslons.astype (float)
+    # ofsstations: station registry of the OFS store
+    if node_index is None:
+        node_index = spatial_index.NodeIndex (ofsstations['lat'], ofsstations['lon'])
 
-    distance, index = [], []
-    for ith, station in metadata.iterrows():
-        pos1 = (station.lat, station.lon)
-
-        ncdistances = []
-        for lat, lon in zip (ofslats, ofslons):
-            pos2 = (lat, lon)
-            ncdistances.append (get_distance (pos1, pos2))
-
-        distance.append (numpy.min (ncdistances))
-        index.append (numpy.argmin (ncdistances))
+    distance, index = node_index.query (metadata.lat.values, metadata.lon.values, k=1)
     
-    metadata['nearest_dist'] = distance
-    metadata['nearest_ofsIndex'] = index
+    metadata['nearest_dist'] = distance[:, 0]
+    metadata['nearest_ofsIndex'] = index[:, 0]
+    metadata['nearest_ofsNode'] = ofsstations['node'][index[:, 0]]
     return metadata
 
-def plot_a_prediction (station, distance, data):
-
-    h = plt.figure (figsize=(20, 5))
-    gs = gridspec.GridSpec (2, 1, height_ratios=[3,1])
-    gs.update (bottom=0.15)
-
-    ## top: water level
-    axis = h.add_subplot (gs[0])
-    xvalues = numpy.arange (len (data['ofs']))
-    ylimit = [numpy.inf, -numpy.inf]
-    for key in ['coops', 'ofs']:
-        yvalues = data[key].values
-        color   = 'blue' if key == 'coops' else 'red'
-        label   = 'CO-OPS pred' if key == 'coops' else 'OFS pred'
-        axis.plot (xvalues[numpy.isfinite (yvalues)], yvalues[numpy.isfinite (yvalues)],
-                    color=color, alpha=0.6, linewidth=0.5, linestyle='-', label=label)
-        if min (yvalues) < ylimit[0]: ylimit[0] = min (yvalues) - 0.5
-        if max (yvalues) > ylimit[1]: ylimit[1] = max (yvalues) + 0.5
-    ##  Add legend to plot
-    axis.legend (loc=2, prop={'size':10})
-    ##  Format x-axis
-    axis.set_xlim ([min(xvalues), max(xvalues)])
-    is_xticks = xvalues % 8760 == 0
-    axis.set_xticks (xvalues[is_xticks])    
-    axis.get_xaxis ().set_ticklabels ([])
-    ##  Format y-axis
-    axis.set_ylim (ylimit)
-    axis.tick_params (axis='y', labelsize=8)
-    axis.set_ylabel ('water level (m) MLLW', fontsize=10)
-    ##  Plot grid lines
-    for ytick in axis.yaxis.get_majorticklocs():
-        axis.axhline (y=ytick, color='gray', alpha=0.3, linestyle=':', linewidth=0.2)
-    for xtick in axis.xaxis.get_majorticklocs():
-        axis.axvline (x=xtick, color='gray', alpha=0.3, linestyle=':', linewidth=0.2)
-
-    ## bottom: difference
-    axis = h.add_subplot (gs[1])
-    yvalues = data['ofs'] - data['coops']
-    axis.plot (xvalues[numpy.isfinite (yvalues)], yvalues[numpy.isfinite (yvalues)],
-                color='gray', alpha=0.7, linewidth=0.5, linestyle='-')
-    ##  Format x-axis
-    axis.set_xlim ([min(xvalues), max(xvalues)])
-    axis.set_xticks (xvalues[is_xticks])
-    times = numpy.array (list (data.index))
-    xticklabels = [datetime.strftime (atime, '%Y-%m-%d\n%H:%M')
-                   for atime in times[is_xticks]]
-    axis.set_xticklabels (xticklabels)
-    axis.tick_params (axis='x', labelsize=8, labelrotation=30)     
-    ##  Format y-axis
-    axis.set_ylim (min (yvalues)-0.25, max (yvalues)+0.25)
-    axis.tick_params (axis='y', labelsize=8)
-    axis.set_ylabel ('ofs - coops (m)', fontsize=10)
-    ##  Plot grid lines
-    for ytick in axis.yaxis.get_majorticklocs():
-        axis.axhline (y=ytick, color='gray', alpha=0.3, linestyle=':', linewidth=0.2)
-    for xtick in axis.xaxis.get_majorticklocs():
-        axis.axvline (x=xtick, color='gray', alpha=0.3, linestyle=':', linewidth=0.2)    
-
-    ### Store plot as PDF
-    plt.suptitle ('Pred at {0} ({1:.3f} km)'.format (station, distance), fontsize=15)
-    h.savefig (outpath + '/CB_stations/predictions_' + station + '.pdf')
-    plt.close ('all')
-    return
-
-def plot_predictions (metadata, ofsdata, coopsdata):
-
+def read_interpolated_ofs (metadata, ofsstations, node_index=None):
+
+    # Weights are cached next to the store; only the OFS stations that
+    # any stencil uses are read
+    weights = interpolation.get_weights (ofsstations['lat'], ofsstations['lon'],
+                                         metadata.lat.values, metadata.lon.values,
+                                         node_index=node_index, afile=ofsWeightsFile)
+    metadata['ofs_stencil'] = weights.get_stencils ()
+
+    # Stations without a stencil (no wet node within max_distance_km) take
+    # their nearest node, as without interpolation
+    if 'nearest_ofsIndex' not in metadata:
+        metadata = match_stations_by_ofs_indices (metadata, ofsstations, node_index=node_index)
+    no_stencil = weights.stencils == 0
+    nearest = metadata.nearest_ofsIndex.values[no_stencil]
+
+    nodes = numpy.union1d (weights.get_nodes (), nearest).astype (int)
+    heights = ofs_store.read_heights (ofsAllFile, stations=nodes)
+    values = weights.apply (heights.values.T, nodes=nodes).T
+    if no_stencil.any ():
+        values[:, no_stencil] = heights.values[:, numpy.searchsorted (nodes, nearest)]
+        metadata.loc[no_stencil, 'ofs_stencil'] = 'nearest'
+        print ('{0} stations without an interpolation stencil take their nearest OFS node: {1}'.format (
+               no_stencil.sum (), ', '.join (metadata.id.values[no_stencil])))
+    ofsdata = pandas.DataFrame (values, index=pandas.DatetimeIndex (heights.times),
+                                columns=metadata.id.values)
+    ofsdata.index.name = 'datetime'
+    return ofsdata
+
+def plot_predictions (metadata, ofsdata, coopsdata, nworkers=None):
+
+    # matplotlib is only imported when plots are made
+    import ofs_plotter
+    items = []
     for row in metadata.itertuples ():
         ofs = ofsdata[row.id].to_frame()
         ofs.columns = ['ofs']
         coops = coopsdata[row.id].to_frame()
         coops.columns = ['coops']
         data = ofs.merge (coops, right_index=True, left_index=True)
-        plot_a_prediction (row.id, row.nearest_dist, data)
+        items.append ((row.id, row.nearest_dist, data))
+    multipage_file = 'predictions.pdf' if multipage_plots else None
+    ofs_plotter.render (ofs_plotter.PredictionFigure, items, outpath + '/CB_stations/',
+                        nworkers=nworkers, multipage_file=multipage_file)
 
 #####################################
 ## Script starts here!
@@ -238,29 +195,53 @@ def plot_predictions (metadata, ofsdata, coopsdata):
 
 if __name__ == '__main__':
 
-    ## Read OFS dataframe
-    ofsdata = pandas.read_csv (ofsAllFile)
-    ofsdata.index = pandas.to_datetime (ofsdata['datetime'])
-    ofsdata = ofsdata.drop (axis=1, columns=['datetime'])
+    run_report.profile_stage = profile_stage
 
-    ## Obtain and massage data from physical stations
-    metadata = pull_stations ()
-    metadata = match_stations_by_ofs_indices (metadata, ofsdata)
+    ## Read OFS station table and its (persisted) spatial index
+    with run_report.stage ('node_index'):
+        ofsstations = ofs_store.read_stations (ofsAllFile)
+        node_index = spatial_index.get_node_index (ofsstations['lat'], ofsstations['lon'],
+                                                   afile=ofsIndexFile)
 
-    ## Clean up data from OFS based on the physical stations
-    ofsdata = ofsdata.iloc[:, metadata.nearest_ofsIndex.values]
-    ofsdata.columns = metadata.id.values
+    ## Obtain and massage data from physical stations
+    with run_report.stage ('pull_stations'):
+        metadata = pull_stations ()
+    with run_report.stage ('match_stations'):
+        metadata = match_stations_by_ofs_indices (metadata, ofsstations, node_index=node_index)
+
+    ## Only read OFS data at the stations matched to the physical stations
+    with run_report.stage ('read_ofs'):
+        if interpolate_ofs:
+            ofsdata = read_interpolated_ofs (metadata, ofsstations, node_index=node_index)
+        else:
+            ofsdata = ofs_store.read_heights (ofsAllFile, stations=metadata.nearest_ofsIndex.values)
+            ofsdata = ofsdata.to_dataframe ()
+            ofsdata.columns = metadata.id.values
 
     ## Obtain co-ops predctions from obs-based HA
     begin_date = ofsdata.index[0].strftime ('%Y%m%d %H:%M')
     end_date = ofsdata.index[-1].strftime ('%Y%m%d %H:%M')
-    coopsdata = pull_coops_pred (metadata, begin_date, end_date)
+    with run_report.stage ('pull_predictions'):
+        coopsdata = pull_coops_pred (metadata, begin_date, end_date)
+
+    ## Per-station skill of OFS against CO-OPS predictions (see skill_metrics.py)
+    with run_report.stage ('skill'):
+        skill = skill_metrics.score_frames (ofsdata, coopsdata)
+        columns = ['name', 'nearest_dist'] + (['ofs_stencil'] if interpolate_ofs else [])
+        skill = metadata.set_index ('id')[columns].join (skill, how='inner')
+        skill.index.name = 'station'
+        skill.to_csv (skillFile)
+    print (skill[['bias', 'rmse', 'corr', 'high_time_error', 'low_time_error']].round (3))
 
     ## Generate plots at all stations
-    plot_predictions (metadata, ofsdata, coopsdata)
+    if make_plots:
+        with run_report.stage ('plot'):
+            plot_predictions (metadata, ofsdata, coopsdata)
 
     ## Dump out the massaged CSV files for T-tide
-    ofsdata.to_csv (ofsFile)
-    coopsdata.to_csv (coopsFile)
+    with run_report.stage ('write_csv'):
+        ofsdata.to_csv (ofsFile)
+        coopsdata.to_csv (coopsFile)
 
-    
\ No newline at end of file
+    run_report.write_report (reportFile)
+    run_report.print_report ()
@@ -0,0 +1,211 @@
+#!/home/elims/envs/py37/bin/python
+
+## This python renders the per-station time-series plots. It is only
+## imported when plots are requested, so matplotlib never slows down a
+## run that only needs the data products.
+##
+## Each worker process builds one template figure and, for every station,
+## only swaps the data, limits, ticks and title of the existing artists
+## before saving. Stations are split evenly between the workers. With a
+## multipage file, all pages go into that one PDF instead of one PDF per
+## station: a single process writes its vector pages directly, while
+## several workers draw their pages as PNG images that the parent writes
+## into the PDF in station order.
+#########################################################################
+
+#####################################
+## Import packages
+#####################################
+import numpy, pandas, os, io
+from datetime import datetime
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+matplotlib.use ('Agg')
+import matplotlib.pyplot as plt
+import matplotlib.gridspec as gridspec
+from matplotlib.backends.backend_pdf import PdfPages
+plt.rc ('text', usetex=False)
+plt.rc ('font', family='sans-serif')
+plt.rc ('font', serif='Computer Modern Roman')
+
+#####################################
+## Define constants
+#####################################
+# Number of processes rendering plots; 1 renders serially.
+n_workers = os.cpu_count ()
+
+# One x tick per year of hourly data
+n_steps_per_xtick = 8760
+
+# Resolution of the PNG pages drawn by workers into a multipage PDF, and
+# the number of pages per task (bounds the pages held by the parent)
+page_dpi = 150
+n_pages_per_task = 64
+
+grid_style = {'color':'gray', 'alpha':0.3, 'linestyle':':', 'linewidth':0.2}
+
+#####################################
+## Define functions
+#####################################
+def set_time_axis (axis, xvalues, times=None):
+
+    # x ticks at every n_steps_per_xtick; labels only if times are given
+    axis.set_xlim ([min (xvalues), max (xvalues)])
+    is_xticks = xvalues % n_steps_per_xtick == 0
+    axis.set_xticks (xvalues[is_xticks])
+    if times is None:
+        axis.get_xaxis ().set_ticklabels ([])
+        return
+    xticklabels = [datetime.strftime (atime, '%Y-%m-%d\n%H:%M')
+                   for atime in numpy.array (list (times))[is_xticks]]
+    axis.set_xticklabels (xticklabels)
+    axis.tick_params (axis='x', labelsize=8, labelrotation=30)
+
+def set_finite_data (line, xvalues, yvalues):
+
+    is_finite = numpy.isfinite (yvalues)
+    line.set_data (xvalues[is_finite], yvalues[is_finite])
+
+class HeightFigure (object):
+
+    # OFS water level at one OFS station; item = (lat, lon, times, values)
+    def __init__ (self):
+
+        self.figure = plt.figure (figsize=(15, 5))
+        gs = gridspec.GridSpec (1, 1)
+        gs.update (bottom=0.15)
+
+        self.axis = self.figure.add_subplot (gs[0])
+        self.line, = self.axis.plot ([], [], color='blue', alpha=0.7, linewidth=0.5, linestyle='-')
+        self.axis.tick_params (axis='y', labelsize=8)
+        self.axis.set_ylabel ('MLLW Height [meters]', fontsize=10)
+        self.axis.grid (True, **grid_style)
+        self.title = self.figure.suptitle ('', fontsize=15)
+
+    def update (self, lat, lon, times, yvalues):
+
+        xvalues = numpy.arange (len (yvalues))
+        set_finite_data (self.line, xvalues, yvalues)
+        set_time_axis (self.axis, xvalues, times=pandas.DatetimeIndex (times))
+        self.axis.set_ylim ([numpy.nanmin (yvalues) - 0.5, numpy.nanmax (yvalues) + 0.5])
+
+        lat, lon = '{0:.4f}'.format (lat), '{0:.4f}'.format (lon)
+        self.title.set_text ('OFS Height at (lat, lon) = ({0}, {1})'.format (lat, lon))
+        return 'ofs_height_' + lat + '_' + lon + '.pdf'
+
+class PredictionFigure (object):
+
+    # OFS vs CO-OPS predictions at one CO-OPS station and their difference;
+    # item = (station id, distance to OFS node in km, dataframe with ofs & coops)
+    def __init__ (self):
+
+        self.figure = plt.figure (figsize=(20, 5))
+        gs = gridspec.GridSpec (2, 1, height_ratios=[3,1])
+        gs.update (bottom=0.15)
+
+        ## top: water level
+        self.top = self.figure.add_subplot (gs[0])
+        self.lines = {}
+        for key in ['coops', 'ofs']:
+            color = 'blue' if key == 'coops' else 'red'
+            label = 'CO-OPS pred' if key == 'coops' else 'OFS pred'
+            self.lines[key], = self.top.plot ([], [], color=color, alpha=0.6, linewidth=0.5,
+                                              linestyle='-', label=label)
+        self.top.legend (loc=2, prop={'size':10})
+        self.top.tick_params (axis='y', labelsize=8)
+        self.top.set_ylabel ('water level (m) MLLW', fontsize=10)
+        self.top.grid (True, **grid_style)
+
+        ## bottom: difference
+        self.bottom = self.figure.add_subplot (gs[1])
+        self.lines['diff'], = self.bottom.plot ([], [], color='gray', alpha=0.7, linewidth=0.5, linestyle='-')
+        self.bottom.tick_params (axis='y', labelsize=8)
+        self.bottom.set_ylabel ('ofs - coops (m)', fontsize=10)
+        self.bottom.grid (True, **grid_style)
+        self.title = self.figure.suptitle ('', fontsize=15)
+
+    def update (self, station, distance, data):
+
+        xvalues = numpy.arange (len (data['ofs']))
+        for key in ['coops', 'ofs']:
+            set_finite_data (self.lines[key], xvalues, data[key].values)
+        values = data[['coops', 'ofs']].values
+        self.top.set_ylim ([numpy.nanmin (values) - 0.5, numpy.nanmax (values) + 0.5])
+        set_time_axis (self.top, xvalues)
+
+        yvalues = (data['ofs'] - data['coops']).values
+        set_finite_data (self.lines['diff'], xvalues, yvalues)
+        self.bottom.set_ylim (numpy.nanmin (yvalues) - 0.25, numpy.nanmax (yvalues) + 0.25)
+        set_time_axis (self.bottom, xvalues, times=data.index)
+
+        self.title.set_text ('Pred at {0} ({1:.3f} km)'.format (station, distance))
+        return 'predictions_' + station + '.pdf'
+
+def render_items (figure_class, outpath, items, multipage_file=None):
+
+    # Draw every item on one template figure of this process
+    template = figure_class ()
+    pages = None if multipage_file is None else PdfPages (multipage_file)
+    try:
+        for item in items:
+            filename = template.update (*item)
+            if pages is None: template.figure.savefig (os.path.join (outpath, filename))
+            else: pages.savefig (template.figure)
+    finally:
+        if pages is not None: pages.close ()
+        plt.close (template.figure)
+    return len (items)
+
+def render_pages (figure_class, items):
+
+    # PNG bytes of every item's page, drawn on one template figure
+    template = figure_class ()
+    pages = []
+    try:
+        for item in items:
+            template.update (*item)
+            buffer = io.BytesIO ()
+            template.figure.savefig (buffer, format='png', dpi=page_dpi)
+            pages.append (buffer.getvalue ())
+    finally:
+        plt.close (template.figure)
+    return pages
+
+def write_pages (pdf, pages):
+
+    # One PDF page per PNG image, filling a figure of the image size
+    for page in pages:
+        image = plt.imread (io.BytesIO (page), format='png')
+        figure = plt.figure (figsize=(image.shape[1] / page_dpi, image.shape[0] / page_dpi))
+        axis = figure.add_axes ([0, 0, 1, 1])
+        axis.imshow (image, aspect='auto', interpolation='none')
+        axis.set_axis_off ()
+        pdf.savefig (figure, dpi=page_dpi)
+        plt.close (figure)
+    return len (pages)
+
+def render (figure_class, items, outpath, nworkers=None, multipage_file=None):
+
+    # items: argument tuples of figure_class.update, one per plot
+    if nworkers is None: nworkers = n_workers
+    if not os.path.exists (outpath): os.makedirs (outpath)
+    if multipage_file is not None: multipage_file = os.path.join (outpath, multipage_file)
+    nworkers = max (1, min (nworkers, len (items)))
+    if nworkers == 1:
+        return render_items (figure_class, outpath, items, multipage_file=multipage_file)
+
+    ## One PDF per item: contiguous shares, one per worker
+    if multipage_file is None:
+        shares = numpy.array_split (numpy.arange (len (items)), nworkers)
+        shares = [[items[index] for index in share] for share in shares]
+        with ProcessPoolExecutor (max_workers=nworkers) as executor:
+            return sum (executor.map (partial (render_items, figure_class, outpath), shares))
+
+    ## One multipage PDF: workers return PNG pages of small tasks, which
+    ## map yields back in station order for the parent to write
+    tasks = [items[index:index+n_pages_per_task] for index in range (0, len (items), n_pages_per_task)]
+    with ProcessPoolExecutor (max_workers=nworkers) as executor, PdfPages (multipage_file) as pdf:
+        return sum (write_pages (pdf, pages) for pages in
+                    executor.map (partial (render_pages, figure_class), tasks))
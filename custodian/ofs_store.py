@@ -0,0 +1,465 @@
+#!/home/elims/envs/py37/bin/python
+
+## This python keeps the OFS water level time-series in a columnar HDF5
+## store instead of a wide csv. Values are float32, chunked by time and
+## station so that a few stations over a period can be read without
+## touching the rest of the file.
+##
+##   /time            int64 (ntime,)   nanoseconds since 1970-01-01
+##   /heights         float32 (ntime, nstation)  meters; MLLW
+##   /stations/node   int32 (nstation,)  OFS station index in the netcdf
+##   /stations/lat, /stations/lon  float64 (nstation,)
+##   /stations/name, /stations/id  strings (nstation,)
+##
+## Stations are read back as a registry (see station_registry.py) and
+## heights as StationHeights on that registry.
+##
+## Currents at the OFS stations use the same layout, with the east and
+## north velocity components in place of the heights:
+##
+##   /u, /v           float32 (ntime, nstation)  m/s
+##   attribute level: depth level of the velocities (see ofs_currents.py)
+##
+## Gridded "fields" outputs only keep the wet nodes of the curvilinear
+## grid, and are laid out node-major so that the time-series at a node
+## is read from a few contiguous chunks:
+##
+##   /time            int64 (ntime,)
+##   /zeta            float32 (nnode, ntime)  meters; MLLW
+##   /nodes/lat, /nodes/lon  float64 (nnode,)
+##   /nodes/eta, /nodes/xi   int32 (nnode,)  indices on the rho grid
+##
+## Gridded currents are kept as the "u" / "v" fields next to "zeta", with
+## the same level attribute.
+##
+## Full forecasts keep every lead step of every cycle, so that series at
+## any lead window, or from the freshest cycle, can be stitched without
+## re-reading the netcdf files. Cycles are stored in arrival order:
+##
+##   /cycle           int64 (ncycle,)  cycle start; nanoseconds since 1970
+##   /forecast        float32 (ncycle, nlead, nstation)  meters; MLLW
+##   /stations/...    as above
+##   attribute minutes_per_step: minutes between lead steps
+##
+## Harmonic constants fitted at the OFS stations, for synthesizing tides
+## anywhere near them:
+##
+##   /names           strings (nconsti,)
+##   /amp, /pha       float64 (nconsti, nstation)  meters; deg (Greenwich)
+##   /mean            float64 (nstation,)  meters; MLLW
+##   /stations/...    as above
+#########################################################################
+
+#####################################
+## Import packages
+#####################################
+import numpy, pandas, h5py, os
+from station_registry import StationHeights, find_nodes, make_registry
+
+#####################################
+## Define constants
+#####################################
+# ~10 days of 6-minute data by 16 stations per chunk
+time_chunk = 2400
+station_chunk = 16
+
+# ~10 days of hourly fields by 256 nodes per chunk
+fields_time_chunk = 240
+fields_node_chunk = 256
+
+# 4 days of 6-hourly cycles by 6 hours of 6-minute leads by 16 stations
+cycle_chunk = 16
+lead_chunk = 60
+
+#####################################
+## Define functions
+#####################################
+to_int64 = lambda index: pandas.DatetimeIndex (index).values.astype ('datetime64[ns]').view ('int64')
+
+def write_stations (f, stations):
+
+    f.create_dataset ('stations/node', data=stations['node'])
+    f.create_dataset ('stations/lat', data=stations['lat'])
+    f.create_dataset ('stations/lon', data=stations['lon'])
+    f.create_dataset ('stations/name', data=numpy.char.encode (stations['name'], 'utf-8'))
+    f.create_dataset ('stations/id', data=numpy.char.encode (stations['id'], 'utf-8'))
+
+def read_registry (f):
+
+    group = f['stations']
+    lats, lons = group['lat'][:], group['lon'][:]
+    # Stores written before the registry only have lat / lon
+    nodes = group['node'][:] if 'node' in group else None
+    names = group['name'][:].astype (str) if 'name' in group else None
+    ids = group['id'][:].astype (str) if 'id' in group else None
+    return make_registry (lats, lons, nodes=nodes, names=names, ids=ids)
+
+def write_series (afile, series, attrs=None):
+
+    # series: {dataset name: StationHeights}, all on the same times and
+    # stations (e.g. {'heights':...} or {'u':..., 'v':...})
+    first = list (series.values ())[0]
+    ntime, nstation = first.values.shape
+
+    # Write into a temporary file and swap it in when complete
+    with h5py.File (afile + '.tmp', 'w') as f:
+        f.create_dataset ('time', data=to_int64 (first.times), maxshape=(None,),
+                          chunks=(time_chunk,))
+        for name, data in series.items ():
+            f.create_dataset (name, data=data.values, maxshape=(None, nstation),
+                              chunks=(time_chunk, min (station_chunk, max (nstation, 1))))
+        write_stations (f, first.stations)
+        for key, value in ({} if attrs is None else attrs).items (): f.attrs[key] = value
+    os.replace (afile + '.tmp', afile)
+
+def write_heights (afile, heights):
+
+    write_series (afile, {'heights':heights})
+
+def append_series (afile, series, attrs=None):
+
+    if not os.path.exists (afile):
+        write_series (afile, series, attrs=attrs)
+        return
+
+    with h5py.File (afile, 'r+') as f:
+        stations = read_registry (f)
+        first = list (series.values ())[0]
+        positions = find_nodes (stations, first.stations['node'])
+        if (positions < 0).any ():
+            raise ValueError ('{0} stations are not in {1}.'.format ((positions < 0).sum (), afile))
+
+        # Stations missing from the new rows are stored as NaN
+        order = numpy.argsort (first.times, kind='mergesort')
+        columns = positions
+        times = to_int64 (first.times[order])
+        allvalues = {}
+        for name, data in series.items ():
+            allvalues[name] = numpy.full ((len (times), len (stations)), numpy.nan, dtype=numpy.float32)
+            allvalues[name][:, columns] = data.values[order]
+
+        # Rows with stored time stamps are overwritten in place, only on
+        # the given stations
+        stored = f['time'][:]
+        positions = numpy.searchsorted (stored, times)
+        positions[positions == len (stored)] = 0
+        is_stored = stored[positions] == times if len (stored) > 0 else numpy.zeros (len (times), dtype=bool)
+        for name, values in allvalues.items ():
+            for position, row in zip (positions[is_stored], values[is_stored]):
+                stored_row = f[name][position]
+                stored_row[columns] = row[columns]
+                f[name][position] = stored_row
+
+        # The rest must come after the last stored time
+        times = times[~is_stored]
+        allvalues = {name:values[~is_stored] for name, values in allvalues.items ()}
+        if len (times) == 0: return
+        if len (stored) > 0 and times[0] <= stored[-1]:
+            needs_rewrite = True
+            attrs = dict (f.attrs)
+        else:
+            needs_rewrite = False
+            ntime = len (stored)
+            f['time'].resize ((ntime + len (times),))
+            f['time'][ntime:] = times
+            for name, values in allvalues.items ():
+                f[name].resize ((ntime + len (times), len (stations)))
+                f[name][ntime:] = values
+
+    # Back-filled rows land in the middle of the record: merge and rewrite
+    if needs_rewrite:
+        write_series (afile, {name:StationHeights.concat ([read_heights (afile, name=name),
+                                                           StationHeights (times, values, stations)]).sort ()
+                              for name, values in allvalues.items ()}, attrs=attrs)
+
+def append_heights (afile, heights):
+
+    append_series (afile, {'heights':heights})
+
+def drop_stations (afile, nodes):
+
+    # Rewrite the store without the stations at the given nodes
+    with h5py.File (afile, 'r') as f:
+        registry = read_registry (f)
+        names = [name for name in f.keys () if name not in ['time', 'stations']]
+        attrs = dict (f.attrs)
+    keep = numpy.where (~numpy.isin (registry['node'], nodes))[0]
+    if len (keep) == len (registry): return
+    write_series (afile, {name:read_heights (afile, stations=keep, name=name) for name in names},
+                  attrs=attrs)
+
+def read_stations (afile):
+
+    with h5py.File (afile, 'r') as f:
+        return read_registry (f)
+
+def read_times (afile):
+
+    with h5py.File (afile, 'r') as f:
+        return pandas.to_datetime (f['time'][:])
+
+def read_heights (afile, stations=None, begin=None, end=None, name='heights'):
+
+    # StationHeights at the given registry positions (all by default); name
+    # picks another series of the store (e.g. 'u' / 'v' of the currents)
+    with h5py.File (afile, 'r') as f:
+        registry = read_registry (f)
+        times = f['time'][:]
+
+        # Time range [begin, end] via the sorted time axis
+        start = 0 if begin is None else numpy.searchsorted (times, to_int64 ([begin])[0], side='left')
+        stop = len (times) if end is None else numpy.searchsorted (times, to_int64 ([end])[0], side='right')
+
+        # h5py wants increasing indices; put the requested order back after
+        if stations is None:
+            stations = numpy.arange (len (registry))
+            values = f[name][start:stop, :]
+        else:
+            stations = numpy.array (stations, dtype=int)
+            unique, inverse = numpy.unique (stations, return_inverse=True)
+            values = f[name][start:stop, unique][:, inverse]
+
+    return StationHeights (times[start:stop], values, registry[stations])
+
+def create_fields (afile, lats, lons, etas, xis, grid_shape, names=('zeta',), attrs=None):
+
+    nnode = len (lats)
+    with h5py.File (afile + '.tmp', 'w') as f:
+        f.create_dataset ('time', shape=(0,), dtype=numpy.int64, maxshape=(None,),
+                          chunks=(fields_time_chunk,))
+        for name in names:
+            f.create_dataset (name, shape=(nnode, 0), dtype=numpy.float32,
+                              maxshape=(nnode, None), fillvalue=numpy.nan,
+                              chunks=(min (fields_node_chunk, nnode), fields_time_chunk))
+        f.create_dataset ('nodes/lat', data=lats)
+        f.create_dataset ('nodes/lon', data=lons)
+        f.create_dataset ('nodes/eta', data=numpy.asarray (etas, dtype=numpy.int32))
+        f.create_dataset ('nodes/xi', data=numpy.asarray (xis, dtype=numpy.int32))
+        f.attrs['grid_shape'] = grid_shape
+        for key, value in ({} if attrs is None else attrs).items (): f.attrs[key] = value
+    os.replace (afile + '.tmp', afile)
+
+def append_fields (afile, times, blocks):
+
+    # blocks: {name: (nnode, ntime) values} after the last stored time.
+    # Blocks that are multiples of fields_time_chunk write whole chunks.
+    with h5py.File (afile, 'r+') as f:
+        ntime = f['time'].shape[0]
+        f['time'].resize ((ntime + len (times),))
+        f['time'][ntime:] = to_int64 (times)
+        for name, values in blocks.items ():
+            f[name].resize ((f[name].shape[0], ntime + len (times)))
+            f[name][:, ntime:] = values
+
+def read_last_time (afile):
+
+    with h5py.File (afile, 'r') as f:
+        if f['time'].shape[0] == 0: return None
+        return pandas.to_datetime (f['time'][-1])
+
+def read_grid_shape (afile):
+
+    with h5py.File (afile, 'r') as f:
+        return tuple (f.attrs['grid_shape'])
+
+def read_nodes (afile):
+
+    with h5py.File (afile, 'r') as f:
+        return pandas.DataFrame ({key:f['nodes/' + key][:] for key in f['nodes'].keys ()})
+
+def read_node_series (afile, nodes, begin=None, end=None, name='zeta'):
+
+    # Time-series (time x node) at the given node indices
+    with h5py.File (afile, 'r') as f:
+        times = f['time'][:]
+        start = 0 if begin is None else numpy.searchsorted (times, to_int64 ([begin])[0], side='left')
+        stop = len (times) if end is None else numpy.searchsorted (times, to_int64 ([end])[0], side='right')
+
+        nodes = numpy.array (nodes, dtype=int)
+        unique, inverse = numpy.unique (nodes, return_inverse=True)
+        values = f[name][unique, start:stop][inverse].T
+
+    dataframe = pandas.DataFrame (values, index=pandas.to_datetime (times[start:stop]), columns=nodes)
+    dataframe.index.name = 'datetime'
+    return dataframe
+
+def iter_node_blocks (afile, name='zeta', nodes_per_block=None):
+
+    # Whole-record node blocks (node slice, (nnode, ntime) values) for
+    # passes over every node without loading the full array
+    with h5py.File (afile, 'r') as f:
+        dataset = f[name]
+        if nodes_per_block is None: nodes_per_block = dataset.chunks[0]
+        for start in range (0, dataset.shape[0], nodes_per_block):
+            nodes = slice (start, min (start + nodes_per_block, dataset.shape[0]))
+            yield nodes, dataset[nodes, :]
+
+def write_constants (afile, names, amps, phases, means, stations):
+
+    with h5py.File (afile + '.tmp', 'w') as f:
+        f.create_dataset ('names', data=numpy.char.encode (numpy.asarray (names, dtype=str), 'utf-8'))
+        f.create_dataset ('amp', data=numpy.asarray (amps, dtype=float))
+        f.create_dataset ('pha', data=numpy.asarray (phases, dtype=float))
+        f.create_dataset ('mean', data=numpy.asarray (means, dtype=float))
+        write_stations (f, stations)
+    os.replace (afile + '.tmp', afile)
+
+def read_constants (afile):
+
+    with h5py.File (afile, 'r') as f:
+        return {'names':list (f['names'][:].astype (str)), 'amp':f['amp'][:], 'pha':f['pha'][:],
+                'mean':f['mean'][:], 'stations':read_registry (f)}
+
+def create_cycles (afile, nlead, stations, minutes_per_step):
+
+    nstation = len (stations)
+    with h5py.File (afile + '.tmp', 'w') as f:
+        f.create_dataset ('cycle', shape=(0,), dtype=numpy.int64, maxshape=(None,),
+                          chunks=(cycle_chunk,))
+        f.create_dataset ('forecast', shape=(0, nlead, nstation), dtype=numpy.float32,
+                          maxshape=(None, nlead, nstation), fillvalue=numpy.nan,
+                          chunks=(cycle_chunk, min (lead_chunk, nlead),
+                                  min (station_chunk, max (nstation, 1))))
+        write_stations (f, stations)
+        f.attrs['minutes_per_step'] = minutes_per_step
+    os.replace (afile + '.tmp', afile)
+
+def append_cycles (afile, cycles, values, stations, minutes_per_step):
+
+    # values: (ncycle, nlead, nstation) full forecasts of the given cycles.
+    # Cycles already stored are overwritten in place; the rest are added.
+    values = numpy.asarray (values, dtype=numpy.float32)
+    if not os.path.exists (afile):
+        create_cycles (afile, values.shape[1], stations, minutes_per_step)
+
+    with h5py.File (afile, 'r+') as f:
+        if f.attrs['minutes_per_step'] != minutes_per_step:
+            raise ValueError ('{0} has {1} minutes per step.'.format (afile, f.attrs['minutes_per_step']))
+        if not numpy.array_equal (read_registry (f)['node'], stations['node']):
+            raise ValueError ('Stations differ from those in {0}.'.format (afile))
+
+        # Shorter forecasts are padded with NaN; longer ones are cut
+        nlead = f['forecast'].shape[1]
+        if values.shape[1] < nlead:
+            padding = numpy.full ((len (values), nlead - values.shape[1], values.shape[2]), numpy.nan,
+                                  dtype=numpy.float32)
+            values = numpy.concatenate ([values, padding], axis=1)
+        values = values[:, :nlead]
+
+        cycles = to_int64 (cycles)
+        stored = f['cycle'][:]
+        is_stored = numpy.isin (cycles, stored)
+        if is_stored.any ():
+            rows = {cycle:row for row, cycle in enumerate (stored)}
+            for cycle, value in zip (cycles[is_stored], values[is_stored]):
+                f['forecast'][rows[cycle]] = value
+
+        ncycle, nnew = len (stored), (~is_stored).sum ()
+        if nnew == 0: return
+        f['cycle'].resize ((ncycle + nnew,))
+        f['cycle'][ncycle:] = cycles[~is_stored]
+        f['forecast'].resize ((ncycle + nnew,) + f['forecast'].shape[1:])
+        f['forecast'][ncycle:] = values[~is_stored]
+
+def merge_cycles (afile, partfile):
+
+    # Add the cycles of a partial store (e.g. one month) to afile, a chunk
+    # of cycles at a time
+    with h5py.File (partfile, 'r') as f:
+        stations = read_registry (f)
+        minutes_per_step = f.attrs['minutes_per_step']
+        for start in range (0, len (f['cycle']), cycle_chunk):
+            rows = slice (start, start + cycle_chunk)
+            append_cycles (afile, pandas.to_datetime (f['cycle'][rows]), f['forecast'][rows],
+                           stations, minutes_per_step)
+
+def read_cycles (afile):
+
+    with h5py.File (afile, 'r') as f:
+        return pandas.to_datetime (numpy.sort (f['cycle'][:]))
+
+def read_forecast_rows (f, rows, steps, stations):
+
+    # (len (rows), nstep, nstation) at the given stored rows. h5py takes one
+    # increasing index list per read: rows are sorted and read in runs,
+    # where a run only bridges gaps of up to a cycle chunk, then subset.
+    unique, inverse = numpy.unique (stations, return_inverse=True)
+    rows = numpy.asarray (rows)
+    values = numpy.zeros ((len (rows), steps.stop - steps.start, len (stations)), dtype=f['forecast'].dtype)
+    if len (rows) == 0: return values
+    order = numpy.argsort (rows, kind='stable')
+    sorted_rows = rows[order]
+    breaks = numpy.flatnonzero (numpy.diff (sorted_rows) > cycle_chunk) + 1
+    for run in numpy.split (numpy.arange (len (rows)), breaks):
+        first, last = sorted_rows[run[0]], sorted_rows[run[-1]] + 1
+        block = f['forecast'][first:last, steps, unique]
+        values[order[run]] = block[sorted_rows[run] - first][:, :, inverse]
+    return values
+
+def read_lead_window (afile, leads, stations=None, begin=None, end=None):
+
+    # Series stitched from lead hours [leads[0], leads[1]) of every cycle.
+    # Where windows of several cycles overlap, the latest cycle is kept.
+    with h5py.File (afile, 'r') as f:
+        step = int (f.attrs['minutes_per_step']) * 60 * 10**9
+        nlead, nstation = f['forecast'].shape[1:]
+        stations = numpy.arange (nstation) if stations is None else numpy.array (stations, dtype=int)
+        steps_per_hour = 3600 * 10**9 / step
+        steps = slice (int (round (leads[0] * steps_per_hour)),
+                       min (nlead, int (round (leads[1] * steps_per_hour))))
+        offsets = numpy.arange (steps.start, steps.stop, dtype=numpy.int64) * step
+
+        cycles = f['cycle'][:]
+        is_kept = numpy.ones (len (cycles), dtype=bool)
+        if len (offsets) > 0 and begin is not None: is_kept &= cycles + offsets[-1] >= to_int64 ([begin])[0]
+        if len (offsets) > 0 and end is not None: is_kept &= cycles + offsets[0] <= to_int64 ([end])[0]
+        rows = numpy.where (is_kept)[0]
+        values = read_forecast_rows (f, rows, steps, stations)
+
+        # (cycle, lead) -> one row per time stamp, freshest cycle last
+        times = (cycles[rows][:, None] + offsets[None, :]).ravel ()
+        issued = numpy.repeat (cycles[rows], len (offsets))
+        values = values.reshape (len (times), len (stations))
+        is_kept = numpy.ones (len (times), dtype=bool)
+        if begin is not None: is_kept &= times >= to_int64 ([begin])[0]
+        if end is not None: is_kept &= times <= to_int64 ([end])[0]
+        order = numpy.lexsort ((issued[is_kept], times[is_kept]))
+        times, values = times[is_kept][order], values[is_kept][order]
+        is_last = numpy.append (times[1:] != times[:-1], True)
+        return StationHeights (times[is_last], values[is_last], read_registry (f)[stations])
+
+def read_freshest (afile, stations=None, begin=None, end=None):
+
+    # Series where each time stamp comes from the latest cycle issued at or
+    # before it, i.e. each cycle is used until the next one starts. Cycles
+    # are read a chunk at a time in time order.
+    with h5py.File (afile, 'r') as f:
+        step = int (f.attrs['minutes_per_step']) * 60 * 10**9
+        nlead, nstation = f['forecast'].shape[1:]
+        stations = numpy.arange (nstation) if stations is None else numpy.array (stations, dtype=int)
+
+        cycles = f['cycle'][:]
+        order = numpy.argsort (cycles)
+        # Lead steps used from each cycle: up to the next cycle, or all of them
+        nexts = numpy.append (cycles[order][1:], numpy.iinfo (numpy.int64).max)
+        nsteps = numpy.minimum (nlead, -((cycles[order] - nexts) // step))
+        is_kept = numpy.ones (len (order), dtype=bool)
+        if begin is not None: is_kept &= cycles[order] + (nsteps - 1) * step >= to_int64 ([begin])[0]
+        if end is not None: is_kept &= cycles[order] <= to_int64 ([end])[0]
+        order, nsteps = order[is_kept], nsteps[is_kept]
+
+        alltimes, allvalues = [], []
+        for start in range (0, len (order), cycle_chunk):
+            rows, counts = order[start:start+cycle_chunk], nsteps[start:start+cycle_chunk]
+            values = read_forecast_rows (f, rows, slice (0, counts.max ()), stations)
+            is_used = numpy.arange (counts.max ())[None, :] < counts[:, None]
+            times = cycles[rows][:, None] + numpy.arange (counts.max (), dtype=numpy.int64)[None, :] * step
+            alltimes.append (times[is_used])
+            allvalues.append (values[is_used])
+
+        times = numpy.concatenate (alltimes) if len (alltimes) > 0 else numpy.array ([], dtype=numpy.int64)
+        values = numpy.concatenate (allvalues) if len (allvalues) > 0 else numpy.zeros ((0, len (stations)))
+        is_kept = numpy.ones (len (times), dtype=bool)
+        if begin is not None: is_kept &= times >= to_int64 ([begin])[0]
+        if end is not None: is_kept &= times <= to_int64 ([end])[0]
+        return StationHeights (times[is_kept], values[is_kept], read_registry (f)[stations])
@@ -0,0 +1,179 @@
+#!/home/elims/envs/py37/bin/python
+
+## This python records where a run spends its time and memory. Scripts
+## wrap their steps in stages:
+##
+##     with run_report.stage ('decode'):
+##         ...
+##
+## and each stage records its wall and cpu time, peak RSS, bytes read and
+## written (Linux /proc/self/io, including reaped worker processes), plus
+## any counters and latencies reported through count () / observe () while
+## it was open, e.g. API requests and cache hits. Stages may be nested.
+## write_report () dumps everything into one JSON file; one stage can also
+## be run under cProfile with its stats dumped next to the report.
+#########################################################################
+
+#####################################
+## Import packages
+#####################################
+import numpy, json, os, sys, time, threading, resource, cProfile
+from contextlib import contextmanager
+
+#####################################
+## Define constants
+#####################################
+# Set to False to record nothing
+enabled = True
+
+# Name of the stage to run under cProfile, if any
+profile_stage = None
+
+# ru_maxrss is in kB on Linux and in bytes on macOS
+rss_unit = 1 if sys.platform == 'darwin' else 1024
+
+#####################################
+## Define functions
+#####################################
+_lock = threading.Lock ()
+_counters, _latencies = {}, {}
+_stages, _open_stages = [], []
+_started = time.time ()
+
+def count (key, value=1):
+
+    # e.g. count ('api_cache_hits'); safe to call from threads
+    if not enabled: return
+    with _lock:
+        _counters[key] = _counters.get (key, 0) + value
+
+def observe (key, seconds):
+
+    # A latency (s), e.g. of one API request
+    if not enabled: return
+    with _lock:
+        _latencies.setdefault (key, []).append (seconds)
+
+def read_io ():
+
+    # Bytes through read / write calls (chars) and from / to storage (bytes)
+    try:
+        with open ('/proc/self/io') as f:
+            values = dict (line.split (':') for line in f)
+    except (OSError, ValueError):
+        return {}
+    keys = {'rchar':'read_chars', 'wchar':'write_chars',
+            'read_bytes':'read_bytes', 'write_bytes':'write_bytes'}
+    return {name:int (values[key]) for key, name in keys.items () if key in values}
+
+def read_peak_rss ():
+
+    # High water mark (bytes) since the last reset, else since start
+    try:
+        with open ('/proc/self/status') as f:
+            for line in f:
+                if line.startswith ('VmHWM:'): return int (line.split ()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage (resource.RUSAGE_SELF).ru_maxrss * rss_unit
+
+def reset_peak_rss ():
+
+    # Linux >= 4.0 lets a process reset its own high water mark
+    try:
+        with open ('/proc/self/clear_refs', 'w') as f:
+            f.write ('5')
+    except OSError:
+        pass
+
+def summarize_latencies (latencies):
+
+    latencies = numpy.array (latencies)
+    return {'n':len (latencies), 'total':float (latencies.sum ()), 'mean':float (latencies.mean ()),
+            'p50':float (numpy.percentile (latencies, 50)), 'p95':float (numpy.percentile (latencies, 95)),
+            'max':float (latencies.max ())}
+
+@contextmanager
+def stage (name):
+
+    if not enabled:
+        yield
+        return
+
+    # Fold the peak so far into the enclosing stages before resetting it
+    peak = read_peak_rss ()
+    for record in _open_stages: record['peak_rss'] = max (record['peak_rss'], peak)
+    reset_peak_rss ()
+
+    record = {'name':name, 'parent':_open_stages[-1]['name'] if len (_open_stages) > 0 else None,
+              'peak_rss':0}
+    _open_stages.append (record)
+    with _lock:
+        counters = dict (_counters)
+        nlatencies = {key:len (values) for key, values in _latencies.items ()}
+    io = read_io ()
+    children_peak = resource.getrusage (resource.RUSAGE_CHILDREN).ru_maxrss * rss_unit
+    wall, cpu = time.perf_counter (), time.process_time ()
+
+    profile = cProfile.Profile () if name == profile_stage else None
+    if profile is not None: profile.enable ()
+    try:
+        yield
+    finally:
+        if profile is not None: profile.disable ()
+
+        record['wall'] = time.perf_counter () - wall
+        record['cpu'] = time.process_time () - cpu
+        record['peak_rss'] = max (record['peak_rss'], read_peak_rss ())
+        # Only a worker that beats the earlier high water mark shows here
+        record['children_peak_rss'] = max (0, resource.getrusage (resource.RUSAGE_CHILDREN).ru_maxrss
+                                           * rss_unit - children_peak)
+        record.update ({key:value - io.get (key, 0) for key, value in read_io ().items ()})
+        with _lock:
+            record['counters'] = {key:value - counters.get (key, 0) for key, value in _counters.items ()
+                                  if value != counters.get (key, 0)}
+            record['latencies'] = {key:summarize_latencies (values[nlatencies.get (key, 0):])
+                                   for key, values in _latencies.items ()
+                                   if len (values) > nlatencies.get (key, 0)}
+
+        # e.g. api_cache_hits / (api_cache_hits + api_cache_misses)
+        for key in list (record['counters']):
+            if not key.endswith ('_hits'): continue
+            misses = record['counters'].get (key[:-5] + '_misses', 0)
+            total = record['counters'][key] + misses
+            if total > 0: record['counters'][key[:-5] + '_hit_rate'] = record['counters'][key] / total
+
+        _open_stages.pop ()
+        _stages.append (record)
+        if profile is not None: record['profile'] = profile
+
+def write_report (afile, script=None):
+
+    # Stages are listed in the order they finished
+    stages = []
+    for record in _stages:
+        record = dict (record)
+        profile = record.pop ('profile', None)
+        if profile is not None:
+            record['profile'] = os.path.splitext (afile)[0] + '.' + record['name'] + '.prof'
+            profile.dump_stats (record['profile'])
+        stages.append (record)
+
+    report = {'script':script if script is not None else os.path.basename (sys.argv[0]),
+              'started':time.strftime ('%Y-%m-%dT%H:%M:%S', time.localtime (_started)),
+              'wall':time.time () - _started,
+              'peak_rss':resource.getrusage (resource.RUSAGE_SELF).ru_maxrss * rss_unit,
+              'children_peak_rss':resource.getrusage (resource.RUSAGE_CHILDREN).ru_maxrss * rss_unit,
+              'counters':dict (_counters),
+              'latencies':{key:summarize_latencies (values) for key, values in _latencies.items ()},
+              'stages':stages}
+    with open (afile, 'w') as f:
+        json.dump (report, f, indent=2)
+    return report
+
+def print_report ():
+
+    for record in _stages:
+        indent = '  ' if record['parent'] is not None else ''
+        print ('| {0:<30s} {1:9.2f} s {2:9.1f} MB'.format (indent + record['name'], record['wall'],
+                                                        record['peak_rss'] / 1024.**2))
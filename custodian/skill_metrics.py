@@ -0,0 +1,245 @@
+#!/home/elims/envs/py37/bin/python
+
+## This python scores OFS water levels against CO-OPS predictions (or
+## observations) at many stations at once. Both come as aligned (time x
+## station) arrays, and are fed a chunk of times at a time so a long
+## record never has to be in memory:
+##
+##   bias, rmse, mae, std ratio, correlation   running sums
+##   percentiles of the absolute error          histogram with 1 mm bins
+##   high / low water timing and height errors  local extremes of both
+##                                              series, each reference
+##                                              extreme matched to the
+##                                              nearest model one
+##
+## Errors are model - reference in meters, and timing errors in minutes,
+## positive when the model is late. The output is one row per station.
+#########################################################################
+
+#####################################
+## Import packages
+#####################################
+import numpy, pandas
+
+#####################################
+## Define constants
+#####################################
+# ~1 month of 6-minute data per chunk
+time_chunk = 7440
+n_minutes_per_step = 6
+
+# A high / low water is the max / min within +/- 3 hours, about a quarter
+# of the M2 period; model and reference extremes at most 3 hours apart
+# are matched.
+extreme_halfwidth_hours = 3
+match_hours = 3
+
+# Absolute errors are binned by 1 mm; anything above max_error goes into
+# the last bin.
+error_bin = 0.001
+max_error = 5.
+percentiles = [50, 90, 95, 99]
+
+# Candidate extremes checked at once, to bound memory on noisy series
+candidate_chunk = 2**18
+
+ns_per_minute = 60 * 10**9
+
+#####################################
+## Define functions
+#####################################
+def find_maxima (values, halfwidth):
+
+    # (time, station) positions of local maxima over +/- halfwidth steps;
+    # only the first of a flat top. Rises followed by a fall are the
+    # candidates, and only those are checked against their whole window.
+    values = numpy.where (numpy.isfinite (values), values, -numpy.inf)
+    is_candidate = numpy.zeros (values.shape, dtype=bool)
+    is_candidate[1:-1] = (values[1:-1] > values[:-2]) & (values[1:-1] >= values[2:]) & \
+                         numpy.isfinite (values[1:-1])
+    rows, columns = numpy.nonzero (is_candidate)
+
+    offsets = numpy.arange (-halfwidth, halfwidth + 1)
+    is_max = numpy.zeros (len (rows), dtype=bool)
+    for start in range (0, len (rows), candidate_chunk):
+        block = slice (start, start + candidate_chunk)
+        window = numpy.clip (rows[block, None] + offsets[None, :], 0, len (values) - 1)
+        peaks = values[window, columns[block, None]].max (axis=1)
+        is_max[block] = peaks == values[rows[block], columns[block]]
+    return rows[is_max], columns[is_max]
+
+def match_extremes (reference, model, tolerance):
+
+    # reference / model: (station, minute, height) arrays of one kind of
+    # extreme. For each reference extreme, the nearest model extreme of
+    # the same station within tolerance minutes; -1 if none.
+    if len (model[0]) == 0 or len (reference[0]) == 0: return numpy.full (len (reference[0]), -1)
+
+    # One sorted key of (station, minute) so all stations are searched at once
+    origin = min (reference[1].min (), model[1].min ())
+    span = max (reference[1].max (), model[1].max ()) - origin + 2 * tolerance + 1
+    model_keys = model[0] * span + (model[1] - origin)
+    order = numpy.argsort (model_keys, kind='mergesort')
+    model_keys = model_keys[order]
+    keys = reference[0] * span + (reference[1] - origin)
+
+    after = numpy.minimum (numpy.searchsorted (model_keys, keys), len (model_keys) - 1)
+    before = numpy.maximum (after - 1, 0)
+    nearest = numpy.where (numpy.abs (model_keys[before] - keys) < numpy.abs (model_keys[after] - keys),
+                           before, after)
+    is_matched = numpy.abs (model_keys[nearest] - keys) <= tolerance
+    return numpy.where (is_matched, order[nearest], -1)
+
+class SkillAccumulator (object):
+
+    def __init__ (self, stations, minutes_per_step=None):
+
+        # stations: names of the columns, in order
+        if minutes_per_step is None: minutes_per_step = n_minutes_per_step
+        self.stations = list (stations)
+        nstation = len (self.stations)
+        self.halfwidth = int (round (extreme_halfwidth_hours * 60 / minutes_per_step))
+
+        self.sums = {key:numpy.zeros (nstation) for key in
+                     ['n', 'error', 'abs_error', 'error2', 'model', 'model2', 'ref', 'ref2', 'product']}
+        self.max_abs_error = numpy.zeros (nstation)
+        self.nbins = int (round (max_error / error_bin)) + 1
+        self.histogram = numpy.zeros (nstation * self.nbins, dtype=numpy.int64)
+
+        # The last 2 * halfwidth rows are kept so that extremes near the
+        # end of a chunk are found with the next one
+        self.tail = None
+        self.extremes = {key:[] for key in ['model_high', 'model_low', 'ref_high', 'ref_low']}
+
+    def update (self, times, model, reference):
+
+        # times: (ntime,) in time order after the previous chunk;
+        # model / reference: (ntime, nstation) aligned with times
+        model = numpy.asarray (model, dtype=float)
+        reference = numpy.asarray (reference, dtype=float)
+        self.update_sums (model, reference)
+
+        minutes = numpy.asarray (times, dtype='datetime64[ns]').view ('int64') // ns_per_minute
+        if self.tail is not None:
+            minutes = numpy.concatenate ([self.tail[0], minutes])
+            model = numpy.vstack ([self.tail[1], model])
+            reference = numpy.vstack ([self.tail[2], reference])
+        self.update_extremes (minutes, model, reference)
+        keep = max (0, len (minutes) - 2 * self.halfwidth)
+        self.tail = (minutes[keep:], model[keep:], reference[keep:])
+
+    def update_sums (self, model, reference):
+
+        is_valid = numpy.isfinite (model) & numpy.isfinite (reference)
+        model, reference = numpy.where (is_valid, model, 0.), numpy.where (is_valid, reference, 0.)
+        error = model - reference
+        abs_error = numpy.abs (error)
+
+        self.sums['n'] += is_valid.sum (axis=0)
+        self.sums['error'] += error.sum (axis=0)
+        self.sums['abs_error'] += abs_error.sum (axis=0)
+        self.sums['error2'] += (error**2).sum (axis=0)
+        self.sums['model'] += model.sum (axis=0)
+        self.sums['model2'] += (model**2).sum (axis=0)
+        self.sums['ref'] += reference.sum (axis=0)
+        self.sums['ref2'] += (reference**2).sum (axis=0)
+        self.sums['product'] += (model * reference).sum (axis=0)
+        self.max_abs_error = numpy.maximum (self.max_abs_error, abs_error.max (axis=0, initial=0))
+
+        # One bincount over station-major bin indices for all stations
+        bins = numpy.minimum ((abs_error / error_bin).astype (int), self.nbins - 1)
+        bins += numpy.arange (len (self.stations))[None, :] * self.nbins
+        self.histogram += numpy.bincount (bins[is_valid], minlength=len (self.histogram))
+
+    def update_extremes (self, minutes, model, reference):
+
+        # Only rows with a full window in this buffer; the rest are found
+        # with the next chunk (or, at the record edges, not at all)
+        first, last = self.halfwidth, len (minutes) - self.halfwidth
+        for key, values in [('model_high', model), ('model_low', -model),
+                            ('ref_high', reference), ('ref_low', -reference)]:
+            rows, columns = find_maxima (values, self.halfwidth)
+            is_inside = (rows >= first) & (rows < last)
+            rows, columns = rows[is_inside], columns[is_inside]
+            sign = -1 if key.endswith ('low') else 1
+            self.extremes[key].append ((columns, minutes[rows], sign * values[rows, columns]))
+
+    def get_extremes (self, key):
+
+        parts = self.extremes[key]
+        if len (parts) == 0: return (numpy.zeros (0, dtype=int),) * 2 + (numpy.zeros (0),)
+        return tuple (numpy.concatenate ([part[index] for part in parts]) for index in range (3))
+
+    def get_timing (self, kind):
+
+        # Mean (and mean absolute) timing / height errors of matched extremes
+        nstation = len (self.stations)
+        reference, model = self.get_extremes ('ref_' + kind), self.get_extremes ('model_' + kind)
+        matched = match_extremes (reference, model, match_hours * 60)
+        is_matched = matched >= 0
+        columns = reference[0][is_matched]
+        dtimes = (model[1][matched[is_matched]] - reference[1][is_matched]).astype (float)
+        dheights = model[2][matched[is_matched]] - reference[2][is_matched]
+
+        counts = numpy.bincount (columns, minlength=nstation).astype (float)
+        with numpy.errstate (invalid='ignore', divide='ignore'):
+            return {'n_' + kind:numpy.bincount (reference[0], minlength=nstation),
+                    'n_' + kind + '_matched':counts.astype (int),
+                    kind + '_time_error':numpy.bincount (columns, dtimes, minlength=nstation) / counts,
+                    kind + '_time_mae':numpy.bincount (columns, numpy.abs (dtimes), minlength=nstation) / counts,
+                    kind + '_height_error':numpy.bincount (columns, dheights, minlength=nstation) / counts}
+
+    def get_percentiles (self):
+
+        histogram = self.histogram.reshape (len (self.stations), self.nbins)
+        cumulative = numpy.cumsum (histogram, axis=1)
+        results = {}
+        for percentile in percentiles:
+            # Upper edge of the first bin holding the percentile
+            target = cumulative[:, -1] * percentile / 100.
+            bins = numpy.argmax (cumulative >= target[:, None], axis=1)
+            values = (bins + 1) * error_bin
+            values[cumulative[:, -1] == 0] = numpy.nan
+            results['p{0}_abs_error'.format (percentile)] = values
+        return results
+
+    def to_dataframe (self):
+
+        sums = self.sums
+        with numpy.errstate (invalid='ignore', divide='ignore'):
+            n = sums['n']
+            model_var = sums['model2'] / n - (sums['model'] / n)**2
+            ref_var = sums['ref2'] / n - (sums['ref'] / n)**2
+            covariance = sums['product'] / n - sums['model'] * sums['ref'] / n**2
+            table = {'n':n.astype (int),
+                     'bias':sums['error'] / n,
+                     'rmse':numpy.sqrt (sums['error2'] / n),
+                     'mae':sums['abs_error'] / n,
+                     'max_abs_error':numpy.where (n > 0, self.max_abs_error, numpy.nan),
+                     'std_ratio':numpy.sqrt (model_var / ref_var),
+                     'corr':covariance / numpy.sqrt (model_var * ref_var)}
+        table.update (self.get_percentiles ())
+        table.update (self.get_timing ('high'))
+        table.update (self.get_timing ('low'))
+
+        dataframe = pandas.DataFrame (table, index=pandas.Index (self.stations, name='station'))
+        return dataframe
+
+def score (times, model, reference, stations, tchunk=None, minutes_per_step=None):
+
+    # Per-station skill of (ntime, nstation) arrays, a chunk of times at a time
+    if tchunk is None: tchunk = time_chunk
+    accumulator = SkillAccumulator (stations, minutes_per_step=minutes_per_step)
+    for start in range (0, len (times), tchunk):
+        rows = slice (start, start + tchunk)
+        accumulator.update (times[rows], model[rows], reference[rows])
+    return accumulator.to_dataframe ()
+
+def score_frames (model, reference, tchunk=None, minutes_per_step=None):
+
+    # model / reference: dataframes with a datetime index and a column per
+    # station; only common times and stations are scored
+    stations = [station for station in model.columns if station in reference.columns]
+    times = model.index.intersection (reference.index).sort_values ()
+    return score (times.values, model.loc[times, stations].values, reference.loc[times, stations].values,
+                  stations, tchunk=tchunk, minutes_per_step=minutes_per_step)
@@ -0,0 +1,111 @@
+#!/home/elims/envs/py37/bin/python
+
+## This python builds a spatial index over OFS node coordinates for fast
+## nearest-node and within-radius look-ups. Nodes are placed on the unit
+## sphere so that a KD-tree on (x, y, z) gives exact great-circle order;
+## chord lengths are converted back to km on the way out.
+#########################################################################
+
+#####################################
+## Import packages
+#####################################
+import numpy, pickle, hashlib, os
+from scipy.spatial import cKDTree
+
+#####################################
+## Define constants
+#####################################
+earth_radius = 6373. # km
+
+#####################################
+## Define functions
+#####################################
+chord_to_km = lambda chord: 2 * earth_radius * numpy.arcsin (numpy.clip (chord / 2, 0, 1))
+km_to_chord = lambda km: 2 * numpy.sin (numpy.minimum (km / earth_radius, numpy.pi) / 2)
+index_file_of = lambda storefile: os.path.splitext (storefile)[0] + '.nodeindex.pkl'
+
+def to_xyz (lats, lons):
+
+    lats = numpy.radians (numpy.atleast_1d (numpy.asarray (lats, dtype=float)))
+    lons = numpy.radians (numpy.atleast_1d (numpy.asarray (lons, dtype=float)))
+    return numpy.stack ([numpy.cos (lats) * numpy.cos (lons),
+                         numpy.cos (lats) * numpy.sin (lons),
+                         numpy.sin (lats)], axis=-1)
+
+def get_checksum (lats, lons):
+
+    # Identifies the node table the index was built from
+    md5 = hashlib.md5 ()
+    md5.update (numpy.ascontiguousarray (lats, dtype=float).tobytes ())
+    md5.update (numpy.ascontiguousarray (lons, dtype=float).tobytes ())
+    return md5.hexdigest ()
+
+class NodeIndex (object):
+
+    def __init__ (self, lats, lons):
+
+        lats = numpy.asarray (lats, dtype=float)
+        lons = numpy.asarray (lons, dtype=float)
+        self.checksum = get_checksum (lats, lons)
+        self.nnodes = len (lats)
+
+        # Nodes without coordinates (e.g. masked) are left out of the tree;
+        # self.nodes maps tree positions back to node indices.
+        self.nodes = numpy.where (numpy.isfinite (lats) & numpy.isfinite (lons))[0]
+        self.tree = cKDTree (to_xyz (lats[self.nodes], lons[self.nodes]))
+
+    def query (self, lats, lons, k=1, max_distance=numpy.inf):
+
+        # distances in km and node indices, shaped (npoint, k); misses
+        # beyond max_distance come back as inf / -1.
+        upper = km_to_chord (max_distance) if numpy.isfinite (max_distance) else numpy.inf
+        chords, positions = self.tree.query (to_xyz (lats, lons), k=k, distance_upper_bound=upper)
+        chords, positions = chords.reshape (len (chords), -1), positions.reshape (len (positions), -1)
+
+        is_found = positions < len (self.nodes)
+        indices = numpy.full (positions.shape, -1, dtype=int)
+        indices[is_found] = self.nodes[positions[is_found]]
+        distances = numpy.full (chords.shape, numpy.inf)
+        distances[is_found] = chord_to_km (chords[is_found])
+        return distances, indices
+
+    def query_radius (self, lats, lons, radius):
+
+        # One array of node indices / distances (km) per point, sorted by distance
+        xyz = to_xyz (lats, lons)
+        allpositions = self.tree.query_ball_point (xyz, km_to_chord (radius))
+
+        distances, indices = [], []
+        for point, positions in zip (xyz, allpositions):
+            positions = numpy.array (positions, dtype=int)
+            chords = numpy.linalg.norm (self.tree.data[positions] - point, axis=1)
+            order = numpy.argsort (chords)
+            distances.append (chord_to_km (chords[order]))
+            indices.append (self.nodes[positions[order]])
+        return distances, indices
+
+    def save (self, afile):
+
+        with open (afile + '.tmp', 'wb') as f:
+            pickle.dump (self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace (afile + '.tmp', afile)
+
+def load_node_index (afile, lats=None, lons=None):
+
+    # Returns None if missing, or if built from a different node table
+    if not os.path.exists (afile): return None
+    with open (afile, 'rb') as f:
+        node_index = pickle.load (f)
+    if lats is not None and node_index.checksum != get_checksum (lats, lons): return None
+    return node_index
+
+def get_node_index (lats, lons, afile=None):
+
+    # Reuse the persisted index when it matches; otherwise build and save
+    if afile is not None:
+        node_index = load_node_index (afile, lats=lats, lons=lons)
+        if node_index is not None: return node_index
+
+    node_index = NodeIndex (lats, lons)
+    if afile is not None: node_index.save (afile)
+    return node_index
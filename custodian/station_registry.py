@@ -0,0 +1,98 @@
+#!/home/elims/envs/py37/bin/python
+
+## This python keeps track of OFS stations as a typed array instead of
+## "lat_lon" column names. Each registry entry holds the OFS station index
+## (node) in the netcdf files, its lat / lon and an optional name and ID.
+##
+## Water levels go with the registry in StationHeights: one contiguous
+## float32 (time x station) array whose columns follow the registry order.
+## "lat_lon" names are only made when a pandas frame or csv is asked for.
+#########################################################################
+
+#####################################
+## Import packages
+#####################################
+import numpy, pandas
+
+#####################################
+## Define constants
+#####################################
+station_dtype = numpy.dtype ([('node', numpy.int32), ('lat', numpy.float64), ('lon', numpy.float64),
+                              ('name', 'U32'), ('id', 'U16')])
+
+#####################################
+## Define functions
+#####################################
+def make_registry (lats, lons, nodes=None, names=None, ids=None):
+
+    registry = numpy.zeros (len (lats), dtype=station_dtype)
+    registry['node'] = numpy.arange (len (lats)) if nodes is None else nodes
+    registry['lat'], registry['lon'] = lats, lons
+    if names is not None: registry['name'] = names
+    if ids is not None: registry['id'] = ids
+    return registry
+
+def to_columns (registry):
+
+    # Legacy "lat_lon" names, as in the csv outputs
+    return [str (lat) + '_' + str (lon) for lat, lon in zip (registry['lat'], registry['lon'])]
+
+def find_nodes (registry, nodes):
+
+    # Registry positions of the given OFS station indices; -1 if absent
+    sorter = numpy.argsort (registry['node'])
+    positions = numpy.searchsorted (registry['node'], nodes, sorter=sorter)
+    positions = sorter[numpy.minimum (positions, len (registry) - 1)]
+    return numpy.where (registry['node'][positions] == nodes, positions, -1)
+
+class StationHeights (object):
+
+    # times: (ntime,) datetime64[ns]; values: (ntime, nstation) float32
+    # with columns in the order of stations (a registry)
+    def __init__ (self, times, values, stations):
+
+        self.times = numpy.asarray (times, dtype='datetime64[ns]')
+        self.values = numpy.ascontiguousarray (values, dtype=numpy.float32)
+        self.stations = stations
+        if self.values.shape != (len (self.times), len (stations)):
+            raise ValueError ('{0} values for {1} times and {2} stations.'.format (
+                              self.values.shape, len (self.times), len (stations)))
+
+    def __len__ (self): return len (self.times)
+
+    def select (self, positions):
+
+        # Subset of stations by registry position
+        positions = numpy.asarray (positions, dtype=int)
+        return StationHeights (self.times, self.values[:, positions], self.stations[positions])
+
+    def dropna (self):
+
+        # Only stations with a complete time-series
+        return self.select (numpy.where (numpy.isfinite (self.values).all (axis=0))[0])
+
+    def sort (self):
+
+        order = numpy.argsort (self.times, kind='mergesort')
+        return StationHeights (self.times[order], self.values[order], self.stations)
+
+    def to_dataframe (self, columns=None):
+
+        # columns: a registry field (e.g. 'id', 'node') or "lat_lon" names
+        columns = to_columns (self.stations) if columns is None else self.stations[columns]
+        dataframe = pandas.DataFrame (self.values, index=pandas.DatetimeIndex (self.times),
+                                      columns=columns)
+        dataframe.index.name = 'datetime'
+        return dataframe
+
+    @staticmethod
+    def concat (parts):
+
+        # Parts along time; all must be on the same stations
+        parts = [part for part in parts if part is not None]
+        stations = parts[0].stations
+        for part in parts[1:]:
+            if not numpy.array_equal (part.stations['node'], stations['node']):
+                raise ValueError ('Cannot concatenate heights on different stations.')
+        return StationHeights (numpy.concatenate ([part.times for part in parts]),
+                               numpy.concatenate ([part.values for part in parts]), stations)
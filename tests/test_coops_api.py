@@ -0,0 +1,123 @@
+## CO-OPS API client against a local stand-in of the datagetter
+## (http.server). Run with: python -m pytest tests
+#########################################################################
+
+#####################################
+## Import packages
+#####################################
+import pandas, json, threading, os, sys, pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qsl
+
+testpath = os.path.dirname (os.path.abspath (__file__))
+sys.path.insert (0, os.path.join (testpath, '..', 'custodian'))
+
+import coops_api, ofs_obs_massager
+
+#####################################
+## Define constants
+#####################################
+# Requests failing before an answer: station -> (status, number of times)
+failures = {'8575512':(503, 2), '8571892':(429, 1), '8577330':(500, 1000)}
+
+#####################################
+## Define functions
+#####################################
+class DataGetter (BaseHTTPRequestHandler):
+
+    # Hourly predictions of value = station hours since 2020-01-01 over
+    # the requested range, after the failures of the station
+    def do_GET (self):
+
+        params = dict (parse_qsl (urlsplit (self.path).query))
+        station = params['station']
+        with self.server.lock:
+            self.server.calls.append ((station, params['begin_date'], params['end_date']))
+            status, count = failures.get (station, (200, 0))
+            nfailed = self.server.nfailed.get (station, 0)
+            if nfailed < count: self.server.nfailed[station] = nfailed + 1
+            else: status = 200
+
+        content = {'error':{'message':'down'}}
+        if status == 200:
+            times = pandas.date_range (params['begin_date'], params['end_date'], freq='1h')
+            hours = (times - pandas.Timestamp ('2020-01-01')) / pandas.Timedelta (hours=1)
+            content = {'predictions':[{'t':time.strftime ('%Y-%m-%d %H:%M'), 'v':str (hour)}
+                                      for time, hour in zip (times, hours)]}
+        body = json.dumps (content).encode ()
+        self.send_response (status)
+        self.send_header ('Content-Type', 'application/json')
+        self.send_header ('Content-Length', str (len (body)))
+        self.end_headers ()
+        self.wfile.write (body)
+
+    def log_message (self, format, *args):
+
+        pass
+
+@pytest.fixture
+def server (monkeypatch):
+
+    httpd = ThreadingHTTPServer (('127.0.0.1', 0), DataGetter)
+    httpd.lock, httpd.calls, httpd.nfailed = threading.Lock (), [], {}
+    thread = threading.Thread (target=httpd.serve_forever, daemon=True)
+    thread.start ()
+
+    monkeypatch.setattr (coops_api, 'api_host', 'http://127.0.0.1:{0}'.format (httpd.server_address[1]))
+    monkeypatch.setattr (coops_api, 'use_cache', False)
+    monkeypatch.setattr (coops_api, 'backoff_factor', 0.01)
+    monkeypatch.setattr (coops_api, '_session', None)
+    yield httpd
+
+    httpd.shutdown ()
+    httpd.server_close ()
+
+def test_split_date_range ():
+
+    chunks = coops_api.split_date_range ('20200101 00:00', '20200305 00:00', max_days=31)
+    assert chunks == [('20200101 00:00', '20200201 00:00'), ('20200201 00:00', '20200303 00:00'),
+                      ('20200303 00:00', '20200305 00:00')]
+    assert coops_api.split_date_range ('20200101 00:00', '20200101 00:00') == \
+           [('20200101 00:00', '20200101 00:00')]
+
+def test_pull_heights_stitches_chunks (server):
+
+    heights = ofs_obs_massager.pull_heights (station='8574680', begin_date='20200101 00:00',
+                                             end_date='20200305 00:00')
+    assert len (server.calls) == 3
+    assert heights.index.is_unique and heights.index.is_monotonic_increasing
+    assert heights.index[0] == pandas.Timestamp ('2020-01-01') and \
+           heights.index[-1] == pandas.Timestamp ('2020-03-05')
+    assert (heights['8574680'].values == range (len (heights))).all ()
+
+@pytest.mark.parametrize ('station', ['8575512', '8571892'])
+def test_pull_data_retries (server, station):
+
+    # 503 twice / 429 once, then an answer
+    api = coops_api.get_data_api (**{**coops_api.dataAPI_params, 'station':station,
+                                     'begin_date':'20200101 00:00', 'end_date':'20200102 00:00'})
+    content = coops_api.pull_data (api)
+    assert len (content['predictions']) == 25
+    assert len (server.calls) == failures[station][1] + 1
+
+def test_pull_many_keeps_order (server):
+
+    days = pandas.date_range ('2020-01-01', periods=20, freq='D')
+    apis = [coops_api.get_data_api (**{**coops_api.dataAPI_params, 'station':'8574680',
+                                       'begin_date':day.strftime (coops_api.date_format),
+                                       'end_date':day.strftime (coops_api.date_format)})
+            for day in days]
+    contents = coops_api.pull_many (apis, nworkers=8)
+    assert [content['predictions'][0]['t'] for content in contents] == \
+           [day.strftime ('%Y-%m-%d %H:%M') for day in days]
+
+def test_failed_chunk_gives_none (server):
+
+    # 8577330 always fails: its chunks are None, the others are not
+    apis = [coops_api.get_data_api (**{**coops_api.dataAPI_params, 'station':station,
+                                       'begin_date':'20200101 00:00', 'end_date':'20200102 00:00'})
+            for station in ['8574680', '8577330', '8573927']]
+    contents = coops_api.pull_many (apis, nworkers=3)
+    assert contents[0] is not None and contents[1] is None and contents[2] is not None
+    assert ofs_obs_massager.pull_heights (station='8577330', begin_date='20200101 00:00',
+                                          end_date='20200102 00:00') is None
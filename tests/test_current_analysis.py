@@ -0,0 +1,103 @@
+## Tidal current ellipses (analysis/current_analysis.py) from synthetic
+## currents: exact recovery, gaps, stores, and utide's ellipses.
+## Run with: python -m pytest tests
+#########################################################################
+
+#####################################
+## Import packages
+#####################################
+import numpy, pandas, os, sys, pytest
+
+testpath = os.path.dirname (os.path.abspath (__file__))
+sys.path.insert (0, os.path.join (testpath, '..', 'analysis'))
+sys.path.insert (0, os.path.join (testpath, '..', 'custodian'))
+
+from constituents import design_matrix, to_hours
+from station_registry import StationHeights, make_registry
+import current_analysis, ofs_store
+
+#####################################
+## Define constants
+#####################################
+names = ['O1', 'K1', 'N2', 'M2', 'S2', 'M4']
+
+#####################################
+## Define functions
+#####################################
+def make_ellipses (nstation, seed=0):
+
+    # Major, minor (either sign), inclination in (0, 180) and phase (deg)
+    random = numpy.random.RandomState (seed)
+    shape = (len (names), nstation)
+    major = random.uniform (0.1, 1., shape)
+    ellipses = {'major':major, 'minor':major * random.uniform (-0.8, 0.8, shape),
+                'inc':random.uniform (5., 175., shape), 'pha':random.uniform (5., 355., shape)}
+    means = random.uniform (-0.1, 0.1, nstation) + 1j * random.uniform (-0.1, 0.1, nstation)
+    return ellipses, means
+
+def make_currents (hours, ellipses, means):
+
+    # w = u + i v from W+ / W- of each ellipse on the harmonic design
+    inc, pha = numpy.radians (ellipses['inc']), numpy.radians (ellipses['pha'])
+    wplus = (ellipses['major'] + ellipses['minor']) / 2. * numpy.exp (1j * (inc - pha))
+    wminus = (ellipses['major'] - ellipses['minor']) / 2. * numpy.exp (1j * (inc + pha))
+    coefs = numpy.vstack ([means, wplus + wminus, 1j * (wplus - wminus)])
+    currents = design_matrix (hours, names).dot (coefs)
+    return currents.real, currents.imag
+
+def assert_ellipses (results, ellipses, atol=1e-8):
+
+    for key in ['major', 'minor', 'inc']:
+        numpy.testing.assert_allclose (results[key], ellipses[key], atol=atol)
+    errors = (results['pha'] - ellipses['pha'] + 180.) % 360. - 180.
+    numpy.testing.assert_allclose (errors, 0., atol=atol * 100.)
+
+def test_fit_currents_with_gaps ():
+
+    hours = to_hours (pandas.date_range ('2020-01-01', periods=24 * 40, freq='1h'))
+    ellipses, means = make_ellipses (4)
+    u, v = make_currents (hours, ellipses, means)
+
+    # A gap in u only drops the sample for both components
+    u[100:150, 1] = numpy.nan
+    v[300:320, 2] = numpy.nan
+    results = current_analysis.fit_currents (hours, u, v, names)
+    assert_ellipses (results, ellipses)
+    numpy.testing.assert_allclose (results['mean_u'] + 1j * results['mean_v'], means, atol=1e-10)
+
+def test_station_store (tmp_path):
+
+    times = pandas.date_range ('2020-01-01', periods=24 * 10 * 30, freq='6min')
+    ellipses, means = make_ellipses (3, seed=1)
+    u, v = make_currents (to_hours (times), ellipses, means)
+    registry = make_registry (numpy.array ([38., 38.5, 39.]), numpy.array ([-76., -76.2, -76.4]),
+                              nodes=numpy.array ([3, 7, 9]))
+    afile = str (tmp_path / 'currents.h5')
+    ofs_store.write_series (afile, {'u':StationHeights (times, u, registry),
+                                    'v':StationHeights (times, v, registry)}, attrs={'level':'surface'})
+
+    # float32 in the store
+    table = current_analysis.analyze_station_currents (afile, names=names)
+    assert list (table.columns) == ['station', 'tide', 'freq'] + current_analysis.ellipse_keys
+    table = table.set_index (['tide', 'station'])
+    for index, node in enumerate ([3, 7, 9]):
+        for key in ['major', 'minor', 'inc']:
+            numpy.testing.assert_allclose (table.xs (node, level='station').loc[names, key].values,
+                                           ellipses[key][:, index], atol=1e-5)
+
+def test_ellipses_match_utide ():
+
+    utide = pytest.importorskip ('utide')
+    times = pandas.date_range ('2020-01-01', periods=24 * 120, freq='1h')
+    ellipses, means = make_ellipses (1, seed=2)
+    u, v = make_currents (to_hours (times), ellipses, means)
+
+    days = ((times - pandas.Timestamp ('1970-01-01')) / pandas.Timedelta (days=1)).values
+    coef = utide.solve (days, u[:, 0], v[:, 0], lat=38., method='ols', conf_int='none', constit=names,
+                        nodal=True, trend=False, verbose=False, epoch='1970-01-01')
+    order = [list (coef.name).index (name) for name in names]
+    results = current_analysis.fit_currents (to_hours (times), u, v, names)
+    numpy.testing.assert_allclose (coef.Lsmaj[order], results['major'][:, 0], rtol=0.02)
+    numpy.testing.assert_allclose (coef.Lsmin[order], results['minor'][:, 0], atol=0.02)
+    numpy.testing.assert_allclose (coef.theta[order], results['inc'][:, 0], atol=1.)
+    numpy.testing.assert_allclose ((coef.g[order] - results['pha'][:, 0] + 180.) % 360. - 180., 0., atol=1.)
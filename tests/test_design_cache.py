@@ -0,0 +1,79 @@
+## Harmonic designs (analysis/design_cache.py): gap solves against plain
+## least squares, and the memory / disk caches.
+## Run with: python -m pytest tests
+#########################################################################
+
+#####################################
+## Import packages
+#####################################
+import numpy, pandas, os, sys
+
+testpath = os.path.dirname (os.path.abspath (__file__))
+sys.path.insert (0, os.path.join (testpath, '..', 'analysis'))
+
+from constituents import select_constituents, to_hours
+import design_cache
+
+#####################################
+## Define functions
+#####################################
+def get_axis (ndays=40):
+
+    hours = to_hours (pandas.date_range ('2020-01-01', periods=24 * ndays, freq='1h'))
+    return hours, select_constituents (hours[-1] - hours[0])
+
+def test_solve_with_gaps_matches_lstsq ():
+
+    hours, names = get_axis ()
+    design = design_cache.Design (hours, names)
+    values = numpy.random.RandomState (0).standard_normal ((len (hours), 3))
+
+    # No gap, a few missing rows (downdated Cholesky) and most rows missing
+    # (normal equations rebuilt from the good rows)
+    for nmissing in [0, 50, 700]:
+        is_good = numpy.ones (len (hours), dtype=bool)
+        is_good[100:100+nmissing] = False
+        coefs, unscaled = design.solve (values[is_good], is_good=is_good)
+        X = design.X[is_good]
+        numpy.testing.assert_allclose (coefs, numpy.linalg.lstsq (X, values[is_good], rcond=None)[0],
+                                       atol=1e-10)
+        numpy.testing.assert_allclose (unscaled, numpy.linalg.inv (X.T.dot (X)), atol=1e-10)
+
+def test_memory_cache_keeps_factors_only (monkeypatch):
+
+    monkeypatch.setattr (design_cache, '_factors', {})
+    monkeypatch.setattr (design_cache, 'n_designs_in_memory', 2)
+    hours, names = get_axis ()
+    first = design_cache.get_design (hours, names)
+    again = design_cache.get_design (hours, names)
+    assert again._X is None
+    numpy.testing.assert_array_equal (again.cholesky, first.cholesky)
+    numpy.testing.assert_array_equal (again.X, first.X)
+
+    # Bounded: the oldest entries go first
+    for ndays in [41, 42]: design_cache.get_design (get_axis (ndays)[0], names)
+    assert len (design_cache._factors) == 2
+    assert design_cache.get_key (hours, names) not in design_cache._factors
+    for factors in design_cache._factors.values ():
+        assert sorted (factors) == sorted (design_cache.factor_arrays)
+
+def test_disk_cache (tmp_path, monkeypatch):
+
+    monkeypatch.setattr (design_cache, '_factors', {})
+    hours, names = get_axis ()
+    design = design_cache.get_design (hours, names, cache_path=str (tmp_path))
+    afile = design_cache.get_design_file (design_cache.get_key (hours, names), str (tmp_path))
+    assert os.path.exists (afile)
+
+    # Read back from disk in a fresh process (empty memory cache)
+    monkeypatch.setattr (design_cache, '_factors', {})
+    stored = design_cache.get_design (hours, names, cache_path=str (tmp_path))
+    for name in design_cache.design_arrays:
+        numpy.testing.assert_array_equal (getattr (stored, name), getattr (design, name))
+    assert stored.names == list (names)
+
+    # A broken file is recomputed
+    monkeypatch.setattr (design_cache, '_factors', {})
+    with open (afile, 'wb') as f: f.write (b'broken')
+    numpy.testing.assert_allclose (design_cache.get_design (hours, names, cache_path=str (tmp_path)).gram,
+                                   design.gram)
@@ -0,0 +1,130 @@
+## download_netcdf.py against a local HTTP stand-in of the NOS server
+## holding a month of netCDF3 / netCDF4 files, two of them truncated.
+## Run with: python -m pytest tests
+#########################################################################
+
+#####################################
+## Import packages
+#####################################
+import numpy, xarray, threading, os, sys, pytest
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+testpath = os.path.dirname (os.path.abspath (__file__))
+sys.path.insert (0, os.path.join (testpath, '..', 'custodian'))
+
+import download_netcdf
+
+#####################################
+## Define constants
+#####################################
+month = '202001'
+names = {'classic':'nos.cbofs.stations.forecast.20200101.t00z.nc',
+         'netcdf4':'nos.cbofs.stations.forecast.20200101.t06z.nc',
+         'classic_cut':'nos.cbofs.stations.forecast.20200101.t12z.nc',
+         'netcdf4_cut':'nos.cbofs.stations.forecast.20200101.t18z.nc'}
+
+#####################################
+## Define functions
+#####################################
+class RangeHandler (SimpleHTTPRequestHandler):
+
+    # http.server does not do Range requests; answer 'bytes=N-' with a 206
+    def send_head (self):
+
+        self.server.ranges.append (self.headers.get ('Range'))
+        path = self.translate_path (self.path)
+        if self.headers.get ('Range') is None or not os.path.isfile (path):
+            return super ().send_head ()
+
+        start = int (self.headers['Range'].split ('=')[1].split ('-')[0])
+        size = os.path.getsize (path)
+        f = open (path, 'rb')
+        f.seek (start)
+        self.send_response (206)
+        self.send_header ('Content-Type', 'application/octet-stream')
+        self.send_header ('Content-Range', 'bytes {0}-{1}/{2}'.format (start, size - 1, size))
+        self.send_header ('Content-Length', str (size - start))
+        self.end_headers ()
+        return f
+
+    def log_message (self, format, *args):
+
+        pass
+
+def write_file (afile, netcdf4):
+
+    times = numpy.arange (600)
+    dataset = xarray.Dataset ({'zeta':(('ocean_time', 'station'), numpy.random.rand (600, 20))},
+                              coords={'ocean_time':times})
+    if netcdf4: dataset.to_netcdf (afile, format='NETCDF4')
+    else: dataset.to_netcdf (afile, format='NETCDF3_64BIT', engine='scipy')
+
+def truncate (afile):
+
+    with open (afile, 'rb+') as f: f.truncate (os.path.getsize (afile) * 2 // 3)
+
+@pytest.fixture
+def server (tmp_path):
+
+    # The server's files: two good, two cut short as if caught mid-upload
+    serverpath = tmp_path / 'server'
+    (serverpath / month).mkdir (parents=True)
+    for key, name in names.items ():
+        afile = str (serverpath / month / name)
+        write_file (afile, key.startswith ('netcdf4'))
+        if key.endswith ('cut'): truncate (afile)
+
+    handler = partial (RangeHandler, directory=str (serverpath))
+    httpd = ThreadingHTTPServer (('127.0.0.1', 0), handler)
+    httpd.ranges = []
+    thread = threading.Thread (target=httpd.serve_forever, daemon=True)
+    thread.start ()
+    httpd.url = 'http://127.0.0.1:{0}/'.format (httpd.server_address[1])
+    httpd.path = serverpath
+    yield httpd
+
+    httpd.shutdown ()
+    httpd.server_close ()
+
+def test_download_resume_and_rerun (server, tmp_path):
+
+    datapath = tmp_path / 'data'
+    (datapath / month).mkdir (parents=True)
+
+    # Half of the netCDF4 file was downloaded before an interruption
+    with open (str (server.path / month / names['netcdf4']), 'rb') as f: content = f.read ()
+    with open (str (datapath / month / names['netcdf4']) + '.part', 'wb') as f:
+        f.write (content[:len (content) // 2])
+
+    statuses = download_netcdf.download_netcdf ('stations', 2020, str (datapath), url=server.url,
+                                                nworkers=2)
+    statuses = {os.path.basename (afile):status for afile, status in statuses.items ()}
+    assert statuses == {names['classic']:'downloaded', names['netcdf4']:'downloaded',
+                        names['classic_cut']:'bad', names['netcdf4_cut']:'bad'}
+    assert 'bytes={0}-'.format (len (content) // 2) in server.ranges
+
+    # Good files are whole and readable; cut ones are only kept as .bad
+    for key, name in names.items ():
+        afile = str (datapath / month / name)
+        assert not os.path.exists (afile + '.part')
+        if key.endswith ('cut'):
+            assert os.path.exists (afile + '.bad') and not os.path.exists (afile)
+            continue
+        with open (afile, 'rb') as f, open (str (server.path / month / name), 'rb') as g:
+            assert f.read () == g.read ()
+        xarray.open_dataset (afile).close ()
+
+    # Nothing is fetched again on a rerun
+    statuses = download_netcdf.download_netcdf ('stations', 2020, str (datapath), url=server.url)
+    assert sorted (statuses.values ()) == ['bad', 'bad', 'skipped', 'skipped']
+
+def test_check_netcdf (tmp_path):
+
+    # Whole files pass, any cut of them fails
+    for netcdf4 in [False, True]:
+        afile = str (tmp_path / 'file.nc')
+        write_file (afile, netcdf4)
+        assert download_netcdf.check_netcdf (afile)
+        truncate (afile)
+        assert not download_netcdf.check_netcdf (afile)
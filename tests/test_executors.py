@@ -0,0 +1,65 @@
+## Month map-reduce of ofs_massager on each executor (see executors.py):
+## serial, a process pool and a dask LocalCluster must write the same
+## stores. Run with: python -m pytest tests
+#########################################################################
+
+#####################################
+## Import packages
+#####################################
+import numpy, h5py, os, sys, pytest
+
+testpath = os.path.dirname (os.path.abspath (__file__))
+custodianpath = os.path.join (testpath, '..', 'custodian')
+sys.path.insert (0, custodianpath)
+sys.path.insert (0, os.path.join (testpath, '..', 'benchmarks'))
+
+import synthetic_ofs, ofs_massager, ofs_store
+
+#####################################
+## Define functions
+#####################################
+def read_store (afile):
+
+    # Every dataset, by its path in the file
+    datasets = {}
+    with h5py.File (afile, 'r') as f:
+        f.visititems (lambda name, item: datasets.update ({name:item[()]})
+                      if isinstance (item, h5py.Dataset) else None)
+    return datasets
+
+def run_kind (tmp_path, monkeypatch, afiles, kind):
+
+    # Heights and full forecasts of all months through one executor
+    outpath = tmp_path / kind
+    outpath.mkdir ()
+    monkeypatch.setattr (ofs_massager, 'executor_kind', kind)
+    monkeypatch.setattr (ofs_massager, 'partitionPath', str (outpath / 'partitions'))
+    heights = ofs_massager.collect_ofs_data (nworkers=2, by_month=True, allfiles=afiles,
+                                             cycle_file=str (outpath / 'cycles.h5'))
+    ofs_store.write_heights (str (outpath / 'heights.h5'), heights)
+
+    # Same for the per-month reads without a cycle store
+    heights = ofs_massager.collect_ofs_data (nworkers=2, by_month=True, allfiles=afiles)
+    ofs_store.write_heights (str (outpath / 'month_heights.h5'), heights)
+    return {name:read_store (str (outpath / name)) for name in ['cycles.h5', 'heights.h5',
+                                                                 'month_heights.h5']}
+
+def test_executors_write_the_same_stores (tmp_path, monkeypatch):
+
+    pytest.importorskip ('dask.distributed')
+
+    # Spawned dask workers import the custodian scripts from PYTHONPATH
+    monkeypatch.setenv ('PYTHONPATH', os.pathsep.join ([os.path.abspath (custodianpath),
+                                                        os.environ.get ('PYTHONPATH', '')]))
+
+    # Three month sub-folders
+    afiles = synthetic_ofs.make_stations_files (str (tmp_path / 'data'), nstations=6, ndays=70,
+                                                ncycles=1, nhours=6)
+    assert len (ofs_massager.get_months (afiles)) == 3
+
+    stores = {kind:run_kind (tmp_path, monkeypatch, afiles, kind) for kind in ['serial', 'process', 'dask']}
+    for kind in ['process', 'dask']:
+        for name, store in stores['serial'].items ():
+            assert store.keys () == stores[kind][name].keys ()
+            for key, values in store.items ():
+                numpy.testing.assert_array_equal (values, stores[kind][name][key], err_msg=name + key)
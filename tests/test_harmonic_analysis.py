@@ -0,0 +1,104 @@
+## Batched harmonic analysis (analysis/harmonic_analysis.py) on synthetic
+## tides: exact recovery with gaps, and nodal corrections against utide.
+## Run with: python -m pytest tests
+#########################################################################
+
+#####################################
+## Import packages
+#####################################
+import numpy, pandas, os, sys, pytest
+
+testpath = os.path.dirname (os.path.abspath (__file__))
+sys.path.insert (0, os.path.join (testpath, '..', 'analysis'))
+
+from constituents import design_matrix, select_constituents, to_hours
+import harmonic_analysis
+
+#####################################
+## Define constants
+#####################################
+# Major constituents, whose nodal corrections must agree with utide
+major_names = ['M2', 'S2', 'N2', 'K1', 'O1', 'K2', 'M4']
+
+#####################################
+## Define functions
+#####################################
+def make_tides (hours, names, nstation, seed=0, noise=0.):
+
+    # Means, amplitudes and phases (deg) drawn at random, and their series
+    # with white noise of the given standard deviation (m)
+    random = numpy.random.RandomState (seed)
+    means = random.uniform (-0.2, 0.2, nstation)
+    amps = random.uniform (0.02, 0.5, (len (names), nstation))
+    phases = random.uniform (0., 360., (len (names), nstation))
+    coefs = numpy.vstack ([means, amps * numpy.cos (numpy.radians (phases)),
+                           amps * numpy.sin (numpy.radians (phases))])
+    values = design_matrix (hours, names).dot (coefs)
+    return means, amps, phases, values + noise * random.standard_normal (values.shape)
+
+def get_phase_errors (phases, expected):
+
+    return (phases - expected + 180.) % 360. - 180.
+
+def test_fit_recovers_constituents_with_gaps ():
+
+    times = pandas.date_range ('2020-01-01', periods=24 * 60, freq='1h')
+    hours = to_hours (times)
+    names = select_constituents (hours[-1] - hours[0])
+    means, amps, phases, values = make_tides (hours, names, 5)
+    noisy = make_tides (hours, names, 5, noise=0.05)[-1]
+
+    # Complete; two sharing one gap; a short gap (downdated normal
+    # equations); most of the record missing (rebuilt normal equations)
+    for series in [values, noisy]:
+        series[100:300, 1:3] = numpy.nan
+        series[500:510, 3] = numpy.nan
+        series[200:1200, 4] = numpy.nan
+
+    results = harmonic_analysis.fit_constituents (hours, values, names)
+    numpy.testing.assert_allclose (results['mean'], means, atol=1e-8)
+    numpy.testing.assert_allclose (results['amp'], amps, atol=1e-8)
+    numpy.testing.assert_allclose (get_phase_errors (results['pha'], phases), 0., atol=1e-6)
+
+    # Each column alone gives the same answer as the grouped solve
+    results = harmonic_analysis.fit_constituents (hours, noisy, names)
+    for column in range (noisy.shape[1]):
+        alone = harmonic_analysis.fit_constituents (hours, noisy[:, column], names)
+        numpy.testing.assert_allclose (alone['amp'][:, 0], results['amp'][:, column], atol=1e-10)
+        numpy.testing.assert_allclose (alone['amp_err'][:, 0], results['amp_err'][:, column], rtol=1e-6)
+
+def test_too_few_samples_give_nan ():
+
+    hours = to_hours (pandas.date_range ('2020-01-01', periods=24 * 30, freq='1h'))
+    names = select_constituents (hours[-1] - hours[0])
+    values = make_tides (hours, names, 2)[-1]
+    values[2 * len (names):, 1] = numpy.nan
+    results = harmonic_analysis.fit_constituents (hours, values, names)
+    assert numpy.isfinite (results['amp'][:, 0]).all () and numpy.isnan (results['amp'][:, 1]).all ()
+
+def test_harmonic_analysis_tables ():
+
+    times = pandas.date_range ('2020-01-01', periods=24 * 30, freq='1h')
+    names = ['M2', 'K1']
+    values = make_tides (to_hours (times), names, 2)[-1]
+    percents, tables = harmonic_analysis.harmonic_analysis (pandas.DataFrame (values, index=times,
+                                                            columns=['a', 'b']), names=names)
+    assert list (tables) == ['a', 'b'] and list (tables['a'].tide) == names
+    numpy.testing.assert_allclose (percents.values, 100.)
+
+@pytest.mark.parametrize ('year', [2006, 2011])
+def test_nodal_corrections_match_utide (year):
+
+    # The lunar node is near 0 deg in 2006 (f of M2 ~ 0.963) and near 270
+    # deg in 2011 (u of M2 ~ +2 deg): utide must find the same constants
+    # in a year of hourly tides synthesized with our f, u and V
+    utide = pytest.importorskip ('utide')
+    times = pandas.date_range ('{0}-01-01'.format (year), '{0}-12-31'.format (year), freq='1h')
+    _, amps, phases, values = make_tides (to_hours (times), major_names, 1, seed=year)
+
+    days = ((times - pandas.Timestamp ('1970-01-01')) / pandas.Timedelta (days=1)).values
+    coef = utide.solve (days, values[:, 0], lat=38., method='ols', conf_int='none', constit=major_names,
+                        nodal=True, trend=False, verbose=False, epoch='1970-01-01')
+    order = [list (coef.name).index (name) for name in major_names]
+    numpy.testing.assert_allclose (coef.A[order], amps[:, 0], rtol=0.01)
+    numpy.testing.assert_allclose (get_phase_errors (coef.g[order], phases[:, 0]), 0., atol=0.5)
@@ -0,0 +1,59 @@
+## Incremental ingestion into the heights store on a synthetic archive
+## (see benchmarks/synthetic_ofs.py). Run with: python -m pytest tests
+#########################################################################
+
+#####################################
+## Import packages
+#####################################
+import numpy, xarray, os, sys
+
+testpath = os.path.dirname (os.path.abspath (__file__))
+sys.path.insert (0, os.path.join (testpath, '..', 'custodian'))
+sys.path.insert (0, os.path.join (testpath, '..', 'benchmarks'))
+
+import synthetic_ofs, ofs_massager, ofs_store
+
+#####################################
+## Define functions
+#####################################
+def put_nan (afile, station):
+
+    # One missing water level at one station of a file
+    dataset = xarray.open_dataset (afile, decode_times=False).load ()
+    dataset['zeta'][3, station] = numpy.nan
+    dataset.to_netcdf (afile + '.tmp')
+    os.replace (afile + '.tmp', afile)
+
+def run_batch (monkeypatch, files):
+
+    # One nightly incremental run over the given files
+    monkeypatch.setattr (ofs_massager, 'list_ofs_files', lambda: files)
+    heights, manifest = ofs_massager.update_ofs_data ()
+    ofs_massager.append_increment (heights)
+    ofs_massager.save_manifest (manifest)
+
+def test_incremental_batches_keep_complete_stations (tmp_path, monkeypatch):
+
+    monkeypatch.setattr (ofs_massager, 'heightsFile', str (tmp_path / 'heights.h5'))
+    monkeypatch.setattr (ofs_massager, 'manifestFile', str (tmp_path / 'manifest.json'))
+    monkeypatch.setattr (ofs_massager, 'executor_kind', 'serial')
+    monkeypatch.setattr (ofs_massager, 'n_workers', 1)
+
+    afiles = synthetic_ofs.make_stations_files (str (tmp_path / 'data'), nstations=8, ndays=2,
+                                                ncycles=4, nhours=6)
+    first, second = afiles[:4], afiles[4:]
+    put_nan (first[1], 3)
+    put_nan (second[2], 5)
+
+    # The first batch drops station 3, which is complete in the second
+    run_batch (monkeypatch, first)
+    stations = ofs_store.read_stations (ofs_massager.heightsFile)
+    assert list (stations['node']) == [0, 1, 2, 4, 5, 6, 7]
+
+    # The second batch keeps the stored stations and drops station 5,
+    # which now has a gap, instead of storing its gap as NaN
+    run_batch (monkeypatch, first + second)
+    heights = ofs_store.read_heights (ofs_massager.heightsFile)
+    assert list (heights.stations['node']) == [0, 1, 2, 4, 6, 7]
+    assert numpy.isfinite (heights.values).all ()
+    assert len (heights) == 2 * 4 * 6 * 10
@@ -0,0 +1,40 @@
+## OFS series at the CO-OPS stations (custodian/ofs_obs_massager.py)
+## from a small synthetic heights store. Run with: python -m pytest tests
+#########################################################################
+
+#####################################
+## Import packages
+#####################################
+import numpy, pandas, os, sys
+
+testpath = os.path.dirname (os.path.abspath (__file__))
+sys.path.insert (0, os.path.join (testpath, '..', 'custodian'))
+
+from station_registry import StationHeights, make_registry
+import ofs_obs_massager, ofs_store
+
+#####################################
+## Define functions
+#####################################
+def test_stations_without_stencil_take_nearest_node (tmp_path, monkeypatch):
+
+    # A 0.01 deg grid of OFS stations; heights are the station position
+    lats, lons = [value.ravel () for value in numpy.meshgrid (numpy.arange (38., 38.1, 0.01),
+                                                              numpy.arange (-76.5, -76.4, 0.01))]
+    times = pandas.date_range ('2020-01-01', periods=10, freq='6min')
+    values = numpy.tile (numpy.arange (len (lats), dtype=float), (len (times), 1))
+    afile = str (tmp_path / 'heights.h5')
+    ofs_store.write_heights (afile, StationHeights (times, values, make_registry (lats, lons)))
+    monkeypatch.setattr (ofs_obs_massager, 'ofsAllFile', afile)
+    monkeypatch.setattr (ofs_obs_massager, 'ofsWeightsFile', str (tmp_path / 'weights.pkl'))
+
+    # One station inside the grid, one ~30 km away from any node
+    metadata = pandas.DataFrame ({'id':['inside', 'far'], 'name':['a', 'b'],
+                                  'lat':[38.045, 38.35], 'lon':[-76.455, -76.45]})
+    ofsstations = ofs_store.read_stations (afile)
+    metadata = ofs_obs_massager.match_stations_by_ofs_indices (metadata, ofsstations)
+    ofsdata = ofs_obs_massager.read_interpolated_ofs (metadata, ofsstations)
+
+    assert list (ofsdata.columns) == ['inside', 'far'] and numpy.isfinite (ofsdata.values).all ()
+    assert metadata.ofs_stencil.iloc[0] != 'nearest' and metadata.ofs_stencil.iloc[1] == 'nearest'
+    numpy.testing.assert_array_equal (ofsdata['far'].values, metadata.nearest_ofsIndex.iloc[1])
@@ -0,0 +1,46 @@
+## Per-station plots (custodian/ofs_plotter.py): one PDF per station, or
+## one multipage PDF with any number of workers.
+## Run with: python -m pytest tests
+#########################################################################
+
+#####################################
+## Import packages
+#####################################
+import numpy, pandas, os, sys, re, pytest
+
+testpath = os.path.dirname (os.path.abspath (__file__))
+sys.path.insert (0, os.path.join (testpath, '..', 'custodian'))
+
+import ofs_plotter
+
+#####################################
+## Define functions
+#####################################
+def make_items (nitems):
+
+    times = pandas.date_range ('2020-01-01', periods=48, freq='1h')
+    return [(38. + index / 100., -76., times, numpy.sin (numpy.arange (48) / (index + 1.)))
+            for index in range (nitems)]
+
+def count_pages (afile):
+
+    with open (afile, 'rb') as f:
+        return len (re.findall (rb'/Type\s*/Page\b', f.read ()))
+
+@pytest.mark.parametrize ('nworkers', [1, 2])
+def test_one_multipage_file (tmp_path, monkeypatch, nworkers):
+
+    monkeypatch.setattr (ofs_plotter, 'n_pages_per_task', 2)
+    outpath = str (tmp_path / 'plots')
+    assert ofs_plotter.render (ofs_plotter.HeightFigure, make_items (5), outpath,
+                               nworkers=nworkers, multipage_file='heights.pdf') == 5
+    assert os.listdir (outpath) == ['heights.pdf']
+    assert count_pages (os.path.join (outpath, 'heights.pdf')) == 5
+
+def test_one_file_per_station (tmp_path):
+
+    outpath = str (tmp_path / 'plots')
+    assert ofs_plotter.render (ofs_plotter.HeightFigure, make_items (3), outpath, nworkers=2) == 3
+    assert sorted (os.listdir (outpath)) == ['ofs_height_38.0000_-76.0000.pdf',
+                                              'ofs_height_38.0100_-76.0000.pdf',
+                                              'ofs_height_38.0200_-76.0000.pdf']
@@ -0,0 +1,35 @@
+## Forecast cycle store (custodian/ofs_store.py): reading scattered rows
+## in runs. Run with: python -m pytest tests
+#########################################################################
+
+#####################################
+## Import packages
+#####################################
+import numpy, pandas, h5py, os, sys
+
+testpath = os.path.dirname (os.path.abspath (__file__))
+sys.path.insert (0, os.path.join (testpath, '..', 'custodian'))
+
+from station_registry import make_registry
+import ofs_store
+
+#####################################
+## Define functions
+#####################################
+def test_read_forecast_rows_in_runs (tmp_path):
+
+    ncycle, nlead, nstation = 100, 12, 5
+    values = numpy.random.RandomState (0).standard_normal ((ncycle, nlead, nstation)).astype (numpy.float32)
+    cycles = pandas.date_range ('2020-01-01', periods=ncycle, freq='6h')
+    registry = make_registry (numpy.linspace (37., 39., nstation), numpy.linspace (-77., -76., nstation))
+    afile = str (tmp_path / 'cycles.h5')
+    ofs_store.append_cycles (afile, cycles, values, registry, 6)
+
+    # Unsorted rows, repeats and gaps wider than a cycle chunk; repeated
+    # and unsorted stations
+    rows = numpy.array ([97, 3, 4, 3, 60, 0, 99, 40])
+    stations = numpy.array ([4, 0, 4, 2])
+    with h5py.File (afile, 'r') as f:
+        read = ofs_store.read_forecast_rows (f, rows, slice (2, 9), stations)
+        numpy.testing.assert_array_equal (read, values[rows][:, 2:9][:, :, stations])
+        assert ofs_store.read_forecast_rows (f, rows[:0], slice (2, 9), stations).shape == (0, 7, 4)
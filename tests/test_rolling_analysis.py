@@ -0,0 +1,81 @@
+## Rolling / expanding window harmonic analysis (analysis/
+## rolling_analysis.py) against direct fits of the same windows.
+## Run with: python -m pytest tests
+#########################################################################
+
+#####################################
+## Import packages
+#####################################
+import numpy, pandas, os, sys, pytest
+
+testpath = os.path.dirname (os.path.abspath (__file__))
+sys.path.insert (0, os.path.join (testpath, '..', 'analysis'))
+
+from constituents import design_matrix, to_hours
+import rolling_analysis, harmonic_analysis
+
+#####################################
+## Define constants
+#####################################
+names = ['O1', 'K1', 'N2', 'M2', 'S2', 'M4']
+
+#####################################
+## Define functions
+#####################################
+def make_dataframe (ndays=20, nstation=6, seed=0):
+
+    # Hourly tides and noise; station 0 complete, 1 and 2 with a few
+    # scattered gaps, 3 with a gap of days, 4 mostly missing, 5 complete
+    random = numpy.random.RandomState (seed)
+    times = pandas.date_range ('2020-01-01', periods=24 * ndays, freq='1h')
+    coefs = random.uniform (-0.3, 0.3, (1 + 2 * len (names), nstation))
+    values = design_matrix (to_hours (times), names).dot (coefs) + \
+             0.02 * random.standard_normal ((len (times), nstation))
+    for column in [1, 2]: values[random.choice (len (times), 20, replace=False), column] = numpy.nan
+    values[24 * 5:24 * 8, 3] = numpy.nan
+    values[24:, 4] = numpy.nan
+    return pandas.DataFrame (values, index=times, columns=['s{0}'.format (i) for i in range (nstation)])
+
+def get_direct (dataframe, table):
+
+    # Direct fits of every window in the table, in the table's row order
+    direct = []
+    for (begin, end), _ in table.groupby (['begin', 'end'], sort=False):
+        window = dataframe[(dataframe.index >= begin) & (dataframe.index < end + pandas.Timedelta (days=1))]
+        results = harmonic_analysis.fit_constituents (to_hours (window.index), window.values, names)
+        ncover = numpy.isfinite (window.values).sum (axis=0)
+        is_valid = ncover >= rolling_analysis.min_coverage * len (window)
+        for key in ['amp', 'amp_err', 'pha', 'pha_err']:
+            results[key][:, ~is_valid] = numpy.nan
+        direct.append ({key:results[key].ravel () for key in ['amp', 'amp_err', 'pha', 'pha_err']})
+    return {key:numpy.concatenate ([window[key] for window in direct]) for key in direct[0]}
+
+@pytest.mark.parametrize ('expanding', [False, True])
+@pytest.mark.parametrize ('max_missing_bytes', [None, 1])
+def test_windows_match_direct_fits (monkeypatch, expanding, max_missing_bytes):
+
+    # With 1 byte, stations with gaps are solved one at a time
+    if max_missing_bytes is not None:
+        monkeypatch.setattr (rolling_analysis, 'max_missing_bytes', max_missing_bytes)
+    dataframe = make_dataframe ()
+    table = rolling_analysis.rolling_analysis (dataframe, names=names, window_days=10, step_days=2,
+                                               expanding=expanding)
+    nwindow = len (range (10, 21, 2))
+    assert len (table) == nwindow * len (names) * dataframe.shape[1]
+    assert (table.end - table.begin == pandas.Timedelta (days=9)).all () != expanding
+
+    direct = get_direct (dataframe, table)
+    numpy.testing.assert_allclose (table.amp.values, direct['amp'], atol=1e-10)
+    numpy.testing.assert_allclose (table.amp_err.values, direct['amp_err'], rtol=1e-6)
+    errors = (table.pha.values - direct['pha'] + 180.) % 360. - 180.
+    numpy.testing.assert_allclose (errors[numpy.isfinite (errors)], 0., atol=1e-7)
+
+    # Station 4 never has enough samples; station 3 only outside its gap
+    assert table[table.station == 's4'].amp.isnull ().all ()
+    assert table[table.station == 's3'].amp.isnull ().any ()
+    assert table[table.station == 's0'].amp.notnull ().all ()
+
+    # nobs counts the good samples of each window
+    last = table[(table.end == table.end.max ()) & (table.tide == 'M2')].set_index ('station')
+    window = dataframe[dataframe.index >= last.begin.iloc[0]]
+    numpy.testing.assert_array_equal (last.nobs.values, numpy.isfinite (window.values).sum (axis=0))
@@ -0,0 +1,100 @@
+## FFT screening (analysis/spectral_screening.py) of synthetic series:
+## line amplitudes, flags, pruning and store blocks.
+## Run with: python -m pytest tests
+#########################################################################
+
+#####################################
+## Import packages
+#####################################
+import numpy, pandas, os, sys
+
+testpath = os.path.dirname (os.path.abspath (__file__))
+sys.path.insert (0, os.path.join (testpath, '..', 'analysis'))
+sys.path.insert (0, os.path.join (testpath, '..', 'custodian'))
+
+from constituents import design_matrix, to_hours
+from station_registry import StationHeights, make_registry
+import spectral_screening, ofs_store
+
+#####################################
+## Define constants
+#####################################
+# Constituents in the tidal series (m); the other candidates are absent
+amplitudes = {'O1':0.10, 'K1':0.15, 'N2':0.10, 'M2':0.50, 'S2':0.12, 'M4':0.03}
+
+#####################################
+## Define functions
+#####################################
+def make_dataframe (ndays=90, seed=0):
+
+    # Columns: three tidal series, one with 40% missing, one flat, one of
+    # noise only and one tidal with strong high-frequency noise
+    random = numpy.random.RandomState (seed)
+    times = pandas.date_range ('2020-01-01', periods=24 * 10 * ndays, freq='6min')
+    names = list (amplitudes)
+    X = design_matrix (to_hours (times), names)
+
+    columns = {}
+    for index in range (3):
+        phases = random.uniform (0., 2. * numpy.pi, len (names))
+        coefs = numpy.r_[0.1 * index, numpy.array (list (amplitudes.values ())) * numpy.cos (phases),
+                         numpy.array (list (amplitudes.values ())) * numpy.sin (phases)]
+        columns['tide{0}'.format (index)] = X.dot (coefs) + 0.01 * random.standard_normal (len (times))
+    gappy = columns['tide0'].copy ()
+    gappy[random.rand (len (times)) < 0.4] = numpy.nan
+    columns['gappy'] = gappy
+    columns['flat'] = numpy.full (len (times), 0.3)
+    columns['noise'] = numpy.cumsum (0.01 * random.standard_normal (len (times)))
+    columns['noisy'] = columns['tide1'] + 0.3 * random.standard_normal (len (times))
+    return pandas.DataFrame (columns, index=times)
+
+def get_flags (results, columns):
+
+    table = spectral_screening.to_table (results, columns)
+    return table['flags'].to_dict ()
+
+def test_screen_dataframe ():
+
+    dataframe = make_dataframe ()
+    results = spectral_screening.screen_dataframe (dataframe)
+    flags = get_flags (results, dataframe.columns)
+    assert flags['tide0'] == flags['tide1'] == flags['tide2'] == ''
+    assert 'gappy' in flags['gappy'].split (',')
+    assert 'flat' in flags['flat'].split (',')
+    assert 'non_tidal' in flags['noise'].split (',')
+    assert 'noisy' in flags['noisy'].split (',')
+
+    # Line amplitudes of the tidal series, and nothing at absent lines
+    amps = pandas.DataFrame (results['amp'], index=results['names'], columns=dataframe.columns)
+    for name, amplitude in amplitudes.items ():
+        numpy.testing.assert_allclose (amps.loc[name, ['tide0', 'tide1', 'tide2']], amplitude, rtol=0.05)
+    absent = [name for name in results['names'] if name not in amplitudes]
+    assert (amps.loc[absent, ['tide0', 'tide1', 'tide2']].values < spectral_screening.min_amplitude).all ()
+
+    # Energy: the variance sits in the tidal bands
+    table = spectral_screening.to_table (results, dataframe.columns)
+    assert (table.loc[['tide0', 'tide1', 'tide2'], 'tidal_fraction'] > 0.9).all ()
+    assert table.loc['gappy', 'coverage'] < 0.7
+
+def test_prune_constituents ():
+
+    dataframe = make_dataframe ()
+    results = spectral_screening.screen_dataframe (dataframe)
+    assert spectral_screening.prune_constituents (results) == list (amplitudes)
+    assert spectral_screening.prune_constituents (results, keep=['MS4', 'O1']) == \
+           ['O1', 'K1', 'N2', 'M2', 'S2', 'M4', 'MS4']
+
+def test_screen_heights_in_blocks (tmp_path):
+
+    dataframe = make_dataframe (ndays=40)
+    registry = make_registry (numpy.linspace (37., 39., dataframe.shape[1]),
+                              numpy.linspace (-77., -76., dataframe.shape[1]))
+    afile = str (tmp_path / 'heights.h5')
+    ofs_store.write_heights (afile, StationHeights (dataframe.index, dataframe.values, registry))
+
+    expected = spectral_screening.screen_dataframe (dataframe.astype (numpy.float32))
+    results = spectral_screening.screen_heights (afile, stations_per_block=3)
+    assert results['names'] == expected['names']
+    numpy.testing.assert_array_equal (results['flags'], expected['flags'])
+    for key in ['amp', 'bands', 'noise', 'variance', 'coverage']:
+        numpy.testing.assert_allclose (results[key], expected[key], rtol=1e-6, atol=1e-9)
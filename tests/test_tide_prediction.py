@@ -0,0 +1,73 @@
+## Vectorized tide prediction (analysis/tide_prediction.py): blocks, the
+## on-disk output and the round trip through the harmonic analysis.
+## Run with: python -m pytest tests
+#########################################################################
+
+#####################################
+## Import packages
+#####################################
+import numpy, pandas, os, sys
+
+testpath = os.path.dirname (os.path.abspath (__file__))
+sys.path.insert (0, os.path.join (testpath, '..', 'analysis'))
+
+from constituents import design_matrix, to_hours
+import tide_prediction, harmonic_analysis
+
+#####################################
+## Define constants
+#####################################
+names = ['M2', 'S2', 'N2', 'K1', 'O1', 'M4']
+stations = ['a', 'b', 'c', 'd', 'e']
+
+#####################################
+## Define functions
+#####################################
+def get_constants (seed=0):
+
+    random = numpy.random.RandomState (seed)
+    amps = pandas.DataFrame (random.uniform (0.01, 0.5, (len (names), len (stations))),
+                             index=names, columns=stations)
+    phases = pandas.DataFrame (random.uniform (0., 360., amps.shape), index=names, columns=stations)
+    means = pandas.Series (random.uniform (-0.1, 0.1, len (stations)), index=stations)
+    return amps, phases, means
+
+def test_predict_matches_design ():
+
+    # A cos (V+u-g) with f: the mean and constituent columns of the design
+    times = pandas.date_range ('2020-01-01', periods=24 * 10 * 5, freq='6min')
+    amps, phases, means = get_constants ()
+    radians = numpy.radians (phases.values)
+    coefs = numpy.vstack ([means.values, amps.values * numpy.cos (radians), amps.values * numpy.sin (radians)])
+    expected = design_matrix (to_hours (times), names).dot (coefs)
+
+    heights = tide_prediction.predict (times, amps, phases, means=means, dtype=float)
+    assert list (heights.columns) == stations and (heights.index == times).all ()
+    numpy.testing.assert_allclose (heights.values, expected, atol=1e-12)
+
+    # Small time and point blocks give the same heights
+    blocks = tide_prediction.predict (times, amps, phases, means=means, dtype=float, tchunk=7, pchunk=2)
+    numpy.testing.assert_allclose (blocks.values, expected, atol=1e-12)
+
+def test_predict_into_memmap (tmp_path):
+
+    times = pandas.date_range ('2020-01-01', periods=500, freq='6min')
+    amps, phases, _ = get_constants ()
+    out = numpy.lib.format.open_memmap (str (tmp_path / 'heights.npy'), mode='w+', dtype=numpy.float32,
+                                        shape=(len (times), len (stations)))
+    tide_prediction.predict (times, amps, phases, out=out, tchunk=64, pchunk=3)
+    out.flush ()
+    numpy.testing.assert_allclose (numpy.load (str (tmp_path / 'heights.npy')),
+                                   tide_prediction.predict (times, amps, phases).values, atol=1e-6)
+
+def test_round_trip_through_harmonic_analysis ():
+
+    times = pandas.date_range ('2020-01-01', periods=24 * 10 * 30, freq='6min')
+    amps, phases, means = get_constants (seed=1)
+    heights = tide_prediction.predict (times, amps, phases, means=means, dtype=float)
+    percents, tables = harmonic_analysis.harmonic_analysis (heights, names=names)
+    for station in stations:
+        table = tables[station].set_index ('tide')
+        numpy.testing.assert_allclose (table.amp.values, amps[station].values, atol=1e-8)
+        numpy.testing.assert_allclose ((table.pha.values - phases[station].values + 180.) % 360. - 180.,
+                                       0., atol=1e-6)